@@ -1,8 +1,15 @@
-import time
 import streamlit as st
 from typing import List, Dict, Tuple, Optional
 from dataclasses import dataclass, field
 import random
+import heapq
+import json
+from dataclasses import replace
+import numpy as np
+from forest import Forest
+from ledger import BonusLedger, build_bonus_ledger
+from profiler import NULL_PROFILER, make_profiler
+from plan import CompiledPlan, APP_DEFINITION, APP_PLAN
 
 # ---------------------------
 # 　元ファイルのロジック（基本部分）　
@@ -27,6 +34,7 @@ class Node:
     binary_number_3: int = 0     
     binary_number_5: int = 0     
     binary_number_7: int = 0     
+    active_children_number: int = 0  # アクティブな直１の人数
 
     def process_bank_number(self, node1: 'Node', node2: 'Node') -> None:
         if not node1 or not node2:
@@ -34,18 +42,19 @@ class Node:
         tree1 = node1.tree_number
         tree2 = node2.tree_number
         if tree1 != tree2:
-            while self.bank_number > 0 and tree2 < tree1:
-                tree2 += 1
-                self.bank_number -= 1
+            used = max(min(self.bank_number, tree1 - tree2), 0)
+            tree2 += used
+            self.bank_number -= used
             diff = min(tree1 - tree2, 2)
             if diff > 0:
                 self.bank_number = min(self.bank_number + diff, 2)
 
     def calculate_binary_numbers(self) -> None:
-        active_children = sorted(
-            [child for child in self.children if child.active],
-            key=lambda x: x.tree_number,
-            reverse=True
+        # 使うのは tree_number の上位8人だけなので、全員はソートしない
+        active_children = heapq.nlargest(
+            8,
+            (child for child in self.children if child.active),
+            key=lambda x: x.tree_number
         )
         if not active_children:
             return
@@ -70,20 +79,19 @@ class Node:
             self.binary_number_7 = (min(node7.tree_number, node8.tree_number) - 1) * 2
             self.process_bank_number(node7, node8)
 
-    def activate(self,active_prop) -> None:
+    def activate(self, active_prop, rng: Optional[random.Random] = None, plan: CompiledPlan = APP_PLAN) -> None:
         _active_prop = (100-active_prop)/100
-        self.active=random.random() > _active_prop
+        self.active = (rng or random).random() > _active_prop
         if self.active:
-            self.paid_point += 20790
-            self.total_paid_point += 20790
+            self.paid_point += plan.activation_fee
+            self.total_paid_point += plan.activation_fee
 
-    def set_position(self, position: int) -> None:
-        # ※ 実際の計算用であれば外部入力により費用設定も変更可能
-        position_costs = {1: 41580, 3: 82060, 5: 122540, 7: 163020}
-        if position in position_costs:
+    def set_position(self, position: int, plan: CompiledPlan = APP_PLAN) -> None:
+        # 費用はplan.position_costs（プランのJSONで変更可能）
+        if position in plan.position_costs:
             self.position_number = position
-            self.paid_point += position_costs[position]
-            self.total_paid_point += position_costs[position]
+            self.paid_point += plan.position_costs[position]
+            self.total_paid_point += plan.position_costs[position]
 
     def calculate_tree_number(self) -> int:
         count = 1
@@ -92,111 +100,45 @@ class Node:
                 count += child.calculate_tree_number()
         return count
 
-    def update_title_rank(self) -> None:
-        tree_size = self.calculate_tree_number()
-        active_children = len([child for child in self.children if child.active])
-        # タイトルランクの条件（これも入力可能に変更可能）
-        rank_conditions = [
-            (20, 2, 1), (60, 3, 2), (200, 4, 3),
-            (600, 5, 4), (1000, 7, 5), (2000, 10, 6),
-            (4000, 10, 7), (6000, 10, 8), (10000, 10, 9),
-            (20000, 10, 10)
-        ]
+    def update_title_rank(self, plan: CompiledPlan = APP_PLAN) -> None:
+        # タイトルランクの条件はplan.rank_conditions（node_class.Nodeと共通）
         self.past_title_rank = self.title_rank
-        self.title_rank = 0
-        for tree_req, children_req, rank in rank_conditions:
-            if tree_size >= tree_req and active_children >= children_req:
-                self.title_rank = rank
-
-    def calculate_riseup_binary_bonus(self, bonus_params: Dict[str, float]) -> int:
-        def calculate_bonus_for_binary(binary_number: int) -> float:
-            # 各段階の定数は bonus_params から取得する
-            if 4 <= binary_number <= 60:
-                return bonus_params["level1"] * binary_number / 4
-            elif 64 <= binary_number <= 200:
-                return bonus_params["level1"] * 15 + bonus_params["level2"] * (binary_number - 60) / 4
-            elif 204 <= binary_number <= 2000:
-                return bonus_params["level1"] * 15 + bonus_params["level2"] * 35 + bonus_params["level3"] * (binary_number - 200) / 4
-            elif 2004 <= binary_number <= 20000:
-                return bonus_params["level1"] * 15 + bonus_params["level2"] * 35 + bonus_params["level3"] * 450 + bonus_params["level4"] * (binary_number - 2000) / 4
-            elif binary_number > 20000:
-                return bonus_params["level1"] * 15 + bonus_params["level2"] * 35 + bonus_params["level3"] * 450 + bonus_params["level4"] * 4500
-            return 0
-        bonus = 0
-        if self.position_number >= 1:
-            bonus += calculate_bonus_for_binary(self.binary_number_1)
-        if self.position_number >= 3:
-            bonus += calculate_bonus_for_binary(self.binary_number_3)
-        if self.position_number >= 5:
-            bonus += calculate_bonus_for_binary(self.binary_number_5)
-        if self.position_number >= 7:
-            bonus += calculate_bonus_for_binary(self.binary_number_7)
-        return int(bonus)
-
-    def calculate_product_free_bonus(self, bonus_pf: Dict[str, int]) -> int:
-        def calculate_bonus_for_binary(binary_number: int) -> int:
-            if binary_number >= 4 and binary_number < 8:
-                return bonus_pf["pf4"]
-            elif binary_number >= 8 and binary_number < 12:
-                return bonus_pf["pf8"]
-            elif binary_number >= 12 and binary_number < 16:
-                return bonus_pf["pf12"]
-            elif binary_number == 16:
-                return bonus_pf["pf16"]
-            else:
-                return 0
-
-        bonus = 0
-        if self.position_number >= 1:
-            bonus += calculate_bonus_for_binary(self.binary_number_1)
-        if self.position_number >= 3:
-            bonus += calculate_bonus_for_binary(self.binary_number_3)
-        if self.position_number >= 5:
-            bonus += calculate_bonus_for_binary(self.binary_number_5)
-        if self.position_number >= 7:
-            bonus += calculate_bonus_for_binary(self.binary_number_7)
-        return bonus
-
-    def calculate_matching_bonus(self, bonus_pf: Dict[str, int], total_paid_points: int) -> int:
-        bonus = 0
-        for child in self.children:
-            if child.active:
-                bonus += child.calculate_riseup_binary_bonus(bonus_pf) * 0.15
-                for grandchild in child.children:
-                    if grandchild.active:
-                        bonus += grandchild.calculate_riseup_binary_bonus(bonus_pf) * 0.05
-                        for great_grandchild in grandchild.children:
-                            if great_grandchild.active:
-                                bonus += great_grandchild.calculate_riseup_binary_bonus(bonus_pf) * 0.05
-        return int(bonus)
-
-    def calculate_car_bonus(self) -> int:
-        if self.title_rank >= 4 and self.past_title_rank >= 4:
-            return 100000
-        return 0
-
-    def calculate_house_bonus(self) -> int:
-        if self.title_rank >= 5 and self.past_title_rank >= 5:
-            return 150000
-        return 0
-
-    def calculate_sharing_bonus(self, total_paid_points: int) -> int:
-        if self.title_rank == 3:
-            return int(total_paid_points * 0.01)
-        elif self.title_rank >= 4:
-            return int(total_paid_points * 0.002)
-        return 0
+        self.title_rank = plan.title_rank(self.tree_number, self.active_children_number)
+
+    # ボーナスの定数・判定方法はplanから取得する（定数を変えるときはapp_planで作る）
+    def calculate_riseup_binary_bonus(self, plan: CompiledPlan = APP_PLAN) -> int:
+        return plan.riseup_bonus_of(self)
+
+    def calculate_product_free_bonus(self, plan: CompiledPlan = APP_PLAN) -> int:
+        # app.pyの規則では、次の境目の手前までは同じ金額（pf4は4～7）
+        return plan.product_free_bonus_of(self)
+
+    def calculate_matching_bonus(self, plan: CompiledPlan = APP_PLAN) -> int:
+        # app.pyの規則では、直１・直２・直３のライズアップボーナスの15%・5%・5%
+        return plan.matching_bonus_of(self)
+
+    def calculate_car_bonus(self, plan: CompiledPlan = APP_PLAN) -> int:
+        return plan.car_bonus_of(self)
+
+    def calculate_house_bonus(self, plan: CompiledPlan = APP_PLAN) -> int:
+        return plan.house_bonus_of(self)
+
+    def calculate_sharing_bonus(self, total_paid_points: int, plan: CompiledPlan = APP_PLAN) -> int:
+        return plan.sharing_bonus_of(self, total_paid_points)
 
 # ---------------------------
 #　ノード作成・ツリー構築用関数（外部入力可能に変更）
 # ---------------------------
-def create_nodes_deterministic(layer_config: List[int], fixed_positions: List[int], active_prop) -> List[Node]:
+def create_nodes_deterministic(layer_config: List[int], fixed_positions: List[int], active_prop,
+                               rng: Optional[random.Random] = None) -> List[Node]:
     """
     ランダムではなく、固定値を用いてノード群を作成する例。
     layer_config: 各層のノード数のリスト 例：[1, 5, 2, …]
     fixed_positions: 各ノード作成時に適用するポジション番号（たとえば [1,3,5,7] のどれか）
                      ※層毎に同じ値とする簡易例です。
+    rng: アクティブかどうかを決める乱数生成器（random.Random）。省略するとrandomモジュールの共通の乱数を使う
     """
+    rng = rng or random
     nodes = []
     node_counter = 1
     layer_nodes = {0: []}
@@ -225,7 +167,7 @@ def create_nodes_deterministic(layer_config: List[int], fixed_positions: List[in
                     name=f"Node_{node_counter}",
                     position_number=pos,
                     parent_node=parent.name,
-                    active=random.random() > _active_prop
+                    active=rng.random() > _active_prop
                 )
                 nodes.append(node)
                 layer_nodes[layer].append(node)
@@ -233,60 +175,90 @@ def create_nodes_deterministic(layer_config: List[int], fixed_positions: List[in
                 node_counter += 1
     return nodes
 
-def build_node_hierarchy(nodes: List[Node]) -> List[Node]:
-    node_dict = {node.name: node for node in nodes}
-    root_nodes = []
-    for node in nodes:
-        if node.parent_node:
-            if node.parent_node in node_dict:
-                parent = node_dict[node.parent_node]
-                if node not in parent.children:
-                    parent.children.append(node)
-        else:
-            root_nodes.append(node)
-    return root_nodes
-
-def update_tree_numbers(node: Node) -> None:
-    node.tree_number = node.calculate_tree_number()
-    for child in node.children:
-        update_tree_numbers(child)
-
-def calculate_all_bonuses(nodes: List[Node],
-                          bonus_rise_params: Dict[str, float],
-                          bonus_pf_params: Dict[str, int]) -> Dict[str, Tuple[int, int]]:
-    total_paid_points = sum(node.paid_point for node in nodes)
-    bonus_summary = {
-        'riseup_binary_bonus': [0, 0],
-        'product_free_bonus': [0, 0],
-        'matching_bonus': [0, 0],
-        'car_bonus': [0, 0],
-        'house_bonus': [0, 0],
-        'sharing_bonus': [0, 0]
-    }
-
-    for node in nodes:
-        if not node.active:
-            continue
-        node.calculate_binary_numbers()
-
-        bonuses = {
-            'riseup_binary_bonus': node.calculate_riseup_binary_bonus(bonus_rise_params),
-            'product_free_bonus': node.calculate_product_free_bonus(bonus_pf_params),
-            'matching_bonus': node.calculate_matching_bonus(bonus_rise_params, total_paid_points),  # 修正箇所
-            'car_bonus': node.calculate_car_bonus(),
-            'house_bonus': node.calculate_house_bonus(),
-            'sharing_bonus': node.calculate_sharing_bonus(total_paid_points)
-        }
+def app_plan(bonus_rise_params: Dict[str, float], bonus_pf_params: Dict[str, int]) -> CompiledPlan:
+    """
+    app.pyの規則（プロダクトフリーは範囲で判定し、マッチングボーナスはライズアップボーナスを上の世代へ足し上げる）で、
+    定数だけを画面の入力値にしたプランを作る。定数がおかしければValueError。
+    """
+    return replace(APP_DEFINITION, riseup_levels=dict(bonus_rise_params), product_free_amounts=dict(bonus_pf_params)).compile()
 
-        for bonus_type, amount in bonuses.items():
-            if amount > 0:
-                bonus_summary[bonus_type][0] += amount
-                bonus_summary[bonus_type][1] += 1
+def calculate_forest_bonuses(forest: Forest, plan: CompiledPlan) -> BonusLedger:
+    return build_bonus_ledger(forest, plan)
 
-        node.bonus_point = sum(bonuses.values())
-        node.total_bonus_point += node.bonus_point
+def activate_members(forest: Forest, active_prop, rng: random.Random, fee: int) -> None:
+    """
+    従来の「全ノードのactivate()→その直１のactivate()」の一括版。
+    乱数は従来と同じ順番（各会員の次にその直１を番号順）で引くので、同じシードなら同じ結果になる。
+    直１は2回抽選されるので、支払い（1回fee円。使っているプランのactivation_fee）も当たった回数分になる。
+    """
+    size = len(forest)
+    members = np.arange(size, dtype=np.int64)
+    children = np.flatnonzero(forest.parent >= 0)
+    owner = np.concatenate([members, forest.parent[children]])
+    is_child = np.concatenate([np.zeros(size, dtype=np.int64), np.ones(len(children), dtype=np.int64)])
+    target = np.concatenate([members, children])
+    target = target[np.lexsort((target, is_child, owner))]
 
-    return bonus_summary
+    _active_prop = (100-active_prop)/100
+    drawn = np.fromiter((rng.random() for _ in range(len(target))), dtype=float, count=len(target)) > _active_prop
+    # アクティブかどうかは最後に引いた結果、支払いは当たった回数分
+    last = np.full(size, -1, dtype=np.int64)
+    np.maximum.at(last, target, np.arange(len(target), dtype=np.int64))
+    paid = np.bincount(target, weights=drawn, minlength=size).astype(np.int64) * fee
+    forest.active = drawn[last]
+    forest.paid_point = forest.paid_point + paid
+    forest.total_paid_point = forest.total_paid_point + paid
+
+@st.cache_data(max_entries=8, show_spinner="ネットワークを作成中・・・")
+def build_season_forests(layer_config: List[int], fixed_positions: List[int], active_prop,
+                         seed: int, num_simulations: int,
+                         activation_fee: int = APP_PLAN.activation_fee) -> List[Forest]:
+    """
+    各シーズンのボーナス計算直前のForestを返す（ボーナスの定数によらない部分だけ）。
+    ネットワークの設定とシードが同じなら、ボーナスの定数を変えてもキャッシュを使い回す。
+    activation_feeはアクティブ化1回の支払い（使うプランのactivation_feeを渡す）。
+    """
+    rng = random.Random(seed)
+    forest = Forest.from_nodes(create_nodes_deterministic(layer_config, fixed_positions, active_prop, rng))
+    # ツリー番号と初期のバイナリー計算
+    forest.compute_tree_numbers()
+    forest.calculate_binary_numbers()
+
+    season_forests = []
+    for _ in range(num_simulations):
+        forest.update_title_ranks(APP_PLAN)
+        # マッチングボーナスで直１以下のバイナリーを使うので、ボーナスの前にもう一度全員分計算する
+        forest.calculate_binary_numbers()
+        # Forestのメソッドは配列を書き換えずに置き換えるので、浅いコピーで今のシーズンの状態を残せる
+        season_forests.append(replace(forest))
+        # 次回シミュレーション用に確率に応じてアクティブ化＆再計算
+        activate_members(forest, active_prop, rng, activation_fee)
+        forest.compute_tree_numbers()
+        forest.calculate_binary_numbers()
+    return season_forests
+
+def calculate_season_bonuses(season_forests: List[Forest],
+                             bonus_rise_params: Dict[str, float],
+                             bonus_pf_params: Dict[str, int],
+                             profiler=NULL_PROFILER) -> List[BonusLedger]:
+    """
+    build_season_forestsの各シーズンのボーナスを計算する。
+    アクティブでない会員のbonus_pointは前のシーズンのまま合計に入るので、シーズンをまたいで引き継ぐ。
+    プランは最初に1回だけ作り、全シーズンで使う。
+    """
+    plan = app_plan(bonus_rise_params, bonus_pf_params)
+    ledgers = []
+    previous = None
+    for season, forest in enumerate(season_forests, start=1):
+        forest = replace(forest)
+        if previous is not None:
+            forest.bonus_point = previous.bonus_point
+            forest.total_bonus_point = previous.total_bonus_point
+        with profiler.stage("bonus_ledger"):
+            ledgers.append(calculate_forest_bonuses(forest, plan))
+        profiler.end_season(season)
+        previous = forest
+    return ledgers
 
 # ---------------------------
 #  Streamlit アプリ本体
@@ -318,12 +290,19 @@ def main():
     # ４．会員がアクティブになる確率（％）,10～100の整数を入力してください。
     active_prop = st.sidebar.number_input("会員がアクティブになる確率（％）",min_value=10,max_value=100,value=90)
 
+    # ５．乱数のシード。同じ値なら同じネットワークになり、ボーナスの定数だけ変えたときは作り直さない
+    seed = st.sidebar.number_input("乱数のシード", min_value=0, value=0, step=1)
+
+    # ６．各段階の時間とメモリを profile_season_<シーズン番号>.json / .csv に書き出すか
+    profile = st.sidebar.checkbox("各段階の時間とメモリを記録する", value=False)
+
     st.sidebar.subheader("ライズアップボーナスの定数設定")
+    # ボーナスは円単位の整数で計算するので、定数も整数で入力する
     bonus_rise_params = {
-        "level1": st.sidebar.number_input("level1 (例: 3000)", value=3000.0),
-        "level2": st.sidebar.number_input("level2 (例: 4000)", value=4000.0),
-        "level3": st.sidebar.number_input("level3 (例: 5000)", value=5000.0),
-        "level4": st.sidebar.number_input("level4 (例: 2000)", value=2000.0),
+        "level1": st.sidebar.number_input("level1 (例: 3000)", value=3000, step=100),
+        "level2": st.sidebar.number_input("level2 (例: 4000)", value=4000, step=100),
+        "level3": st.sidebar.number_input("level3 (例: 5000)", value=5000, step=100),
+        "level4": st.sidebar.number_input("level4 (例: 2000)", value=2000, step=100),
     }
 
     st.sidebar.subheader("プロダクトフリーボーナスの定数設定")
@@ -337,48 +316,37 @@ def main():
     # シミュレーション実行ボタン
     if st.sidebar.button("計算開始"):
         st.write("シミュレーション実行中・・・")
-        # 固定値を用いてノード群を作成（乱数は使わず同じ設定となる）
-        nodes = create_nodes_deterministic(layer_config, fixed_positions, active_prop)
-        # 親子関係の構築
-        root_nodes = build_node_hierarchy(nodes)
-        # ツリー番号を計算する。
-        for root in root_nodes:
-            update_tree_numbers(root)
-        # 初期のバイナリー計算
-        for node in nodes:
-            if node.active:
-                node.calculate_binary_numbers()
+        try:
+            plan = app_plan(bonus_rise_params, bonus_pf_params)
+        except ValueError as e:
+            st.error(f"ボーナスの定数が正しくありません: {e}")
+            return
+        profiler = make_profiler(profile)
+        # ノード作成からツリー番号・バイナリー・タイトルランクまではキャッシュされる（キャッシュが効けば一瞬で終わる）
+        with profiler.stage("build_season_forests"):
+            season_forests = build_season_forests(layer_config, fixed_positions, active_prop, int(seed), int(num_simulations),
+                                                  plan.activation_fee)
         st.write("ノード作成完了")
 
         simulation_results = []
 
-        for sim in range(num_simulations):
+        # ボーナス計算（定数を変えたときはここだけ計算し直す）
+        try:
+            ledgers = calculate_season_bonuses(season_forests, bonus_rise_params, bonus_pf_params, profiler)
+        except ValueError as e:
+            st.error(f"ボーナスの定数が正しくありません: {e}")
+            return
+        finally:
+            profiler.close()
+        for sim, ledger in enumerate(ledgers):
             st.write(f"#### シミュレーション {sim+1} 開始")
-            # タイトルランク更新
-            for node in nodes:
-                node.update_title_rank()
-            # ボーナス計算
-            bonus_summary = calculate_all_bonuses(nodes, bonus_rise_params, bonus_pf_params)
-            total_bonus = sum(node.bonus_point for node in nodes)
+            bonus_summary = ledger.summary
+            total_bonus = ledger.total_bonus
             simulation_results.append((sim+1, bonus_summary, total_bonus))
             st.write("**各ボーナス内訳 [合計金額, 件数]:**")
             st.json(bonus_summary)
             st.write(f"**総ボーナス金額: {total_bonus}**")
-            # 次回シミュレーション用に全ノードを確率に応じてアクティブ化＆再計算
-            for node in nodes:
-                node.activate(active_prop)
-                for child in node.children:
-                    child.activate(active_prop)
-            root_nodes = build_node_hierarchy(nodes)
-            # ツリー番号の更新
-            for root in root_nodes:
-                update_tree_numbers(root)
-            # バイナリーナンバーの更新
-            for node in nodes:
-                if node.active:
-                    node.calculate_binary_numbers()
             st.write(f"シミュレーション {sim+1} 完了")
-            time.sleep(1)
 
         st.write("### 全シミュレーション結果まとめ")
         for sim, bonus_summary, total_bonus in simulation_results:
@@ -387,5 +355,12 @@ def main():
             st.json(bonus_summary)
             st.write(f"総ボーナス金額: {total_bonus}")
 
+        if profile:
+            st.write("### 各段階の時間とメモリ")
+            for season in range(1, len(ledgers) + 1):
+                with open(f"profile_season_{season:04d}.json") as f:
+                    st.write(f"**シミュレーション {season}**")
+                    st.json(json.load(f))
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,59 @@
+import argparse
+import gc
+import time
+import tracemalloc
+from typing import List, Tuple
+
+from node_class import Node
+from member_record import CompactNode
+
+
+def build_members(node_cls, count: int) -> List: #ベンチマーク用の会員を作る関数。5人ずつぶら下がるツリー。
+    """count人の会員を作り、直１のリストもつなぐ"""
+    members = []
+    for i in range(count):
+        member = node_cls(
+            name=f"Node_{i + 1}",
+            position_number=7,
+            parent_node=f"Node_{i // 5}" if i else None,
+            paid_point=20790,
+        )
+        members.append(member)
+        if i:
+            members[(i - 1) // 5].children.append(member)
+    return members
+
+
+def measure(node_cls, count: int) -> Tuple[float, float]:
+    """1人あたりのバイト数と作成時間（秒）を返す"""
+    gc.collect()
+    start = time.perf_counter()
+    members = build_members(node_cls, count)
+    elapsed = time.perf_counter() - start
+    del members
+    gc.collect()
+
+    # tracemallocを有効にすると遅くなるので、メモリは別にもう一回作って測る
+    tracemalloc.start()
+    members = build_members(node_cls, count)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del members
+    gc.collect()
+    return used / count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Node と CompactNode のメモリ使用量と作成時間を比べる")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000], help="会員数")
+    args = parser.parse_args()
+
+    print(f"{'class':<12} {'members':>10} {'bytes/member':>14} {'build [s]':>10}")
+    for count in args.sizes:
+        for node_cls in (Node, CompactNode):
+            per_member, elapsed = measure(node_cls, count)
+            print(f"{node_cls.__name__:<12} {count:>10} {per_member:>14.1f} {elapsed:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from node_class import Node
+from forest import Forest, BINARY_COLUMNS
+from ledger import build_bonus_ledger
+from plan import STANDARD_PLAN
+from tree_engine import build_hierarchy
+from generators import preferential_attachment, galton_watson, sponsor_chains
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+DEEP_CHAINS = 10 #deepの形は、会員数÷DEEP_CHAINS人の一本道をDEEP_CHAINS本
+
+# 形ごとのネットワークの作り方。wide: 直１が一部に集中する浅いツリー、deep: 一本道、balanced: 全員の直１が2人
+SHAPES: Dict[str, Callable[[int, int], Forest]] = {
+    'wide': lambda size, seed: preferential_attachment(size, rng=seed),
+    'deep': lambda size, seed: sponsor_chains(max(size // DEEP_CHAINS, 1), DEEP_CHAINS, rng=seed),
+    'balanced': lambda size, seed: galton_watson((0, 0, 1), size, rng=seed),
+}
+
+
+@dataclass
+class StageResult:
+    """1つの段階の計測結果"""
+    shape: str
+    size: int
+    stage: str
+    seconds: float #実行時間
+    peak_bytes: int #tracemallocで測った、その段階で増えたメモリの最大値
+
+
+@dataclass
+class PipelineState:
+    """段階の間で受け渡す状態"""
+    forest: Forest
+    csv_path: str
+    nodes: Optional[List[Node]] = None
+    loaded: Optional[List[Node]] = None
+    extra: Dict[str, object] = field(default_factory=dict)
+
+
+def _binary(forest: Forest) -> Tuple[np.ndarray, ...]:
+    return tuple(getattr(forest, column) for column in BINARY_COLUMNS)
+
+
+def _to_nodes(state: PipelineState) -> None:
+    state.nodes = state.forest.to_nodes()
+
+
+def _save_csv(state: PipelineState) -> None:
+    Node.save_to_csv(state.nodes, state.csv_path)
+
+
+def _load_csv(state: PipelineState) -> None:
+    state.loaded = Node.load_from_csv(state.csv_path)
+
+
+def _build_hierarchy(state: PipelineState) -> None:
+    # load_from_csvの会員は直１のリストが空なので、main.pyと同じく親子関係を作る
+    build_hierarchy(state.loaded)
+
+
+def _forest_from_csv(state: PipelineState) -> None:
+    state.extra['forest'] = Forest.from_csv(state.csv_path)
+
+
+def _tree_numbers(state: PipelineState) -> None:
+    state.forest.compute_tree_numbers()
+
+
+def _title_ranks(state: PipelineState) -> None:
+    state.forest.update_title_ranks()
+
+
+def _binary_numbers(state: PipelineState) -> None:
+    state.forest.calculate_binary_numbers()
+
+
+def _riseup_bonus(state: PipelineState) -> None:
+    state.extra['riseup'] = STANDARD_PLAN.riseup_bonus(*_binary(state.forest), state.forest.position_number)
+
+
+def _product_free_bonus(state: PipelineState) -> None:
+    state.extra['product_free'] = STANDARD_PLAN.product_free_bonus(*_binary(state.forest), state.forest.position_number)
+
+
+def _matching_bonus(state: PipelineState) -> None:
+    forest = state.forest
+    base = STANDARD_PLAN.product_free_bonus(*_binary(forest), forest.position_number)
+    STANDARD_PLAN.matching_bonus(forest.parent, forest.active, base)
+
+
+def _car_house_bonus(state: PipelineState) -> None:
+    forest = state.forest
+    STANDARD_PLAN.car_bonus(forest.title_rank, forest.past_title_rank)
+    STANDARD_PLAN.house_bonus(forest.title_rank, forest.past_title_rank)
+
+
+def _sharing_bonus(state: PipelineState) -> None:
+    forest = state.forest
+    STANDARD_PLAN.sharing_bonus(forest.title_rank, int(forest.paid_point.sum()))
+
+
+def _bonus_ledger(state: PipelineState) -> None:
+    build_bonus_ledger(state.forest)
+
+
+# main.py / new_cal_bonus.pyの流れの順。後の段階は前の段階の結果を使う
+STAGES: Tuple[Tuple[str, Callable[[PipelineState], None]], ...] = (
+    ('to_nodes', _to_nodes),
+    ('save_csv', _save_csv),
+    ('load_csv', _load_csv),
+    ('build_hierarchy', _build_hierarchy),
+    ('forest_from_csv', _forest_from_csv),
+    ('tree_numbers', _tree_numbers),
+    ('title_ranks', _title_ranks),
+    ('binary_numbers', _binary_numbers),
+    ('riseup_bonus', _riseup_bonus),
+    ('product_free_bonus', _product_free_bonus),
+    ('matching_bonus', _matching_bonus),
+    ('car_house_bonus', _car_house_bonus),
+    ('sharing_bonus', _sharing_bonus),
+    ('bonus_ledger', _bonus_ledger),
+)
+
+
+def measure_stage(stage: Callable[[PipelineState], None], state: PipelineState, repeat: int = 1) -> Tuple[float, int]:
+    """実行時間（repeat回のうち最短）と、その段階で増えたメモリの最大値（バイト）を返す"""
+    elapsed = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        stage(state)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    gc.collect()
+
+    # tracemallocを有効にすると遅くなるので、メモリはもう一回実行して測る
+    tracemalloc.start()
+    stage(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def run_pipeline(shape: str, size: int, seed: int = 0, stages: Optional[Sequence[str]] = None,
+                 repeat: int = 1) -> List[StageResult]: #1つの形と会員数で全段階を測る関数。
+    """SHAPES[shape]のネットワークを作り、STAGESを順に測る（stagesを指定すれば、その段階だけ結果に残す）"""
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        forest = SHAPES[shape](size, seed)
+        results.append(StageResult(shape, size, 'generate', time.perf_counter() - start, 0))
+        state = PipelineState(forest=forest, csv_path=os.path.join(directory, "nodes.csv"))
+        for name, stage in STAGES:
+            elapsed, peak = measure_stage(stage, state, repeat)
+            if stages is None or name in stages:
+                results.append(StageResult(shape, size, name, elapsed, peak))
+            if name == 'build_hierarchy':
+                # Nodeのリストはもう使わないので、後の段階のメモリに含めない
+                state.nodes = state.loaded = None
+    return results
+
+
+def compare_to_baseline(results: Sequence[StageResult], baseline: Sequence[Dict], tolerance: float = 0.25,
+                        min_seconds: float = 0.02) -> List[Dict]: #基準の結果より遅く・大きくなった段階を探す関数。
+    """基準よりtolerance（割合）を超えて遅い・メモリが多い段階を返す
+
+    ごく短い段階のばらつきで引っかからないよう、時間はmin_seconds秒以上増えた場合だけ数える。
+    """
+    reference = {(entry['shape'], entry['size'], entry['stage']): entry for entry in baseline}
+    regressions = []
+    for result in results:
+        base = reference.get((result.shape, result.size, result.stage))
+        if base is None:
+            continue
+        slower = result.seconds > base['seconds'] * (1 + tolerance) and result.seconds - base['seconds'] >= min_seconds
+        larger = result.peak_bytes > base['peak_bytes'] * (1 + tolerance)
+        if slower or larger:
+            regressions.append({
+                **asdict(result),
+                'baseline_seconds': base['seconds'],
+                'baseline_peak_bytes': base['peak_bytes'],
+            })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="main.py / new_cal_bonus.pyの各段階の時間とメモリを、ネットワークの形と会員数ごとに測る")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="会員数")
+    parser.add_argument("--shapes", nargs="+", choices=sorted(SHAPES), default=list(SHAPES), help="ネットワークの形")
+    parser.add_argument("--stages", nargs="+", choices=[name for name, _ in STAGES], default=None, help="結果に残す段階（既定は全部）")
+    parser.add_argument("--seed", type=int, default=0, help="ネットワークを作る乱数のシード")
+    parser.add_argument("--repeat", type=int, default=3, help="時間は何回測って最短を取るか（ばらつきを抑える）")
+    parser.add_argument("--output", default="bench_results.json", help="結果のJSONファイル")
+    parser.add_argument("--baseline", default=None, help="比べる基準の結果のJSONファイル（前回の--outputのファイル）")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="基準よりこの割合を超えて遅い・大きければ悪化とみなす")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'shape':<9} {'members':>9} {'stage':<19} {'time [s]':>9} {'peak [MB]':>10}")
+    for shape in args.shapes:
+        for size in args.sizes:
+            for result in run_pipeline(shape, size, args.seed, args.stages, args.repeat):
+                results.append(result)
+                print(f"{result.shape:<9} {result.size:>9} {result.stage:<19} {result.seconds:>9.3f} {result.peak_bytes / 2**20:>10.1f}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f)['results'], args.tolerance)
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'results': [asdict(result) for result in results],
+        'regressions': regressions,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression['shape']} {regression['size']} {regression['stage']}: "
+              f"{regression['baseline_seconds']:.3f}s -> {regression['seconds']:.3f}s, "
+              f"{regression['baseline_peak_bytes'] / 2**20:.1f}MB -> {regression['peak_bytes'] / 2**20:.1f}MB")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
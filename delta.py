@@ -0,0 +1,224 @@
+import csv
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from forest import Forest, BINARY_COLUMNS
+from kernels import top_legs_of, binary_numbers, settle_bank_numbers, accumulate_up
+from plan import CompiledPlan, STANDARD_PLAN
+
+# join: 新しい会員が加わる, activate: アクティブ化（Node.activateと同じく支払いあり）,
+# deactivate: アクティブでなくなる, position: ポジション数の変更（Node.set_positionと同じく支払いあり）
+EVENT_KINDS = ('join', 'activate', 'deactivate', 'position')
+
+
+@dataclass(frozen=True)
+class MemberEvent:
+    """シーズンの間に起きた会員1人の変化"""
+    kind: str #EVENT_KINDSのどれか
+    name: str
+    parent_node: Optional[str] = None #joinの親（紹介者）の名前。空なら始祖会員
+    position_number: int = 1 #joinとpositionのポジション数
+    active: bool = True #joinした会員がアクティブか
+
+
+@dataclass
+class DeltaResult:
+    """apply_deltaの結果"""
+    joined: int
+    activated: int
+    deactivated: int
+    repositioned: int
+    updated: np.ndarray #tree_numberとタイトルランクを計算し直した会員のインデックス
+    rebinarized: np.ndarray #バイナリーのサイズとbank_numberを計算し直した会員のインデックス
+
+
+def load_delta_csv(filename: str, encoding: Optional[str] = None) -> List[MemberEvent]: #差分ファイルを読み込む関数。
+    """event,name,parent_node,position_number,active の列のCSVを読み、MemberEventのリストを返す"""
+    events = []
+    with open(filename, 'r', newline='', encoding=encoding) as f:
+        for row in csv.DictReader(f):
+            kind = row['event'].strip()
+            if kind not in EVENT_KINDS:
+                raise ValueError(f"unknown event {kind!r} for member {row['name']!r}")
+            position = (row.get('position_number') or '').strip()
+            active = (row.get('active') or '').strip()
+            events.append(MemberEvent(
+                kind=kind,
+                name=row['name'],
+                parent_node=row.get('parent_node') or None,
+                position_number=int(position) if position else 1,
+                active=_parse_active(active, row['name']) if active else True,
+            ))
+    return events
+
+
+def _parse_active(value: str, name: str) -> bool:
+    """member_loaderと同じく大文字小文字を区別せずにtrue/falseを読む（それ以外はValueError）"""
+    lowered = value.lower()
+    if lowered not in ('true', 'false'):
+        raise ValueError(f"active must be True or False, got {value!r} for member {name!r}")
+    return lowered == 'true'
+
+
+def apply_delta(forest: Forest, events: Iterable[MemberEvent], plan: CompiledPlan = STANDARD_PLAN) -> DeltaResult: #差分だけをForestに反映する関数。
+    """会員の参加・アクティブ化・非アクティブ化・ポジション変更を、影響のある所だけ計算し直して反映する
+
+    tree_numberとactive_children_numberは変化した会員から始祖会員までの道筋だけを足し直すので、
+    compute_tree_numbers()をやり直したのと同じ値になる。バイナリーのサイズとbank_numberは、
+    直１のtree_numberが変わった会員・ポジションが変わった会員・アクティブになった会員のうち
+    アクティブな会員だけ計算し直す（calculate_binary_numbers(members=...)と同じ）。
+    タイトルランクはtree_numberか直１の人数が変わった会員だけ判定し直し、past_title_rankはずらさない
+    （シーズンの切り替わりはupdate_title_ranksで行う）。
+    ほかのForestのメソッドと同じく、変わる列は新しい配列に置き換える（前の状態の配列は書き換えない）。
+    """
+    size = len(forest)
+    joined: Dict[str, int] = {}
+    join_names, join_parents, join_positions, join_active = [], [], [], []
+    new_active: Dict[int, bool] = {}
+    positions: Dict[int, int] = {}
+    paid: Dict[int, int] = {}
+    activated = deactivated = 0
+
+    def index_of(name: str) -> int:
+        if name in joined:
+            return joined[name]
+        try:
+            return forest.index_of(name)
+        except KeyError:
+            raise ValueError(f"unknown member {name!r}") from None
+
+    # 1. イベントを順番に読んで、会員ごとの最後の状態と支払いをまとめる（件数は少ないのでPythonで回す）
+    for event in events:
+        if event.kind == 'join':
+            if event.name in joined or _exists(forest, event.name):
+                raise ValueError(f"member {event.name!r} already exists")
+            joined[event.name] = size + len(join_names)
+            join_names.append(event.name)
+            join_parents.append(index_of(event.parent_node) if event.parent_node else -1)
+            join_positions.append(event.position_number)
+            join_active.append(event.active)
+            continue
+        i = index_of(event.name)
+        if event.kind == 'activate':
+            new_active[i] = True
+            paid[i] = paid.get(i, 0) + plan.activation_fee
+            activated += 1
+        elif event.kind == 'deactivate':
+            new_active[i] = False
+            deactivated += 1
+        elif event.kind == 'position':
+            if event.position_number in plan.position_costs:
+                positions[i] = event.position_number
+                paid[i] = paid.get(i, 0) + plan.position_costs[event.position_number]
+        else:
+            raise ValueError(f"unknown event {event.kind!r} for member {event.name!r}")
+
+    # 2. 参加した会員を後ろに追加する。まだ誰もぶら下がっていないので、tree_numberは1
+    if join_names:
+        forest.append_members(
+            join_names, join_parents, np.zeros(len(join_names), dtype=bool),
+            position_number=join_positions, tree_number=np.ones(len(join_names), dtype=np.int64),
+        )
+        for i, active in zip(range(size, len(forest)), join_active):
+            new_active.setdefault(i, active)
+
+    # 3. ポジションと支払いを反映する
+    repositioned = np.fromiter(positions, dtype=np.int64, count=len(positions))
+    if positions:
+        forest.position_number = _replaced(forest.position_number, repositioned,
+                                           np.fromiter(positions.values(), dtype=np.int64, count=len(positions)))
+    if paid:
+        members = np.fromiter(paid, dtype=np.int64, count=len(paid))
+        amounts = np.fromiter(paid.values(), dtype=np.int64, count=len(paid))
+        forest.paid_point = _replaced(forest.paid_point, members, forest.paid_point[members] + amounts)
+        forest.total_paid_point = _replaced(forest.total_paid_point, members, forest.total_paid_point[members] + amounts)
+
+    # 4. アクティブかどうかが変わった会員と、その上の道筋のtree_numberを足し直す
+    changed = np.fromiter((i for i, active in new_active.items() if bool(forest.active[i]) != active), dtype=np.int64)
+    updated = _ancestor_paths(forest.parent, changed)
+    old_contribution = np.where(forest.active[updated], forest.tree_number[updated], 0)
+    forest.active = _replaced(forest.active, changed, ~forest.active[changed])
+    forest.tree_number = _accumulate_paths(forest, updated, old_contribution)
+
+    linked = changed[forest.parent[changed] >= 0]
+    active_children_number = forest.active_children_number.copy()
+    np.add.at(active_children_number, forest.parent[linked], np.where(forest.active[linked], 1, -1))
+    forest.active_children_number = active_children_number
+    contribution_changed = np.where(forest.active[updated], forest.tree_number[updated], 0) != old_contribution
+
+    # 5. 直１のtree_numberが変わった会員などのバイナリーのサイズとbank_numberを計算し直す
+    moved = updated[contribution_changed]
+    rebinarized = np.unique(np.concatenate([forest.parent[moved[forest.parent[moved] >= 0]], repositioned, changed]))
+    rebinarized = rebinarized[forest.active[rebinarized]]
+    _recalculate_binary_numbers(forest, rebinarized)
+
+    # 6. タイトルランクは判定の元（tree_numberと直１の人数）が変わりうる会員だけ判定し直す
+    forest.title_rank = _replaced(forest.title_rank, updated,
+                                  plan.title_ranks(forest.tree_number[updated], forest.active_children_number[updated]))
+
+    return DeltaResult(
+        joined=len(join_names), activated=activated, deactivated=deactivated, repositioned=len(positions),
+        updated=updated, rebinarized=rebinarized,
+    )
+
+
+def apply_delta_csv(forest: Forest, filename: str, encoding: Optional[str] = None,
+                    plan: CompiledPlan = STANDARD_PLAN) -> DeltaResult: #差分ファイルをForestに反映する関数。
+    """load_delta_csvで読んだイベントをapply_deltaで反映する"""
+    return apply_delta(forest, load_delta_csv(filename, encoding), plan)
+
+
+def _exists(forest: Forest, name: str) -> bool:
+    try:
+        forest.index_of(name)
+    except KeyError:
+        return False
+    return True
+
+
+def _ancestor_paths(parent: np.ndarray, members: np.ndarray) -> np.ndarray:
+    """membersと、その始祖会員までの祖先全員のインデックス（重複なし）"""
+    on_path = np.zeros(len(parent), dtype=bool)
+    frontier = np.unique(members)
+    found = []
+    while frontier.size:
+        on_path[frontier] = True
+        found.append(frontier)
+        frontier = parent[frontier]
+        frontier = np.unique(frontier[frontier >= 0])
+        frontier = frontier[~on_path[frontier]]
+    return np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+
+def _replaced(values: np.ndarray, members: np.ndarray, new_values) -> np.ndarray:
+    """valuesのmembersの所だけをnew_valuesにした新しい配列"""
+    values = values.copy()
+    values[members] = new_values
+    return values
+
+
+def _accumulate_paths(forest: Forest, members: np.ndarray, old_contribution: np.ndarray) -> np.ndarray:
+    """members（道筋の会員）のtree_numberを、直１から届く分の増減だけ足し直した新しいtree_numberを返す
+
+    道筋にいない直１のtree_numberは変わらないので、道筋の直１の「上に届く分」の差だけを親に足せばよい。
+    """
+    depth = forest.depth[members]
+    by_depth = np.argsort(depth, kind='stable')
+    bounds = np.searchsorted(depth[by_depth], np.arange(int(depth.max(initial=-1)) + 2))
+    offset = np.zeros(len(forest), dtype=np.int64)
+    offset[members] = old_contribution
+    return accumulate_up(forest.parent, members[by_depth], bounds, forest.tree_number, forest.active, offset)
+
+
+def _recalculate_binary_numbers(forest: Forest, members: np.ndarray) -> None:
+    """calculate_binary_numbersの、members（重複なしの昇順）の分だけを計算する版"""
+    if len(members) == 0:
+        return
+    legs, counts = top_legs_of(members, forest.parent, forest.active, forest.tree_number)
+    values, paired = binary_numbers(legs, counts, forest.position_number[members])
+    for k, column in enumerate(BINARY_COLUMNS):
+        current = getattr(forest, column)
+        setattr(forest, column, _replaced(current, members, np.where(paired[:, k], values[:, k], current[members])))
+    forest.bank_number = _replaced(forest.bank_number, members, settle_bank_numbers(forest.bank_number[members], legs, paired))
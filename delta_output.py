@@ -0,0 +1,163 @@
+import argparse
+import csv
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from forest import INT_COLUMNS
+from ledger import BONUS_TYPES, write_points
+from result_writer import (
+    ResultWriter, SeasonOutput, COMPRESSION_SUFFIXES, NODE_CSV_HEADER,
+    open_compressed, open_result, write_nodes,
+)
+
+DEFAULT_BASE_EVERY = 10 #何シーズンごとに全員分のベースファイルを書くか
+# 差分ファイルの列（先頭は会員のインデックス＝全員分のnodes.csvで何行目か）
+DELTA_CSV_HEADER = ('index', *NODE_CSV_HEADER)
+
+
+def changed_members(previous: SeasonOutput, current: SeasonOutput) -> np.ndarray: #前のシーズンから行が変わった会員を求める関数。
+    """previousとcurrentで、nodes.csvの行のどれかの列が違う会員と、新しく増えた会員のインデックス"""
+    size = len(previous.parent)
+    changed = current.active[:size] != previous.active
+    changed |= current.parent[:size] != previous.parent
+    for column in INT_COLUMNS:
+        changed |= current.columns[column][:size] != previous.columns[column]
+    for bonus_type in BONUS_TYPES:
+        changed |= current.ledger.components[bonus_type][:size] != previous.ledger.components[bonus_type]
+    # 会員は後ろに追加されるだけで減らないので、previousより後ろの会員は全員新しい行
+    return np.concatenate([np.flatnonzero(changed), np.arange(size, len(current.parent))])
+
+
+class DeltaResultWriter(ResultWriter):
+    """ResultWriterの、前のシーズンから変わった行だけを書く版
+
+    base_everyシーズンごと（と、書き始めの最初のシーズン）は全員分の season_<シーズン番号>_nodes.csv を、
+    それ以外のシーズンは前のシーズンから列が変わった会員と新しい会員の行だけの season_<シーズン番号>_nodes_delta.csv を書く。
+    points.csvは小さいので毎シーズン全部書く。どのシーズンの全員分の行もread_season_nodesで作り直せる。
+    同じディレクトリに前の実行（別のbase_everyや圧縮）が書いたそのシーズンのnodesファイルは、書く前に消す。
+    """
+
+    def __init__(self, output_dir: str = ".", compression: str = 'gzip', base_every: int = DEFAULT_BASE_EVERY,
+                 max_pending: int = 2, level: Optional[int] = None):
+        if base_every < 1:
+            raise ValueError("base_every must be at least 1")
+        self.base_every = base_every
+        self._previous: Optional[SeasonOutput] = None #書き出しスレッドだけが触る
+        super().__init__(output_dir, compression, max_pending, level)
+
+    def paths(self, season: int) -> Dict[str, str]:
+        """シーズンseasonのnodes（ベース）、nodes_delta（差分）とpointsのファイル名"""
+        paths = super().paths(season)
+        paths['nodes_delta'] = delta_path(self.output_dir, season, self.suffix)
+        return paths
+
+    def _write(self, output: SeasonOutput) -> None:
+        paths = self.paths(output.season)
+        previous = self._previous
+        # 前のシーズンを書いていない（書き始めか、シーズンが飛んだ）ときもベースにする
+        base = output.season % self.base_every == 0 or previous is None or previous.season != output.season - 1
+        # 残っていると、read_season_nodesが古いベースに今回の差分を当ててしまう。
+        # 書く前に消すので、途中で落ちてもファイルが欠けるだけ（読むときにFileNotFoundErrorになる）
+        remove_season_nodes(self.output_dir, output.season)
+        if base:
+            with open_compressed(paths['nodes'], self.compression, self.level) as f:
+                write_nodes(output, f)
+        else:
+            with open_compressed(paths['nodes_delta'], self.compression, self.level) as f:
+                write_nodes(output, f, changed_members(previous, output))
+        with open_compressed(paths['points'], self.compression, self.level) as f:
+            write_points(output.ledger, f)
+        self._previous = output
+
+
+def base_path(output_dir: str, season: int, suffix: str = '') -> str:
+    return os.path.join(output_dir, f"season_{season:04d}_nodes.csv{suffix}")
+
+
+def delta_path(output_dir: str, season: int, suffix: str = '') -> str:
+    return os.path.join(output_dir, f"season_{season:04d}_nodes_delta.csv{suffix}")
+
+
+def remove_season_nodes(output_dir: str, season: int) -> None:
+    """seasonのベースファイルと差分ファイルを、圧縮の種類（拡張子）を問わず消す"""
+    for path_of in (base_path, delta_path):
+        for suffix in COMPRESSION_SUFFIXES.values():
+            path = path_of(output_dir, season, suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _find(path_of, output_dir: str, season: int) -> Optional[str]:
+    """圧縮の種類（拡張子）を問わず、あるファイルを返す（拡張子違いで2つ以上あればどれが正しいか分からないのでValueError）"""
+    found = [path for path in (path_of(output_dir, season, suffix) for suffix in COMPRESSION_SUFFIXES.values())
+             if os.path.exists(path)]
+    if len(found) > 1:
+        raise ValueError(f"more than one nodes file for season {season}: {', '.join(found)}")
+    return found[0] if found else None
+
+
+def _read_rows(path: str, header: Tuple[str, ...]) -> List[List[str]]:
+    with open_result(path) as f:
+        reader = csv.reader(f)
+        if tuple(next(reader, ())) != header:
+            raise ValueError(f"{path}: unexpected header")
+        return list(reader)
+
+
+def read_season_nodes(output_dir: str, season: int) -> Tuple[Tuple[str, ...], List[List[str]]]: #どのシーズンの全員分の行でも作り直す関数。
+    """seasonより前で一番近いベースファイルに、その次のシーズンからseasonまでの差分ファイルを順に当てて、(見出し, 行のリスト) を返す
+
+    行の並びは全員分を書いたときと同じ（新しい会員は後ろ）。ファイルが欠けていればFileNotFoundError。
+    """
+    base_season = season
+    deltas = []
+    while True:
+        path = _find(base_path, output_dir, base_season)
+        if path is not None:
+            break
+        delta = _find(delta_path, output_dir, base_season)
+        if delta is None:
+            raise FileNotFoundError(f"no base or delta nodes file for season {base_season} in {output_dir}")
+        deltas.append(delta)
+        base_season -= 1
+
+    # 差分の行は先頭のインデックスの行を置き換える（名前は重複することがあるので使わない）。
+    # 会員は後ろに追加されるだけなので、今の行数より後ろのインデックスは新しい会員として足す
+    rows = _read_rows(path, NODE_CSV_HEADER)
+    for delta in reversed(deltas):
+        for index, *row in _read_rows(delta, DELTA_CSV_HEADER):
+            i = int(index)
+            if i < len(rows):
+                rows[i] = row
+            elif i == len(rows):
+                rows.append(row)
+            else:
+                raise ValueError(f"{delta}: row index {i} skips past the {len(rows)} known members")
+    return NODE_CSV_HEADER, rows
+
+
+def rebuild_season_csv(output_dir: str, season: int, filename: str) -> None: #作り直した行を全員分のCSVに書く関数。
+    """read_season_nodesの結果を、DeltaResultWriterを使わずに書いたときと同じnodes.csvとして書き出す"""
+    header, rows = read_season_nodes(output_dir, season)
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベースファイルと差分ファイルから、あるシーズンの全員分のnodes.csvを作り直す")
+    parser.add_argument("season", type=int, help="シーズン番号")
+    parser.add_argument("--dir", default=".", help="結果のファイルがあるディレクトリ")
+    parser.add_argument("--output", default=None, help="書き出すファイル名（既定は season_<シーズン番号>_nodes_full.csv）")
+    args = parser.parse_args()
+
+    filename = args.output or f"season_{args.season:04d}_nodes_full.csv"
+    rebuild_season_csv(args.dir, args.season, filename)
+    print(f"wrote {filename}")
+
+
+if __name__ == "__main__":
+    main()
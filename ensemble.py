@@ -0,0 +1,126 @@
+import argparse
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from forest import Forest
+from ledger import BONUS_TYPES
+from nodes_create import create_random_nodes
+from season_runner import SeasonRunner
+from plan import CompiledPlan, PlanDefinition, STANDARD_DEFINITION, load_plan_definition
+
+DEFAULT_LAYERS = (1, 5, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2) #nodes_create.pyと同じ層の設定
+
+
+@dataclass(frozen=True)
+class EnsembleConfig:
+    """アンサンブルの1つのプラン設定"""
+    layers: Tuple[int, ...] = DEFAULT_LAYERS #各層のノード数（create_random_nodesのnum_layers）
+    seasons: int = 2 #1つのネットワークで何シーズン計算するか（main.pyと同じ2シーズン）
+    plan: PlanDefinition = STANDARD_DEFINITION #報酬プラン。プランごとにEnsembleConfigを作って分布を比べる
+
+
+@dataclass(frozen=True)
+class RunSummary:
+    """1回分（1つのネットワーク）の結果の要約。親プロセスにはこれだけを返す"""
+    run: int #何回目か（0始まり）。同じseedなら同じrunは同じネットワークになる
+    members: int
+    total_paid: int #最後のシーズンのtotal_paid（paid_pointは累計なので、全シーズンに支払われたポイント）
+    total_bonus: int #全シーズンのtotal_bonusの合計
+    bonus_totals: Tuple[int, ...] #BONUS_TYPESの順の、全シーズンの合計金額
+
+    @property
+    def payout_ratio(self) -> float:
+        """支払ったボーナス÷支払われたポイント（ポイントが0ならnan）"""
+        return self.total_bonus / self.total_paid if self.total_paid else math.nan
+
+
+def simulate_run(config: EnsembleConfig, run: int, seed_sequence: np.random.SeedSequence,
+                 plan: Optional[CompiledPlan] = None) -> RunSummary: #1つのネットワークを計算する関数。
+    """ネットワークを1つ作り、nodes_create.py→main.pyと同じ流れで、config.planの規則で計算して要約を返す
+
+    planにconfig.planをcompileしたものを渡せば、作り直さずに使う。
+    """
+    # 他の回とは独立した、再現できる乱数（どのプロセスで計算しても同じ結果になる）
+    rng = random.Random(int(seed_sequence.generate_state(1, np.uint64)[0]))
+    forest = Forest.from_nodes(create_random_nodes(list(config.layers), rng))
+    forest.compute_tree_numbers()
+    forest.calculate_binary_numbers()
+
+    results = SeasonRunner(forest, plan=plan or config.plan.compile()).run(config.seasons)
+    bonus_totals = tuple(sum(result.summary[bonus_type][0] for result in results) for bonus_type in BONUS_TYPES)
+    return RunSummary(
+        run=run,
+        members=len(forest),
+        # paid_pointはシーズンごとに0に戻らないので、足し合わせると前のシーズンの支払いを何度も数えてしまう
+        total_paid=results[-1].total_paid if results else 0,
+        total_bonus=sum(result.total_bonus for result in results),
+        bonus_totals=bonus_totals,
+    )
+
+
+def _simulate_runs(config: EnsembleConfig, runs: Sequence[int], seed_sequences: Sequence[np.random.SeedSequence]) -> List[RunSummary]:
+    """まとめて渡された何回分かを続けて計算する（プロセスプールの中で実行される）"""
+    plan = config.plan.compile() #プランの表はまとめて1回だけ作る
+    return [simulate_run(config, run, seed_sequence, plan) for run, seed_sequence in zip(runs, seed_sequences)]
+
+
+def run_ensemble(config: EnsembleConfig, runs: int, seed: int = 0, workers: Optional[int] = None,
+                 batch_size: int = 8) -> List[RunSummary]: #たくさんのネットワークを並列で計算する関数。
+    """runs個の独立したネットワークをプロセスプールで計算し、runの順に要約を返す
+
+    乱数はSeedSequence(seed)から1回ずつ分けて作るので、workersやbatch_sizeを変えても結果は同じ。
+    workers=1ならプロセスを立ち上げずにこのプロセスで計算する。
+    """
+    config.plan.validate() #プランがおかしければ、プロセスを立ち上げる前にValueErrorを出す
+    seed_sequences = np.random.SeedSequence(seed).spawn(runs)
+    batches = [
+        (range(start, min(start + batch_size, runs)), seed_sequences[start:start + batch_size])
+        for start in range(0, runs, batch_size)
+    ]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return [summary for batch, sequences in batches for summary in _simulate_runs(config, batch, sequences)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_simulate_runs, config, batch, sequences) for batch, sequences in batches]
+        for future in futures:
+            results.extend(future.result())
+    return results
+
+
+def summarize_ensemble(results: Sequence[RunSummary], percentiles: Sequence[float] = (5, 50, 95)) -> Dict[str, float]: #アンサンブルの結果をまとめる関数。
+    """支払い率（ボーナス÷ポイント）の平均と分位点を返す"""
+    ratios = np.array([result.payout_ratio for result in results], dtype=float)
+    ratios = ratios[~np.isnan(ratios)]
+    summary = {'runs': len(results), 'payout_ratio_mean': float(ratios.mean()) if len(ratios) else math.nan}
+    for q in percentiles:
+        summary[f'payout_ratio_p{q:g}'] = float(np.percentile(ratios, q)) if len(ratios) else math.nan
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ランダムなネットワークをたくさん作り、支払い率の分布を調べる")
+    parser.add_argument("--runs", type=int, default=1000, help="ネットワークの数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード（同じなら同じ結果になる）")
+    parser.add_argument("--workers", type=int, default=None, help="プロセス数（既定はCPUの数）")
+    parser.add_argument("--layers", type=int, nargs="+", default=list(DEFAULT_LAYERS), help="各層のノード数")
+    parser.add_argument("--seasons", type=int, default=2, help="1つのネットワークで計算するシーズン数")
+    parser.add_argument("--plan", default=None, help="報酬プランのJSONファイル（python plan.py > plan.json で書き出して編集する）")
+    args = parser.parse_args()
+
+    plan = load_plan_definition(args.plan) if args.plan else STANDARD_DEFINITION
+    config = EnsembleConfig(layers=tuple(args.layers), seasons=args.seasons, plan=plan)
+    results = run_ensemble(config, args.runs, args.seed, args.workers)
+    for key, value in summarize_ensemble(results).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
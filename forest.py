@@ -0,0 +1,272 @@
+from dataclasses import dataclass, field
+from operator import attrgetter
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from node_class import Node
+from member_loader import MemberChunk, iter_members, DEFAULT_CHUNK_SIZE
+from kernels import top_legs, binary_numbers, settle_bank_numbers, accumulate_up
+from plan import CompiledPlan, STANDARD_PLAN
+
+# Nodeの整数フィールドのうち、列（NumPy配列）として持つもの
+INT_COLUMNS = (
+    'position_number', 'bank_number', 'tree_number', 'title_rank', 'past_title_rank',
+    'paid_point', 'bonus_point', 'total_paid_point', 'total_bonus_point',
+    'binary_number_1', 'binary_number_3', 'binary_number_5', 'binary_number_7',
+    'active_children_number',
+)
+BINARY_COLUMNS = ('binary_number_1', 'binary_number_3', 'binary_number_5', 'binary_number_7')
+
+
+def compute_depths(parent: np.ndarray, names: Optional[Sequence[str]] = None) -> np.ndarray: #親インデックス配列から各会員の深さ（始祖会員が0）を計算する関数。
+    """ポインタジャンプで深さを計算（O(N log 深さ)）。親をたどって始祖会員に着かない会員（循環）があればValueError"""
+    depth = (parent >= 0).astype(np.int64)
+    jump = parent.copy()
+    # 1回ごとに飛ぶ段数が倍になるので、深さがN未満ならlog2(N)+1回で全員が始祖会員に着く
+    for _ in range(len(parent).bit_length() + 1):
+        linked = np.flatnonzero(jump >= 0)
+        if linked.size == 0:
+            return depth
+        target = jump[linked]
+        # 古い配列から読み出してから書き込むので、全員が同時に1段ずつ飛ぶ。
+        depth[linked] = depth[linked] + depth[target]
+        jump[linked] = jump[target]
+    looped = np.flatnonzero(jump >= 0)
+    if looped.size == 0:
+        return depth
+    members = [names[i] for i in looped[:10].tolist()] if names is not None else looped[:10].tolist()
+    raise ValueError(f"parent links contain a cycle; {looped.size} members never reach a root, e.g. {members}")
+
+
+@dataclass(eq=False)
+class Forest:
+    """会員群を並列のNumPy配列で持つ列指向の表現。インデックスiが1人の会員に対応する。"""
+    names: Sequence[str] #会員の名前
+    parent: np.ndarray #親（直１から見た紹介者）のインデックス。始祖会員は-1。
+    order: np.ndarray #トポロジカル順（親が必ず子より先に来る）に並べたインデックス
+    depth: np.ndarray #始祖会員からの深さ
+    active: np.ndarray #アクティブか否か（bool）
+    position_number: np.ndarray
+    bank_number: np.ndarray
+    tree_number: np.ndarray
+    title_rank: np.ndarray
+    past_title_rank: np.ndarray
+    paid_point: np.ndarray
+    bonus_point: np.ndarray
+    total_paid_point: np.ndarray
+    total_bonus_point: np.ndarray
+    binary_number_1: np.ndarray
+    binary_number_3: np.ndarray
+    binary_number_5: np.ndarray
+    binary_number_7: np.ndarray
+    active_children_number: np.ndarray
+    # ファイルに書いてあったparent_nodeが見つからず始祖会員扱いにした会員の、元のparent_node（インデックス→名前）。
+    # to_nodesや結果のCSVでは、このparent_nodeをそのまま書き戻す。
+    unresolved_parents: Dict[int, str] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self._index: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    @classmethod
+    def from_arrays(cls, names: Sequence[str], parent, active=None, depth=None,
+                    unresolved_parents: Optional[Dict[int, str]] = None, **columns) -> 'Forest': #配列から直接作るメソッド。
+        """親インデックス配列と列から作成（指定しなかった列は0）。深さが分かっていればdepthに渡すと計算を省く"""
+        parent = np.asarray(parent, dtype=np.int64)
+        size = len(parent)
+        if len(names) != size:
+            raise ValueError("names and parent must have the same length")
+        if active is None:
+            active = np.ones(size, dtype=bool)
+        unknown = set(columns) - set(INT_COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown columns: {sorted(unknown)}")
+        values = {}
+        for column in INT_COLUMNS:
+            if column in columns:
+                values[column] = np.asarray(columns[column], dtype=np.int64).copy()
+            else:
+                values[column] = np.zeros(size, dtype=np.int64)
+        depth = compute_depths(parent, names) if depth is None else np.asarray(depth, dtype=np.int64)
+        order = np.argsort(depth, kind='stable')
+        return cls(
+            names=names, parent=parent, order=order, depth=depth,
+            active=np.asarray(active, dtype=bool).copy(), **values,
+            unresolved_parents=dict(unresolved_parents or {}),
+        )
+
+    @classmethod
+    def from_nodes(cls, nodes: List[Node]) -> 'Forest': #Nodeのリストから作るメソッド。
+        """Nodeのリストを列に変換（parent_nodeが見つからない会員は始祖会員扱いにし、元のparent_nodeはunresolved_parentsに残す）"""
+        names = [node.name for node in nodes]
+        index = {name: i for i, name in enumerate(names)}
+        parent = [index.get(node.parent_node, -1) if node.parent_node else -1 for node in nodes]
+        unresolved = {i: node.parent_node for i, (node, p) in enumerate(zip(nodes, parent)) if p < 0 and node.parent_node}
+        active = [node.active for node in nodes]
+        # 1会員ずつgetattrするより、attrgetterで行ごとにまとめて取り出して2次元配列にする方が速い。
+        table = np.array(list(map(attrgetter(*INT_COLUMNS), nodes)), dtype=np.int64).reshape(len(nodes), len(INT_COLUMNS))
+        columns = {column: table[:, j] for j, column in enumerate(INT_COLUMNS)}
+        return cls.from_arrays(names, parent, active, unresolved_parents=unresolved, **columns)
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[MemberChunk]) -> 'Forest': #member_loaderのチャンクから作るメソッド。
+        """MemberChunkを順につないで作成（parent_nodeが見つからない会員はfrom_nodesと同じく始祖会員扱い）"""
+        names = []
+        parent_nodes = []
+        active = []
+        columns = {column: [] for column in INT_COLUMNS if column != 'active_children_number'}
+        for chunk in chunks:
+            names.extend(chunk.names)
+            parent_nodes.extend(chunk.parent_nodes)
+            active.append(chunk.active)
+            for column, values in columns.items():
+                values.append(chunk.columns[column])
+        index = {name: i for i, name in enumerate(names)}
+        parent = [index.get(parent_node, -1) if parent_node else -1 for parent_node in parent_nodes]
+        unresolved = {i: parent_node for i, (parent_node, p) in enumerate(zip(parent_nodes, parent)) if p < 0 and parent_node}
+        active = np.concatenate(active) if active else np.zeros(0, dtype=bool)
+        columns = {column: np.concatenate(values) if values else np.zeros(0, dtype=np.int64) for column, values in columns.items()}
+        return cls.from_arrays(names, parent, active, unresolved_parents=unresolved, **columns)
+
+    @classmethod
+    def from_csv(cls, filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: Optional[int] = None) -> 'Forest': #会員ファイルからNodeを作らずに直接作るメソッド。
+        """会員ファイルを読んで作成。workersを指定すれば複数プロセスでパースする"""
+        return cls.from_chunks(iter_members(filename, chunk_size, workers))
+
+    def to_nodes(self, node_cls=Node) -> List[Node]: #Nodeのリストに戻すメソッド。直１のリストも作る。
+        """列からNodeのリストを作成し、親子関係もつなぐ"""
+        names = self.names
+        parent = self.parent.tolist()
+        active = self.active.tolist()
+        columns = {column: getattr(self, column).tolist() for column in INT_COLUMNS}
+        unresolved = self.unresolved_parents
+        nodes = []
+        for i in range(len(parent)):
+            nodes.append(node_cls(
+                name=names[i],
+                active=active[i],
+                parent_node=names[parent[i]] if parent[i] >= 0 else unresolved.get(i),
+                **{column: values[i] for column, values in columns.items()}
+            ))
+        for node, p in zip(nodes, parent):
+            if p >= 0:
+                nodes[p].children.append(node)
+        return nodes
+
+    def update_nodes(self, nodes: List[Node]) -> None: #計算結果を既存のNodeに書き戻すメソッド。
+        """列の値をfrom_nodesに渡したのと同じ並びのNodeに書き戻す"""
+        if len(nodes) != len(self):
+            raise ValueError("nodes must be in the same order as the forest")
+        for node, value in zip(nodes, self.active.tolist()):
+            node.active = value
+        for column in INT_COLUMNS:
+            for node, value in zip(nodes, getattr(self, column).tolist()):
+                setattr(node, column, value)
+
+    def append_members(self, names: Sequence[str], parent, active=None, **columns) -> np.ndarray: #会員を後ろに追加するメソッド。
+        """会員を末尾に追加し、追加した会員のインデックスを返す
+
+        parentは追加後のインデックスで、既存の会員か、同じ呼び出しで先に並んでいる会員を指す（始祖会員は-1）。
+        tree_numberなどの集計は更新しないので、必要なら呼び出し側で計算する。
+        """
+        start = len(self)
+        parent = np.asarray(parent, dtype=np.int64).reshape(-1)
+        count = len(parent)
+        if len(names) != count:
+            raise ValueError("names and parent must have the same length")
+        added = np.arange(start, start + count, dtype=np.int64)
+        if np.any(parent >= added):
+            raise ValueError("parents must come before their children")
+        unknown = set(columns) - set(INT_COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown columns: {sorted(unknown)}")
+        if active is None:
+            active = np.ones(count, dtype=bool)
+
+        depth = []
+        old_depth = self.depth
+        for p in parent.tolist():
+            depth.append(0 if p < 0 else (int(old_depth[p]) if p < start else depth[p - start]) + 1)
+        depth = np.asarray(depth, dtype=np.int64)
+        # 同じ深さの既存の会員の後ろに、深さ順に差し込めば、orderは深さ順（同じ深さはインデックス順）のまま
+        by_depth = np.argsort(depth, kind='stable')
+        level_ends = np.cumsum(np.bincount(old_depth, minlength=int(depth.max(initial=0)) + 1))
+        positions = level_ends[depth[by_depth]]
+        self.order = np.insert(self.order, positions, added[by_depth])
+        self.depth = np.concatenate([old_depth, depth])
+        self.parent = np.concatenate([self.parent, parent])
+        self.active = np.concatenate([self.active, np.asarray(active, dtype=bool).reshape(-1)])
+        for column in INT_COLUMNS:
+            values = np.asarray(columns[column], dtype=np.int64).reshape(-1) if column in columns else np.zeros(count, dtype=np.int64)
+            setattr(self, column, np.concatenate([getattr(self, column), values]))
+
+        # namesは他のForest（浅いコピー）と共有していることがあるので、書き足さずに作り直す
+        self.names = [*self.names, *names]
+        if self._index is not None and len(self._index) == start:
+            self._index.update((name, i) for i, name in enumerate(names, start))
+        return added
+
+    def index_of(self, name: str) -> int:
+        """名前から会員のインデックスを返す"""
+        if self._index is None or len(self._index) != len(self):
+            self._index = {n: i for i, n in enumerate(self.names)}
+        return self._index[name]
+
+    def roots(self) -> np.ndarray:
+        """始祖会員のインデックス"""
+        return np.flatnonzero(self.parent < 0)
+
+    def level_bounds(self) -> np.ndarray:
+        """order上で深さdの会員が並ぶ範囲 [bounds[d], bounds[d+1]) を返す"""
+        max_depth = int(self.depth.max()) if len(self) else -1
+        return np.searchsorted(self.depth[self.order], np.arange(max_depth + 2))
+
+    def accumulate_up(self, values: np.ndarray, through: np.ndarray) -> np.ndarray: #下から上に値を足し上げるメソッド。
+        """result[i] = values[i] + (throughがTrueの直１のresult)の合計、を全員分計算"""
+        return accumulate_up(self.parent, self.order, self.level_bounds(), values, through)
+
+    def compute_tree_numbers(self) -> None: #tree_numberとアクティブな直１の人数を配列で計算する。
+        """tree_numberとactive_children_numberを全員分更新"""
+        self.tree_number = self.accumulate_up(np.ones(len(self), dtype=np.int64), self.active)
+        counted = self.active & (self.parent >= 0)
+        self.active_children_number = np.bincount(self.parent[counted], minlength=len(self)).astype(np.int64)
+
+    def arrange_trees(self) -> None: #main.pyの「各ルートノードからツリーを構築」の一括版。
+        """始祖会員全員のarrange_tree()をまとめて行う（arrange_treeは直１以下にはたどらない）
+
+        arrange_treeの列は直１が1人ずつなので、列がそろう始祖会員（アクティブで、ポジション数に足りる直１がいる）の
+        bank_numberが最大2に切り詰められるだけになる。
+        """
+        required = np.select(
+            [self.position_number == position for position in (1, 3, 5, 7)], [2, 4, 6, 8],
+            default=np.iinfo(np.int64).max,
+        )
+        arranged = (self.parent < 0) & self.active & (self.active_children_number >= required)
+        self.bank_number = np.where(arranged, np.minimum(self.bank_number, 2), self.bank_number)
+
+    def update_title_ranks(self, plan: CompiledPlan = STANDARD_PLAN) -> None: #全員のタイトルランクを配列でまとめて更新する。
+        """今のtitle_rankをpast_title_rankへずらしてから、tree_numberと直１の人数でランクを判定（条件はplanのもの）"""
+        self.past_title_rank = self.title_rank
+        self.title_rank = plan.title_ranks(self.tree_number, self.active_children_number)
+
+    def calculate_binary_numbers(self, members: Optional[np.ndarray] = None) -> None: #全員分のバイナリーのサイズをまとめて計算する。
+        """calculate_binary_numbersの一括版。membersを省略するとアクティブな会員全員が対象"""
+        if members is None:
+            members = self.active
+        legs, counts = top_legs(self.parent, self.active, self.tree_number)
+        values, paired = binary_numbers(legs, counts, self.position_number)
+        paired &= members[:, None]
+        for k, column in enumerate(BINARY_COLUMNS):
+            current = getattr(self, column)
+            setattr(self, column, np.where(paired[:, k], values[:, k], current))
+        self.bank_number = settle_bank_numbers(self.bank_number, legs, paired)
+
+
+def calculate_binary_numbers_batch(nodes: List[Node]) -> None: #Nodeのリストのバイナリーのサイズを配列でまとめて計算する関数。
+    """アクティブな会員全員のcalculate_binary_numbers()をまとめて行い、結果をNodeに書き戻す"""
+    forest = Forest.from_nodes(nodes)
+    forest.calculate_binary_numbers()
+    forest.update_nodes(nodes)
@@ -0,0 +1,117 @@
+from typing import Iterator, Optional, Sequence, Union
+
+import numpy as np
+
+from forest import Forest
+
+POSITIONS = (1, 3, 5, 7) #create_random_nodesと同じく、ポジション数はこの中から等確率で選ぶ
+ACTIVE_PROB = 0.9 #create_random_nodesと同じく、始祖会員以外は90%の確率でアクティブ
+
+RandomState = Union[None, int, np.random.SeedSequence, np.random.Generator]
+
+
+class GeneratedNames(Sequence[str]):
+    """"Node_1", "Node_2", ... を必要な分だけ作る名前のリスト（1,000万人分の文字列を最初に作らない）"""
+
+    def __init__(self, size: int, prefix: str = "Node_", start: int = 1):
+        self._size = size
+        self._prefix = prefix
+        self._start = start
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return f"{self._prefix}{self._start + i}"
+
+    def __iter__(self) -> Iterator[str]:
+        prefix = self._prefix
+        for i in range(self._start, self._start + self._size):
+            yield f"{prefix}{i}"
+
+
+def _build_forest(parent: np.ndarray, rng: np.random.Generator, active_prob: float, prefix: str,
+                  depth: Optional[np.ndarray] = None) -> Forest:
+    """親インデックス配列に、ランダムなポジション数とアクティブ状態をつけてForestにする"""
+    size = len(parent)
+    position_number = rng.choice(np.asarray(POSITIONS, dtype=np.int64), size=size)
+    # 始祖会員はアクティブ
+    active = (rng.random(size) < active_prob) | (parent < 0)
+    return Forest.from_arrays(GeneratedNames(size, prefix), parent, active, depth, position_number=position_number)
+
+
+def preferential_attachment(size: int, roots: int = 1, preferential: float = 0.8,
+                            active_prob: float = ACTIVE_PROB, rng: RandomState = None,
+                            prefix: str = "Node_") -> Forest: #直１の多い会員ほど紹介しやすいネットワークを作る関数。
+    """会員を1人ずつ加え、紹介者を「直１の人数に比例」(確率preferential) か「全員から等確率」で選ぶ
+
+    直１の人数の分布は裾の重い（一部の会員に直１が集中する）形になる。
+    「直１の人数に比例」は、それまでの始祖会員以外から等確率に1人選んでその紹介者を紹介者にすることで実現する。
+    紹介者の紹介者の…とたどる参照を、ポインタジャンプ（参照先の参照先へ同時に飛ぶ）でまとめて解決するので、
+    1人ずつのループはない。
+    """
+    rng = np.random.default_rng(rng)
+    if size < roots:
+        raise ValueError("size must be at least roots")
+    index = np.arange(size, dtype=np.int64)
+    parent = np.full(size, -1, dtype=np.int64)
+    members = index[roots:]
+    # 等確率で選ぶ場合の紹介者（自分より前の会員）
+    direct = (rng.random(len(members)) * members).astype(np.int64)
+    # 直１の人数に比例して選ぶ場合は、自分より前の始祖会員以外の会員を1人選んで、その紹介者をまねる
+    copies = members > roots
+    copies &= rng.random(len(members)) < preferential
+    source = index.copy()
+    source[members[copies]] = roots + (rng.random(int(copies.sum())) * (members[copies] - roots)).astype(np.int64)
+    parent[members] = direct
+
+    # まねる先がまた「まねる」会員なら、その先へ飛ぶ。1回ごとにたどる距離が倍になる
+    pending = np.flatnonzero(source != index)
+    while pending.size:
+        source[pending] = source[source[pending]]
+        pending = pending[source[source[pending]] != source[pending]]
+    parent[members] = parent[source[members]]
+    return _build_forest(parent, rng, active_prob, prefix)
+
+
+def galton_watson(offspring: Sequence[float], max_size: int, roots: int = 1, retries: int = 100,
+                  active_prob: float = ACTIVE_PROB, rng: RandomState = None,
+                  prefix: str = "Node_") -> Forest: #直１の人数が確率分布に従うネットワークを作る関数。
+    """各会員の直１の人数をoffspring（offspring[k]が直１k人の確率）から選ぶ、世代ごとの分岐過程
+
+    会員数がmax_sizeに届いたらそこで止める（最後の世代は途中まで）。
+    max_sizeに届く前に誰も紹介しなくなったら最初から作り直し、retries回続けて届かなければエラーにする。
+    """
+    rng = np.random.default_rng(rng)
+    probabilities = np.asarray(offspring, dtype=float)
+    probabilities = probabilities / probabilities.sum()
+    for _ in range(retries):
+        parents = [np.full(min(roots, max_size), -1, dtype=np.int64)]
+        generation = np.arange(len(parents[0]), dtype=np.int64)
+        size = len(generation)
+        while generation.size and size < max_size:
+            counts = rng.choice(len(probabilities), size=len(generation), p=probabilities)
+            children = np.repeat(generation, counts)[:max_size - size]
+            parents.append(children)
+            generation = np.arange(size, size + len(children), dtype=np.int64)
+            size += len(children)
+        if size == max_size:
+            # 世代ごとに作っているので、何番目の世代かがそのまま深さになる
+            depth = np.repeat(np.arange(len(parents), dtype=np.int64), [len(p) for p in parents])
+            return _build_forest(np.concatenate(parents), rng, active_prob, prefix, depth)
+    raise ValueError(f"the branching process died out before reaching {max_size} members in {retries} tries")
+
+
+def sponsor_chains(length: int, chains: int = 1, active_prob: float = ACTIVE_PROB,
+                   rng: RandomState = None, prefix: str = "Node_") -> Forest: #紹介が一本道につながるネットワークを作る関数。
+    """chains本の、length人が1人ずつ紹介でつながった列（深さの最悪ケースの確認用）"""
+    rng = np.random.default_rng(rng)
+    index = np.arange(length * chains, dtype=np.int64)
+    parent = np.where(index % length == 0, -1, index - 1)
+    return _build_forest(parent, rng, active_prob, prefix, index % length)
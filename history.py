@@ -0,0 +1,205 @@
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from plan import CompiledPlan, STANDARD_PLAN
+from forest import Forest
+from ledger import BonusLedger, BONUS_TYPES
+
+# シーズンごとに会員1人1行で残す列（ボーナスは台帳の内訳）
+MEMBER_COLUMNS = (
+    'active', 'position_number', 'tree_number', 'title_rank', 'past_title_rank',
+    'paid_point', 'bonus_point', 'total_paid_point', 'total_bonus_point',
+) + BONUS_TYPES
+# car_streak / house_streak: そのシーズンまで何シーズン続けてカー（ハウス）ボーナスのランク以上か
+STREAK_COLUMNS = ('car_streak', 'house_streak')
+
+# スキーマを変えたら上げる（古いファイルにはそのまま追記しない）
+SCHEMA_VERSION = 2
+
+# run: main.pyの1回の実行（nodes.csvの状態からシーズン1を計算し直すたびに新しいrunになる）。
+# シーズン番号はrunごとに1から数えるので、別の実行のシーズンが続きのシーズンとして扱われることはない。
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    started_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS members (
+    member_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS member_seasons (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    member_id INTEGER NOT NULL REFERENCES members(member_id),
+    season INTEGER NOT NULL,
+    {', '.join(f'{column} INTEGER NOT NULL' for column in MEMBER_COLUMNS + STREAK_COLUMNS)},
+    PRIMARY KEY (run_id, member_id, season)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS member_seasons_rank ON member_seasons (run_id, season, title_rank);
+CREATE TABLE IF NOT EXISTS season_summaries (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    season INTEGER NOT NULL,
+    members INTEGER NOT NULL,
+    total_paid INTEGER NOT NULL,
+    total_bonus INTEGER NOT NULL,
+    all_seasons_total_paid INTEGER NOT NULL,
+    all_seasons_total_bonus INTEGER NOT NULL,
+    {', '.join(f'{bonus_type}_amount INTEGER NOT NULL, {bonus_type}_count INTEGER NOT NULL' for bonus_type in BONUS_TYPES)},
+    PRIMARY KEY (run_id, season)
+);
+"""
+
+
+def duplicate_names(names) -> List[str]:
+    """2回以上出てくる名前（出てきた順）"""
+    seen, duplicates = set(), {}
+    for name in names:
+        if name in seen:
+            duplicates[name] = None
+        seen.add(name)
+    return list(duplicates)
+
+
+class SeasonHistory:
+    """シーズンごとの会員の台帳とサマリーを追記していくSQLiteの履歴
+
+    記録はrun（1回の計算の流れ）ごとに分かれ、シーズンはrunの中で増える順にしか追加できない（過去のシーズンは書き換えない）。
+    run_idを省略すると新しいrunを始め、指定するとそのrunの続きに追記する（チェックポイントから再開するとき）。
+    会員は名前で区別するので、名前が重複しているとrecord_seasonはValueErrorを出す。
+    """
+
+    def __init__(self, filename: str = "history.sqlite", run_id: Optional[int] = None):
+        self.connection = sqlite3.connect(filename)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        tables = self.connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0]
+        if version != SCHEMA_VERSION and tables:
+            self.connection.close()
+            raise ValueError(f"{filename} uses history schema version {version} (expected {SCHEMA_VERSION}); use a new file")
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            if run_id is None:
+                run_id = self.connection.execute("INSERT INTO runs DEFAULT VALUES").lastrowid
+            elif self.connection.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone() is None:
+                raise ValueError(f"run {run_id} is not in {filename}")
+        self.run_id = run_id
+
+    @classmethod
+    def latest_run(cls, filename: str = "history.sqlite") -> 'SeasonHistory': #最後のrunの続きに追記する履歴を開くメソッド。
+        """最後に始めたrunの続きとして開く（まだrunがなければ新しいrunを始める）"""
+        connection = sqlite3.connect(filename)
+        try:
+            run_id = connection.execute("SELECT MAX(run_id) FROM runs").fetchone()[0]
+        except sqlite3.OperationalError: #まだ表がない
+            run_id = None
+        finally:
+            connection.close()
+        return cls(filename, run_id)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> 'SeasonHistory':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def latest_season(self) -> Optional[int]:
+        """このrunで最後に記録したシーズン番号（まだなければNone）"""
+        return self.connection.execute("SELECT MAX(season) FROM season_summaries WHERE run_id = ?", (self.run_id,)).fetchone()[0]
+
+    def _member_ids(self, names: List[str]) -> np.ndarray:
+        """名前に対応するmember_idを返す（初めて出てきた会員は登録する）"""
+        self.connection.executemany("INSERT OR IGNORE INTO members (name) VALUES (?)", ((name,) for name in names))
+        ids = dict(self.connection.execute("SELECT name, member_id FROM members"))
+        return np.fromiter((ids[name] for name in names), dtype=np.int64, count=len(names))
+
+    def _previous_streaks(self, season: Optional[int], size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """前のシーズンの連続記録をmember_idで引ける配列にする（前のシーズンの分しかメモリに載せない）"""
+        car = np.zeros(size, dtype=np.int64)
+        house = np.zeros(size, dtype=np.int64)
+        if season is None:
+            return car, house
+        rows = self.connection.execute(
+            "SELECT member_id, car_streak, house_streak FROM member_seasons WHERE run_id = ? AND season = ?",
+            (self.run_id, season),
+        )
+        for member_id, car_streak, house_streak in rows:
+            if member_id < size:
+                car[member_id] = car_streak
+                house[member_id] = house_streak
+        return car, house
+
+    def record_season(self, season: int, forest: Forest, ledger: BonusLedger,
+                      plan: CompiledPlan = STANDARD_PLAN) -> None: #1シーズン分をまとめて追記するメソッド。
+        """ボーナス計算後のForestと台帳を1つのトランザクションで追記する（連続記録のランクは台帳を作ったplanのもの）"""
+        latest = self.latest_season()
+        if latest is not None and season <= latest:
+            raise ValueError(f"season {season} is already recorded (latest is {latest}); history is append-only")
+
+        names = list(forest.names)
+        duplicates = duplicate_names(names)
+        if duplicates:
+            raise ValueError(f"duplicate member names cannot be recorded in the history: {', '.join(duplicates[:10])}")
+        with self.connection:
+            member_ids = self._member_ids(names)
+            previous_car, previous_house = self._previous_streaks(latest, int(member_ids.max(initial=0)) + 1)
+            # ランク以上なら前のシーズンの記録に1を足し、下回ったら0に戻す
+            car_streak = np.where(forest.title_rank >= plan.car_rule["rank"], previous_car[member_ids] + 1, 0)
+            house_streak = np.where(forest.title_rank >= plan.house_rule["rank"], previous_house[member_ids] + 1, 0)
+
+            values = {
+                'active': forest.active.astype(np.int64),
+                'car_streak': car_streak,
+                'house_streak': house_streak,
+            }
+            for column in MEMBER_COLUMNS + STREAK_COLUMNS:
+                if column in BONUS_TYPES:
+                    values[column] = ledger.components[column]
+                elif column not in values:
+                    values[column] = getattr(forest, column)
+            columns = [values[column].tolist() for column in MEMBER_COLUMNS + STREAK_COLUMNS]
+            placeholders = ', '.join('?' * (3 + len(columns)))
+            run_id = self.run_id
+            self.connection.executemany(
+                f"INSERT INTO member_seasons (run_id, member_id, season, {', '.join(MEMBER_COLUMNS + STREAK_COLUMNS)}) "
+                f"VALUES ({placeholders})",
+                ((run_id, member_id, season, *row) for member_id, *row in zip(member_ids.tolist(), *columns)),
+            )
+
+            summary = [value for bonus_type in BONUS_TYPES for value in ledger.summary[bonus_type]]
+            self.connection.execute(
+                f"INSERT INTO season_summaries VALUES ({', '.join('?' * (7 + len(summary)))})",
+                (run_id, season, len(names), ledger.total_paid, ledger.total_bonus,
+                 ledger.all_seasons_total_paid, ledger.all_seasons_total_bonus, *summary),
+            )
+
+    def member_history(self, name: str, seasons: int = 12) -> List[Dict[str, int]]: #1人の会員の履歴を調べるメソッド。
+        """このrunでの会員nameの直近seasonsシーズン分の記録を、古い順に返す"""
+        rows = self.connection.execute(
+            "SELECT s.* FROM member_seasons AS s JOIN members AS m USING (member_id) "
+            "WHERE s.run_id = ? AND m.name = ? ORDER BY s.season DESC LIMIT ?",
+            (self.run_id, name, seasons),
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def members_with_rank(self, season: int, min_rank: int) -> List[Tuple[str, int]]: #ランク以上の会員を調べるメソッド。
+        """seasonにタイトルランクがmin_rank以上だった会員の (名前, ランク) を返す"""
+        rows = self.connection.execute(
+            "SELECT m.name, s.title_rank FROM member_seasons AS s JOIN members AS m USING (member_id) "
+            "WHERE s.run_id = ? AND s.season = ? AND s.title_rank >= ? ORDER BY s.title_rank DESC, m.name",
+            (self.run_id, season, min_rank),
+        )
+        return [(name, title_rank) for name, title_rank in rows]
+
+    def season_summary(self, season: int) -> Optional[Dict[str, int]]:
+        """seasonのサマリー（points.csvと同じ内容）"""
+        row = self.connection.execute(
+            "SELECT * FROM season_summaries WHERE run_id = ? AND season = ?", (self.run_id, season)
+        ).fetchone()
+        return dict(row) if row is not None else None
@@ -0,0 +1,259 @@
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from tree_engine import compile_rank_table
+
+# 規則の値（単価や条件表）はplan.PlanDefinitionが持ち、ここの関数は渡された値で計算するだけ
+
+# position_numberがいくつ以上なら、何本目のバイナリーがボーナスの対象になるか
+BINARY_POSITIONS = (1, 3, 5, 7)
+
+
+def as_yen(value) -> int:
+    """金額を円単位の整数に変換（端数があればエラー）"""
+    if float(value) != int(value):
+        raise ValueError(f"bonus amounts must be whole yen: {value}")
+    return int(value)
+
+
+def _riseup_table(levels: Dict[str, float], breakpoints: Sequence[int]) -> Tuple[np.ndarray, ...]:
+    """段階の表を配列に変換（金額は1/4円単位）"""
+    low = np.asarray(breakpoints[:-1], dtype=np.int64)
+    high = np.asarray(breakpoints[1:], dtype=np.int64)
+    rate = np.array([as_yen(levels[f"level{k + 1}"]) for k in range(len(low))], dtype=np.int64)
+    # base[k]はk段階目の手前までの合計、base[-1]は上限額
+    base = np.concatenate(([0], np.cumsum(rate * (high - low))))
+    return low, high, rate, base
+
+
+def riseup_quarters(binary_number: np.ndarray, levels: Dict[str, float],
+                    breakpoints: Sequence[int]) -> np.ndarray:
+    """バイナリー1本分のライズアップボーナスを1/4円単位の整数で返す"""
+    low, high, rate, base = _riseup_table(levels, breakpoints)
+    binary_number = np.asarray(binary_number, dtype=np.int64)
+    tier = np.searchsorted(high, binary_number, side='left')
+    inside = tier < len(high)
+    k = np.minimum(tier, len(high) - 1)
+    value = base[k] + rate[k] * (binary_number - low[k])
+    # 境目の直後（例: 62, 202）は元の計算と同じく0円
+    value = np.where(binary_number >= low[k] + 4, value, 0)
+    return np.where(inside, value, base[-1])
+
+
+def riseup_lookup(levels: Dict[str, float], breakpoints: Sequence[int]) -> np.ndarray:
+    """バイナリーのサイズ→1/4円単位の金額の早見表（最後の要素が上限額）"""
+    return riseup_quarters(np.arange(breakpoints[-1] + 2), levels, breakpoints)
+
+
+def _lookup(table: np.ndarray, binary_number) -> np.ndarray:
+    """早見表を引く。表より大きいサイズは最後の要素、負のサイズは0番目の要素になる"""
+    return table[np.clip(binary_number, 0, len(table) - 1)]
+
+
+def position_total(table: np.ndarray, binary_number_1, binary_number_3, binary_number_5, binary_number_7,
+                   position_number) -> np.ndarray: #対象のバイナリー全部の早見表の値を足す。
+    """position_numberで対象になるバイナリーのサイズそれぞれで早見表tableを引き、合計を返す"""
+    position_number = np.asarray(position_number)
+    total = np.zeros(position_number.shape, dtype=np.int64)
+    for binary_number, position in zip((binary_number_1, binary_number_3, binary_number_5, binary_number_7), BINARY_POSITIONS):
+        total += _lookup(table, binary_number) * (position_number >= position)
+    return total
+
+
+def riseup_total_quarters(binary_number_1, binary_number_3, binary_number_5, binary_number_7, position_number,
+                          levels: Dict[str, float], breakpoints: Sequence[int]) -> np.ndarray:
+    """対象のバイナリー全部のライズアップボーナスの合計を、切り捨てる前の1/4円単位で返す"""
+    return position_total(riseup_lookup(levels, breakpoints), binary_number_1, binary_number_3, binary_number_5,
+                          binary_number_7, position_number)
+
+
+def riseup_bonus(binary_number_1, binary_number_3, binary_number_5, binary_number_7, position_number,
+                 levels: Dict[str, float], breakpoints: Sequence[int]) -> np.ndarray: #全員分のライズアップボーナスを一度に計算する。
+    """calculate_riseup_binary_bonusの一括版（円単位の整数配列を返す）"""
+    # 4本分を足してから切り捨てるので、元のint(合計)と同じ結果になる。
+    return riseup_total_quarters(binary_number_1, binary_number_3, binary_number_5, binary_number_7,
+                                 position_number, levels, breakpoints) // 4
+
+
+def product_free_lookup(amounts: Dict[str, int], exact: bool) -> np.ndarray:
+    """バイナリーのサイズ→金額の早見表を作る"""
+    thresholds = sorted((int(key[2:]), as_yen(value)) for key, value in amounts.items())
+    # 最後の要素（範囲外の大きいサイズ）は0円にしておく
+    table = np.zeros(thresholds[-1][0] + 2, dtype=np.int64)
+    for k, (threshold, amount) in enumerate(thresholds):
+        if exact or k == len(thresholds) - 1:
+            table[threshold] = amount
+        else:
+            # app.py方式: 次の境目の手前までは同じ金額
+            table[threshold:thresholds[k + 1][0]] = amount
+    return table
+
+
+def product_free_bonus(binary_number_1, binary_number_3, binary_number_5, binary_number_7, position_number,
+                       amounts: Dict[str, int], exact: bool = True) -> np.ndarray: #全員分のプロダクトフリーボーナスを一度に計算する。
+    """calculate_product_free_bonusの一括版。exact=Falseならapp.pyの範囲方式で判定する"""
+    return position_total(product_free_lookup(amounts, exact), binary_number_1, binary_number_3, binary_number_5,
+                          binary_number_7, position_number)
+
+
+def matching_bonus(parent: np.ndarray, active: np.ndarray, base: np.ndarray,
+                   rates: Sequence[int]) -> np.ndarray: #全員分のマッチングボーナスを一度に計算する。
+    """各会員のbase（円）をrates（%）で親・祖父母・曽祖父母…に足し上げる。世代数×O(N)"""
+    size = len(parent)
+    linked = parent >= 0
+    targets = parent[linked]
+    # アクティブな会員の分だけが上に届く
+    carry = np.where(active, base, 0).astype(np.int64)
+    total = np.zeros(size, dtype=np.int64)
+    for rate in rates:
+        reached = np.bincount(targets, weights=carry[linked], minlength=size).astype(np.int64)
+        total += reached * rate
+        # 次の世代へは、間の会員がアクティブな場合だけ届く
+        carry = np.where(active, reached, 0)
+    return total // 100
+
+
+def accumulate_up(parent: np.ndarray, order: np.ndarray, bounds: np.ndarray, values: np.ndarray,
+                  through: np.ndarray, offset: Optional[np.ndarray] = None) -> np.ndarray: #下から上に値を足し上げる。
+    """result[i] = values[i] + (orderに入っている直１cの (throughなら result[c]) - offset[c]) の合計
+
+    orderは浅い順に並べた会員で、[bounds[d], bounds[d+1]) が同じ深さ。orderの会員の親もorderに入っていること。
+    orderに入っていない会員はvaluesのまま。valuesは書き換えず、新しい配列を返す。
+    """
+    result = np.array(values, dtype=np.int64)
+    if (len(bounds) - 1) * 32 > len(order):
+        # 一本道のような深いツリーは階層ごとのNumPy呼び出しが割高なので、素直にループする
+        members = order[::-1]
+        # 親を、membersの中での番号で表す（始祖会員は-1）
+        slot = np.empty(len(parent), dtype=np.int64)
+        slot[members] = np.arange(len(members))
+        parents = np.where(parent[members] >= 0, slot[np.maximum(parent[members], 0)], -1).tolist()
+        passing = through[members].tolist()
+        totals = result[members].tolist()
+        removed = offset[members].tolist() if offset is not None else [0] * len(members)
+        for k, p in enumerate(parents):
+            if p >= 0:
+                totals[p] += (totals[k] if passing[k] else 0) - removed[k]
+        result[members] = totals
+        return result
+    for d in range(len(bounds) - 2, -1, -1):
+        level = order[bounds[d]:bounds[d + 1]]
+        level = level[parent[level] >= 0]
+        contribution = np.where(through[level], result[level], 0)
+        if offset is not None:
+            contribution -= offset[level]
+        np.add.at(result, parent[level], contribution)
+    return result
+
+
+def compile_rank_lookup(rank_conditions: Sequence[Tuple[int, int, int]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """tree_engine.compile_rank_tableの早見表を、lookup_title_ranks用の配列にする"""
+    children_thresholds, tree_thresholds, table = compile_rank_table(rank_conditions)
+    return (np.asarray(children_thresholds, dtype=np.int64), np.asarray(tree_thresholds, dtype=np.int64),
+            np.asarray(table, dtype=np.int64))
+
+
+def lookup_title_ranks(rank_lookup: Tuple[np.ndarray, np.ndarray, np.ndarray], tree_number: np.ndarray,
+                       active_children_number: np.ndarray) -> np.ndarray: #早見表から全員分のタイトルランクを引く。
+    """compile_rank_lookupの早見表で、tree_numberとアクティブな直１の人数からタイトルランクを返す"""
+    children_thresholds, tree_thresholds, table = rank_lookup
+    row = np.searchsorted(children_thresholds, active_children_number, side='right')
+    column = np.searchsorted(tree_thresholds, tree_number, side='right')
+    return table[row, column]
+
+
+def title_ranks(tree_number: np.ndarray, active_children_number: np.ndarray,
+                rank_conditions: Sequence[Tuple[int, int, int]]) -> np.ndarray: #全員分のタイトルランクを一度に判定する。
+    """tree_numberとアクティブな直１の人数から、条件表どおりのタイトルランクを返す"""
+    return lookup_title_ranks(compile_rank_lookup(rank_conditions), tree_number, active_children_number)
+
+
+def top_legs(parent: np.ndarray, active: np.ndarray, tree_number: np.ndarray, legs: int = 8) -> Tuple[np.ndarray, np.ndarray]: #全員分の直１上位8人をまとめて選ぶ。
+    """各会員のアクティブな直１のtree_numberを大きい順にlegs人分並べた表と、アクティブな直１の人数を返す
+
+    表は (会員数, legs) の配列で、直１が足りない所は0。
+    """
+    size = len(parent)
+    children = np.flatnonzero(active & (parent >= 0))
+    return _leg_table(parent[children], tree_number[children], size, legs)
+
+
+def top_legs_of(members: np.ndarray, parent: np.ndarray, active: np.ndarray, tree_number: np.ndarray,
+                legs: int = 8) -> Tuple[np.ndarray, np.ndarray]: #一部の会員の直１上位8人だけを選ぶ。
+    """top_legsのmembers（重複なしの昇順のインデックス）の行だけを、(len(members), legs) の表で返す"""
+    selected = np.zeros(len(parent), dtype=bool)
+    selected[members] = True
+    children = np.flatnonzero(active & (parent >= 0) & selected[np.maximum(parent, 0)])
+    rows = np.searchsorted(members, parent[children])
+    return _leg_table(rows, tree_number[children], len(members), legs)
+
+
+def _leg_table(owners: np.ndarray, tree: np.ndarray, size: int, legs: int) -> Tuple[np.ndarray, np.ndarray]:
+    """直１の (親の行, tree_number) から、親ごとに大きい順のlegs人分の表と人数を作る"""
+    counts = np.bincount(owners, minlength=size)
+    table = np.zeros((size, legs), dtype=np.int64)
+    if owners.size == 0:
+        return table, counts
+    # (親, tree_numberの大きい順) を1つの整数キーにしてまとめてソートする
+    top = int(tree.max()) + 1
+    keys = np.sort(owners * top + (top - 1 - tree))
+    owners = keys // top
+    values = top - 1 - keys % top
+    # 親ごとの何番目か（0始まり）
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(owners)]))
+    position = np.arange(len(owners)) - group_start
+    keep = position < legs
+    table[owners[keep], position[keep]] = values[keep]
+    return table, counts
+
+
+def binary_numbers(legs: np.ndarray, counts: np.ndarray, position_number: np.ndarray) -> Tuple[np.ndarray, np.ndarray]: #全員分のバイナリーのサイズを計算する。
+    """top_legsの結果から、(binary_number_1, 3, 5, 7)の新しい値とペアが成立したかを返す
+
+    返り値はどちらも (会員数, 4) の配列。成立しなかったペアの値は使わないこと
+    （元のcalculate_binary_numbersは成立しなかったバイナリーの値を変えない）。
+    """
+    paired = np.stack([
+        (position_number >= position) & (counts >= 2 * (k + 1))
+        for k, position in enumerate(BINARY_POSITIONS)
+    ], axis=1)
+    # 大きい順に並んでいるので、ペアの小さい方は2人目
+    values = (legs[:, 1::2] - 1) * 2
+    return values, paired
+
+
+def settle_bank_numbers(bank_number: np.ndarray, legs: np.ndarray, paired: np.ndarray) -> np.ndarray: #全員分のバンクナンバーの処理をまとめて行う。
+    """process_bank_numberをペア1-2, 3-4, 5-6, 7-8の順に、成立したペアだけ適用した後のbank_numberを返す
+
+    前のペアで使った・貯めたバンクが次のペアに影響するので、ペアの順番は守る。
+    1ペアあたりの計算はループなしの式なので、左右の差がいくら大きくても一定の時間で済む。
+    """
+    bank = np.array(bank_number, dtype=np.int64)
+    for k in range(paired.shape[1]):
+        gap = legs[:, 2 * k] - legs[:, 2 * k + 1]
+        # bank_numberを使って小さい方を差の分まで大きくする（成立していないペアは使わない）
+        used = np.where(paired[:, k], np.clip(np.minimum(bank, gap), 0, None), 0)
+        bank -= used
+        # 残った差分をbank_numberに貯蔵（最大2まで）
+        diff = np.minimum(gap - used, 2)
+        stored = paired[:, k] & (diff > 0)
+        bank[stored] = np.minimum(bank[stored] + diff[stored], 2)
+    return bank
+
+
+def rank_pair_bonus(title_rank: np.ndarray, past_title_rank: np.ndarray, rule: Dict[str, int]) -> np.ndarray: #カーボーナスとハウスボーナスの一括版。
+    """今回と前回のタイトルランクが両方rule["rank"]以上の会員にrule["amount"]円を返す"""
+    qualified = (title_rank >= rule["rank"]) & (past_title_rank >= rule["rank"])
+    return np.where(qualified, as_yen(rule["amount"]), 0).astype(np.int64)
+
+
+def sharing_bonus(title_rank: np.ndarray, total_paid_points: int,
+                  sharing_rates: Sequence[Tuple[int, float]]) -> np.ndarray: #シェアリングボーナスの一括版。
+    """タイトルランクごとの割合で、売り上げ合計からのシェアリングボーナスを返す"""
+    bonus = np.zeros(len(title_rank), dtype=np.int64)
+    for rank, share in sharing_rates:
+        # 金額は全員共通なので、calculate_sharing_bonusと同じ式で1回だけ計算する
+        bonus = np.where(title_rank >= rank, int(total_paid_points * share), bonus)
+    return bonus
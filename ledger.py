@@ -0,0 +1,104 @@
+from dataclasses import dataclass, replace
+from typing import Dict, List, TextIO
+
+import numpy as np
+
+from forest import Forest
+# ボーナスの種類はplan.pyで決める（node_class.pyからも使うので、ここでは読み込むだけ）
+from plan import CompiledPlan, STANDARD_PLAN, BONUS_TYPES
+
+
+@dataclass
+class BonusLedger:
+    """1シーズン分のボーナスの台帳。サマリー表示もCSV出力もこれを読むだけで、ボーナスを計算し直さない。"""
+    components: Dict[str, np.ndarray] #ボーナスの種類ごとの、会員ごとの金額（アクティブでない会員は0）
+    summary: Dict[str, List[int]] #ボーナスの種類ごとの [合計金額, 発生件数]
+    total_paid: int #今シーズンのpaid_pointの合計（ボーナスを計算した時点。シェアリングボーナスの元）
+    total_bonus: int #今シーズンのbonus_pointの合計
+    all_seasons_total_paid: int #total_paid_pointの合計
+    all_seasons_total_bonus: int #total_bonus_pointの合計
+
+    def member_bonuses(self, index: int) -> Dict[str, int]:
+        """1人分のボーナスの内訳"""
+        return {bonus_type: int(self.components[bonus_type][index]) for bonus_type in BONUS_TYPES}
+
+    def with_totals_of(self, forest: Forest) -> 'BonusLedger': #書き出す時点の合計に直した台帳を返すメソッド。
+        """合計の4つをforestの今の値（アクティブ化の後）に置き換えた台帳
+
+        total_paidなどはボーナスを計算した時点の値だが、points.csvには元のsave_resultsと同じく、
+        nodes.csvを書く時点（アクティブ化の後）の合計を書く。
+        """
+        return replace(
+            self,
+            total_paid=int(forest.paid_point.sum()),
+            total_bonus=int(forest.bonus_point.sum()),
+            all_seasons_total_paid=int(forest.total_paid_point.sum()),
+            all_seasons_total_bonus=int(forest.total_bonus_point.sum()),
+        )
+
+
+def save_points_csv(ledger: BonusLedger, filename: str) -> None: #ポイントサマリーをCSVに保存する関数。
+    """台帳の合計と種類別の[合計金額, 発生件数]を書き出す"""
+    with open(filename, 'w') as f:
+        write_points(ledger, f)
+
+
+def write_points(ledger: BonusLedger, f: TextIO) -> None: #ポイントサマリーを開いたファイルに書く関数。
+    """save_points_csvと同じ内容をfに書く（result_writerの圧縮したファイルにも使う）"""
+    f.write("metric,amount,count\n")
+    f.write(f"total_paid,{ledger.total_paid},N/A\n")
+
+    # 各ボーナスの詳細を書き出し
+    for bonus_type, (amount, count) in ledger.summary.items():
+        f.write(f"{bonus_type},{amount},{count}\n")
+
+    f.write(f"total_bonus,{ledger.total_bonus},N/A\n")
+    f.write(f"\nall_seasons_total_paid,{ledger.all_seasons_total_paid},N/A\n")
+    f.write(f"all_seasons_total_bonus,{ledger.all_seasons_total_bonus},N/A\n")
+
+
+def build_bonus_ledger(forest: Forest, plan: CompiledPlan = STANDARD_PLAN) -> BonusLedger: #全員のボーナスを1回だけ計算して台帳を作る関数。
+    """バイナリーのサイズとタイトルランクが計算済みのForestから台帳を作り、bonus_pointとtotal_bonus_pointも更新する
+
+    ボーナスの規則はplan（main.pyはplan.STANDARD_PLAN、app.pyはplan.APP_PLANの定数を変えたもの）。
+    """
+    total_paid_points = int(forest.paid_point.sum())
+    amounts = tree_bonus_amounts(forest, plan)
+    amounts['sharing_bonus'] = plan.sharing_bonus(forest.title_rank, total_paid_points)
+    return settle_bonus_ledger(forest, amounts, total_paid_points)
+
+
+def tree_bonus_amounts(forest: Forest, plan: CompiledPlan = STANDARD_PLAN) -> Dict[str, np.ndarray]: #ツリーの中だけで決まるボーナスを計算する関数。
+    """シェアリングボーナス以外の5種類の金額（アクティブかどうかは見ない）。始祖会員のサブツリーごとに計算しても同じになる"""
+    binary = (forest.binary_number_1, forest.binary_number_3, forest.binary_number_5, forest.binary_number_7)
+    amounts = {
+        'riseup_binary_bonus': plan.riseup_bonus(*binary, forest.position_number),
+        'product_free_bonus': plan.product_free_bonus(*binary, forest.position_number),
+    }
+    amounts['matching_bonus'] = plan.matching_bonus(forest.parent, forest.active, amounts[plan.definition.matching_base])
+    amounts['car_bonus'] = plan.car_bonus(forest.title_rank, forest.past_title_rank)
+    amounts['house_bonus'] = plan.house_bonus(forest.title_rank, forest.past_title_rank)
+    return amounts
+
+
+def settle_bonus_ledger(forest: Forest, amounts: Dict[str, np.ndarray], total_paid_points: int) -> BonusLedger: #金額から台帳を作る関数。
+    """BONUS_TYPES全部の金額から台帳を作り、bonus_pointとtotal_bonus_pointを更新する"""
+    active = forest.active
+    # アクティブでない会員はボーナスの対象外（bonus_pointも前のまま）
+    components = {bonus_type: np.where(active, amounts[bonus_type], 0) for bonus_type in BONUS_TYPES}
+    summary = {
+        bonus_type: [int(amount.sum()), int(np.count_nonzero(amount > 0))]
+        for bonus_type, amount in components.items()
+    }
+    bonus = sum(components.values())
+    forest.bonus_point = np.where(active, bonus, forest.bonus_point)
+    forest.total_bonus_point = forest.total_bonus_point + bonus
+
+    return BonusLedger(
+        components=components,
+        summary=summary,
+        total_paid=total_paid_points,
+        total_bonus=int(forest.bonus_point.sum()),
+        all_seasons_total_paid=int(forest.total_paid_point.sum()),
+        all_seasons_total_bonus=int(forest.total_bonus_point.sum()),
+    )
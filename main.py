@@ -1,134 +1,133 @@
-import time
-from typing import List, Dict, Tuple
+import argparse
+from dataclasses import replace
+from typing import List
 from node_class import Node
+from forest import Forest
+from ledger import BonusLedger, build_bonus_ledger, save_points_csv
+from history import SeasonHistory
+from season_runner import SeasonRunner, read_checkpoint
+from profiler import make_profiler
+from plan import CompiledPlan, STANDARD_PLAN, load_plan
+from result_writer import ResultWriter, available_compressions
+from delta_output import DeltaResultWriter
+from tree_engine import build_hierarchy
 
 def build_node_hierarchy(nodes: List[Node]) -> List[Node]: #全会員の親子関係を作る関数。直１と始祖会員を計算する。
     """ノードの親子関係を構築し、ルートノードのリストを返す"""
-    node_dict = {node.name: node for node in nodes}
-    root_nodes = []
+    return build_hierarchy(nodes).roots
 
-    for node in nodes:
-        if node.parent_node:
-            if node.parent_node in node_dict:
-                parent = node_dict[node.parent_node]
-                if node not in parent.children:
-                    parent.children.append(node)
-        else:
-            root_nodes.append(node)
+def calculate_all_bonuses(nodes: List[Node], plan: CompiledPlan = STANDARD_PLAN) -> BonusLedger: #ボーナスを計算する関数。
+    """全ノードのボーナスを1回だけ計算し、会員ごとの内訳・種類別の合計金額と発生件数・合計ポイントの台帳を返す"""
+    forest = Forest.from_nodes(nodes)
 
-    return root_nodes
+    # binary numbersの計算。マッチングボーナスで直１以下のバイナリーを使うので、先に全員分計算しておく。
+    forest.calculate_binary_numbers()
 
-def calculate_all_bonuses(nodes: List[Node]) -> Dict[str, Tuple[int, int]]: #ボーナスを計算する関数。
-    """全ノードのボーナスを計算し、種類別の合計金額と発生件数を返す"""
-    # 全ノードの支払いポイントの合計を計算
-    total_paid_points = sum(node.paid_point for node in nodes)
+    # 6種類のボーナスを全員分まとめて計算し、bonus_pointとtotal_bonus_pointも更新する
+    ledger = build_bonus_ledger(forest, plan)
+    forest.update_nodes(nodes)
+    return ledger
 
-    # ボーナス集計用の辞書を初期化
-    bonus_summary = {
-        'riseup_binary_bonus': [0, 0],  # [合計金額, 発生件数]
-        'product_free_bonus': [0, 0],
-        'matching_bonus': [0, 0],
-        'car_bonus': [0, 0],
-        'house_bonus': [0, 0],
-        'sharing_bonus': [0, 0]
-    }
-
-    for node in nodes:
-        if not node.active:
-            continue
-
-        # binary numbersの計算
-        node.calculate_binary_numbers()
-
-        # 各ボーナスの計算と集計
-        bonuses = {
-            'riseup_binary_bonus': node.calculate_riseup_binary_bonus(),
-            'product_free_bonus': node.calculate_product_free_bonus(),
-            'matching_bonus': node.calculate_matching_bonus(),
-            'car_bonus': node.calculate_car_bonus(),
-            'house_bonus': node.calculate_house_bonus(),
-            'sharing_bonus': node.calculate_sharing_bonus(total_paid_points)
-        }
-
-        # ボーナスの集計
-        for bonus_type, amount in bonuses.items():
-            if amount > 0:
-                bonus_summary[bonus_type][0] += amount  # 金額を加算
-                bonus_summary[bonus_type][1] += 1      # 件数を加算
-
-        # 合計ボーナスの設定
-        node.bonus_point = sum(bonuses.values())
-        node.total_bonus_point += node.bonus_point
-
-    return bonus_summary
-
-def save_results(nodes: List[Node], bonus_summary: Dict[str, Tuple[int, int]], iteration: int) -> None: #CSVに結果を保存する関数。
-    """結果をCSVファイルに保存"""
+def save_results(nodes: List[Node], ledger: BonusLedger, iteration: int) -> None: #CSVに結果を保存する関数。
+    """結果をCSVファイルに保存（ボーナスは台帳の値を書き出すだけで、計算し直さない）"""
     # ノードの状態を保存
-    node_filename = f"{iteration}_nodes.csv"
-    Node.save_to_csv(nodes, node_filename)
-
-    # ポイントサマリーを保存
-    point_filename = f"{iteration}_points.csv"
-    total_paid = sum(node.paid_point for node in nodes)
-    total_bonus = sum(node.bonus_point for node in nodes)
-    total_paid_all = sum(node.total_paid_point for node in nodes)
-    total_bonus_all = sum(node.total_bonus_point for node in nodes)
-
-    with open(point_filename, 'w') as f:
-        f.write("metric,amount,count\n")
-        f.write(f"total_paid,{total_paid},N/A\n")
-        
-        # 各ボーナスの詳細を書き出し
-        for bonus_type, (amount, count) in bonus_summary.items():
-            f.write(f"{bonus_type},{amount},{count}\n")
-        
-        f.write(f"total_bonus,{total_bonus},N/A\n")
-        f.write(f"\nall_seasons_total_paid,{total_paid_all},N/A\n")
-        f.write(f"all_seasons_total_bonus,{total_bonus_all},N/A\n")
+    Node.save_to_csv(nodes, f"{iteration}_nodes.csv", ledger)
+    # ポイントサマリーを保存。合計はnodes.csvと同じく、保存する時点のノードの値
+    ledger = replace(
+        ledger,
+        total_paid=sum(node.paid_point for node in nodes),
+        total_bonus=sum(node.bonus_point for node in nodes),
+        all_seasons_total_paid=sum(node.total_paid_point for node in nodes),
+        all_seasons_total_bonus=sum(node.total_bonus_point for node in nodes),
+    )
+    save_points_csv(ledger, f"{iteration}_points.csv")
 
 def main(): #メインの処理を行う関数。
+    parser = argparse.ArgumentParser(description="nodes.csvを読み込み、シーズンごとのボーナスを計算する")
+    parser.add_argument("--profile", action="store_true",
+                        help="段階ごとの時間・メモリと重いメソッドの呼び出し回数を profile_season_<シーズン番号>.json / .csv に書き出す")
+    parser.add_argument("--plan", default=None,
+                        help="報酬プランのJSONファイル（python plan.py > plan.json で既定のプランを書き出して編集する）")
+    parser.add_argument("--compress", choices=available_compressions(), default=None,
+                        help="シーズンの結果を別スレッドで書き出し、この形式で圧縮する（noneは圧縮しない）。省略すれば今まで通りその場で書く")
+    parser.add_argument("--delta-base-every", type=int, default=None, metavar="N",
+                        help="nodes.csvはNシーズンごとだけ全員分を書き、それ以外は前のシーズンから変わった行だけを書く（python delta_output.py <シーズン番号> で全員分に戻せる）")
+    parser.add_argument("--seasons", type=int, default=2,
+                        help="何シーズン目まで計算するか（--resumeのときは再開したシーズンの続きからここまで）")
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="このディレクトリにチェックポイント（スナップショット）を保存する")
+    parser.add_argument("--checkpoint-every", type=int, default=10, metavar="N",
+                        help="Nシーズンごとにチェックポイントを保存する（最後のシーズンでも必ず保存する）")
+    parser.add_argument("--resume", action="store_true",
+                        help="nodes.csvを読まずに--checkpoint-dirの最後のチェックポイントから再開し、履歴も同じrunの続きに書く")
+    args = parser.parse_args()
+    if args.resume and not args.checkpoint_dir:
+        parser.error("--resume needs --checkpoint-dir")
+    if args.checkpoint_every < 1:
+        parser.error("--checkpoint-every must be at least 1")
+    # タイトルの条件とボーナスの規則。省略すれば既定のプラン
+    plan = load_plan(args.plan) if args.plan else STANDARD_PLAN
+
     # シミュレーションのパラメータ
-    num_simulations = 2  # シミュレーション回数。何シーズン計算するか。今回は２シーズンシュミレーションする。
+    num_simulations = args.seasons  # シミュレーション回数。何シーズン目まで計算するか。既定では２シーズンシュミレーションする。
+    # --profileを付けなければ何もしないプロファイラーになる
+    profiler = make_profiler(args.profile)
+    profiler.count_hot_methods()
 
-    for sim in range(num_simulations):
-        print(f"Starting simulation {sim + 1}")
-        
+    if not args.resume:
         # 1. CSVからノードを読み込む
-        if sim == 0:
+        with profiler.stage("load_csv"):
             nodes = Node.load_from_csv("nodes.csv")
-        else:
-            nodes = Node.load_from_csv(f"{timestamp}_nodes.csv")
-        # 2. ノードの階層構造を構築
-        root_nodes = build_node_hierarchy(nodes)
-        
-        # 3. 各ルートノードから念のためツリーを構築
-        for root in root_nodes:
-            root.arrange_tree()
-            
-        # 4. タイトルランクを更新。
-        for node in nodes:
-            node.update_title_rank()
-            
-        # 5. ボーナスを計算し、サマリーを取得
-        bonus_summary = calculate_all_bonuses(nodes)
-        
-        # 6. 全てのノードをアクティブにする。これにより、２シーズン目以降は全会員がアクティブな状態になる。テスト用。アクティブかどうかは手動で入力するしかない。
-        for node in nodes:
-            node.activate()
-        
-        # 7. アクティブなノードのみバイナリーのサイズを計算する。（更新する）
-        for node in nodes:
-            if not node.active:
-                continue
-            node.calculate_binary_numbers()
-
-        # 8. 結果を保存。csvで出力する。
-        timestamp = int(time.time())
-        save_results(nodes, bonus_summary, timestamp)
-        
-        print(f"Simulation {sim + 1} completed")
-        time.sleep(1)
+        # 2. ノードの階層構造を構築。親が見つからない会員や名前の重複があれば知らせる。
+        with profiler.stage("build_hierarchy"):
+            hierarchy = build_hierarchy(nodes)
+        if hierarchy.orphans:
+            print(f"Warning: {len(hierarchy.orphans)} nodes have an unknown parent_node")
+        if hierarchy.duplicates:
+            # 履歴は会員を名前で区別するので、重複があると同じシーズンに同じ会員が2回記録されてしまう
+            raise SystemExit(f"Error: duplicate node names in nodes.csv: {', '.join(hierarchy.duplicates[:10])}"
+                             " (member names must be unique to record the season history)")
+
+    # 3. シーズンの計算はメモリ上で続けて行う（ファイルを読み直したり待ったりしない）。
+    #    結果はseason_<シーズン番号>_nodes.csv / _points.csvに保存し、台帳とサマリーはSQLiteの履歴に追記する。
+    #    nodes.csvの状態から計算し直すときは、履歴には新しいrunとしてシーズン1から記録する。
+    #    --resumeのときはチェックポイントを保存したときのrunに、その続きのシーズンから記録する。
+    if args.resume:
+        run_id = read_checkpoint(args.checkpoint_dir).get("history_run")
+        history = SeasonHistory("history.sqlite", run_id=run_id) if run_id is not None else SeasonHistory.latest_run("history.sqlite")
+    else:
+        history = SeasonHistory("history.sqlite")
+        with profiler.stage("to_forest"):
+            forest = Forest.from_nodes(nodes)
+    # --compressか--delta-base-everyを付ければ、次のシーズンを計算している間に前のシーズンの結果を書き出す
+    if args.delta_base_every:
+        writer = DeltaResultWriter(".", args.compress or 'none', args.delta_base_every)
+    else:
+        writer = ResultWriter(".", args.compress) if args.compress else None
+    options = dict(output_dir=".", history=history, profiler=profiler, plan=plan, writer=writer,
+                   checkpoint_every=args.checkpoint_every)
+    if args.resume:
+        runner = SeasonRunner.resume(args.checkpoint_dir, **options)
+        print(f"Resuming from season {runner.season}")
+    else:
+        runner = SeasonRunner(forest, checkpoint_dir=args.checkpoint_dir, **options)
+
+    try:
+        while runner.season < num_simulations:
+            sim = runner.season
+            print(f"Starting simulation {sim + 1}")
+            # ツリー番号→ツリー構築→タイトルランク→ボーナス→全員アクティブ化（テスト用）→バイナリーのサイズ→CSV保存
+            runner.run_season()
+            print(f"Simulation {sim + 1} completed")
+        # 最後のシーズンがcheckpoint_everyの倍数でなくても、そこから再開できるようにしておく
+        if args.checkpoint_dir and runner.season % args.checkpoint_every != 0:
+            runner.checkpoint()
+    finally:
+        # 書き出しを待っているシーズンを書き終え、fsyncしてから終わる
+        if writer is not None:
+            writer.close()
+        history.close()
+        profiler.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,178 @@
+import csv
+import io
+import locale
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 会員ファイルから読む整数の列（ボーナスの列は出力専用なので読まない）
+INT_FIELDS = (
+    'position_number', 'bank_number', 'tree_number', 'title_rank', 'past_title_rank',
+    'paid_point', 'bonus_point', 'total_paid_point', 'total_bonus_point',
+    'binary_number_1', 'binary_number_3', 'binary_number_5', 'binary_number_7',
+)
+FIELDS = ('name', 'active', 'parent_node') + INT_FIELDS
+
+DEFAULT_CHUNK_SIZE = 100_000 #1回に読む行数
+DEFAULT_CHUNK_BYTES = 32 * 1024 * 1024 #並列で読むときの1つの範囲のバイト数
+
+
+@dataclass
+class MemberChunk:
+    """会員ファイルの一部（連続した行）を列ごとにまとめたもの"""
+    names: List[str]
+    parent_nodes: List[Optional[str]] #parent_nodeが空ならNone
+    active: np.ndarray #bool
+    columns: Dict[str, np.ndarray] #INT_FIELDSの列（int64）
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def to_nodes(self, node_cls) -> List: #Nodeのリストにするメソッド。親子関係はつながない。
+        """チャンクの行をnode_clsのリストに変換"""
+        nodes = []
+        values = [self.columns[field].tolist() for field in INT_FIELDS]
+        for row in zip(self.names, self.active.tolist(), self.parent_nodes, *values):
+            nodes.append(node_cls(**dict(zip(FIELDS, row))))
+        return nodes
+
+
+def _field_positions(header: Sequence[str]) -> Dict[str, int]:
+    """ヘッダーから各列の位置を調べる"""
+    positions = {name: i for i, name in enumerate(header)}
+    missing = [field for field in FIELDS if field not in positions]
+    if missing:
+        raise ValueError(f"member file is missing columns: {', '.join(missing)}")
+    return positions
+
+
+def _parse_int_column(values: Sequence[str]) -> np.ndarray:
+    """文字列の列をまとめてint64の配列に変換（元のload_from_csvと同じくint()の規則で、読めない値があればValueError）"""
+    # np.arrayに文字列のまま渡す方が、1つずつint()してからnp.fromiterするより速い
+    return np.array(values, dtype=np.int64)
+
+
+def _invalid_int(values: Sequence[str]) -> Optional[int]:
+    """int64として読めない最初の値の位置（なければNone）"""
+    for i, value in enumerate(values):
+        try:
+            np.int64(int(value))
+        except (ValueError, OverflowError):
+            return i
+    return None
+
+
+def _parse_rows(rows: List[List[str]], positions: Dict[str, int], first_line: Optional[int] = None) -> MemberChunk:
+    """csv.readerの行のリストを列にまとめて変換
+
+    整数の列に読めない値があれば、列名・値・会員名（first_lineが分かれば、ファイルの何行目か）を添えてValueErrorを出す。
+    """
+    lines = [k for k, row in enumerate(rows) if row]
+    rows = [rows[k] for k in lines]  # 空行は読み飛ばす（DictReaderと同じ）
+    if not rows:
+        return MemberChunk([], [], np.zeros(0, dtype=bool), {field: np.zeros(0, dtype=np.int64) for field in INT_FIELDS})
+    columns = list(zip(*rows))
+    names = list(columns[positions['name']])
+    parsed = {}
+    for field in INT_FIELDS:
+        values = columns[positions[field]]
+        try:
+            parsed[field] = _parse_int_column(values)
+        except (ValueError, OverflowError):
+            i = _invalid_int(values)
+            if i is None:
+                raise
+            where = f" on line {first_line + lines[i]}" if first_line is not None else ""
+            raise ValueError(f"invalid {field} {values[i]!r} for member {names[i]!r}{where}") from None
+    return MemberChunk(
+        names=names,
+        parent_nodes=[parent or None for parent in columns[positions['parent_node']]],
+        active=np.fromiter((value.lower() == 'true' for value in columns[positions['active']]), dtype=bool, count=len(rows)),
+        columns=parsed,
+    )
+
+
+def iter_member_chunks(filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       encoding: Optional[str] = None) -> Iterator[MemberChunk]: #会員ファイルを少しずつ読む関数。
+    """会員ファイルをchunk_size行ずつ読み、MemberChunkを順に返す（メモリはチャンク1つ分で済む）"""
+    with open(filename, 'r', newline='', encoding=encoding) as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        positions = _field_positions(header)
+        while True:
+            first_line = reader.line_num + 1
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                return
+            yield _parse_rows(rows, positions, first_line)
+
+
+def split_byte_ranges(filename: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                      encoding: Optional[str] = None) -> Tuple[List[str], List[Tuple[int, int]]]: #会員ファイルをバイト範囲に分ける関数。
+    """ヘッダーと、行の途中で切れないように分けた (開始, 終了) のバイト範囲のリストを返す
+
+    行の区切りは改行で探すので、名前などの値に改行を含むファイルには使えない。
+    """
+    size = os.path.getsize(filename)
+    ranges = []
+    with open(filename, 'rb') as f:
+        header_line = f.readline()
+        header = next(csv.reader([header_line.decode(encoding or locale.getpreferredencoding(False))]), [])
+        start = f.tell()
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()  # 次の行の先頭まで進める
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return header, ranges
+
+
+def _parse_range(filename: str, start: int, end: int, header: List[str], encoding: Optional[str]) -> MemberChunk:
+    """バイト範囲[start, end)の行を読む（プロセスプールの中で実行される）"""
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode(encoding or locale.getpreferredencoding(False))
+    return _parse_rows(list(csv.reader(io.StringIO(text, newline=''))), _field_positions(header))
+
+
+def iter_member_chunks_parallel(filename: str, workers: Optional[int] = None,
+                                chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                                encoding: Optional[str] = None) -> Iterator[MemberChunk]: #会員ファイルを複数プロセスで読む関数。
+    """会員ファイルをバイト範囲ごとにプロセスプールでパースし、ファイルの順番どおりにMemberChunkを返す
+
+    先読みはworkers×2範囲までなので、メモリはchunk_bytesに比例した分で済む。
+    """
+    header, ranges = split_byte_ranges(filename, chunk_bytes, encoding)
+    _field_positions(header)  # 列が足りなければ、プロセスを立ち上げる前にエラーにする
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start, end in ranges:
+            pending.append(executor.submit(_parse_range, filename, start, end, header, encoding))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_members(filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: Optional[int] = None,
+                 encoding: Optional[str] = None) -> Iterable[MemberChunk]: #読み方を選んでMemberChunkを返す関数。
+    """workersを指定すれば複数プロセス（範囲はDEFAULT_CHUNK_BYTESごと）、しなければ1プロセスでchunk_size行ずつ読む"""
+    if workers:
+        return iter_member_chunks_parallel(filename, workers, encoding=encoding)
+    return iter_member_chunks(filename, chunk_size, encoding)
+
+
+def iter_node_batches(filename: str, node_cls, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                      workers: Optional[int] = None, encoding: Optional[str] = None) -> Iterator[List]: #Nodeを少しずつ作る関数。
+    """会員ファイルをnode_clsのリストの単位で返す（親子関係はつながない）"""
+    for chunk in iter_members(filename, chunk_size, workers, encoding):
+        yield chunk.to_nodes(node_cls)
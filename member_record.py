@@ -0,0 +1,46 @@
+from dataclasses import dataclass, field
+from typing import Optional, List
+
+from node_class import Node
+
+
+@dataclass(slots=True, eq=False, repr=False)
+class CompactNode:
+    """__slots__で持つ省メモリ版のNode。フィールドとメソッドはnode_class.Nodeと同じ。
+
+    ==は実体（is）で比べ、reprはchildrenをたどらない。大規模な会員数で
+    __dict__のメモリや、childrenを再帰的に比べてしまう事故を避けるために使う。
+    """
+    name: str
+    position_number: int
+    bank_number: int = 0
+    active: bool = True
+    parent_node: Optional[str] = None
+    tree_number: int = 0
+    title_rank: int = 0
+    past_title_rank: int = 0
+    paid_point: int = 0
+    bonus_point: int = 0
+    total_paid_point: int = 0
+    total_bonus_point: int = 0
+    children: List['CompactNode'] = field(default_factory=list)
+    binary_number_1: int = 0
+    binary_number_3: int = 0
+    binary_number_5: int = 0
+    binary_number_7: int = 0
+    active_children_number: int = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"CompactNode(name={self.name!r}, position_number={self.position_number}, "
+            f"active={self.active}, parent_node={self.parent_node!r}, "
+            f"tree_number={self.tree_number}, title_rank={self.title_rank}, "
+            f"children={len(self.children)})"
+        )
+
+
+# ボーナス計算などのメソッドはNodeのものをそのまま使う（同じ関数なので結果も同じになる）
+for _name, _attr in vars(Node).items():
+    if not _name.startswith('__') and (callable(_attr) or isinstance(_attr, classmethod)):
+        setattr(CompactNode, _name, _attr)
+del _name, _attr
@@ -1,8 +1,15 @@
-import time
+import argparse
 import random
 from typing import List, Dict, Tuple, Optional
 from dataclasses import dataclass, field
 import csv
+import heapq
+from forest import Forest, calculate_binary_numbers_batch
+from ledger import BonusLedger, build_bonus_ledger
+from season_runner import SeasonRunner
+from tree_engine import build_hierarchy, compute_tree_numbers
+from profiler import make_profiler
+from plan import CompiledPlan, STANDARD_PLAN, load_plan
 
 @dataclass
 class Node:
@@ -24,6 +31,7 @@ class Node:
     binary_number_3: int = 0 #ポジション３の時の２個目のバイナリーのサイズ。
     binary_number_5: int = 0 #ポジション５の時の３個目のバイナリーのサイズ。
     binary_number_7: int = 0 #ポジション７の時の４個目のバイナリーのサイズ。
+    active_children_number: int = 0 #アクティブな直１の人数。tree_numberと一緒に計算される。
 
     def process_bank_number(self, node1: 'Node', node2: 'Node') -> None: #バンクナンバーを足したり引いたりするメソッド
         """bank_number処理を実行"""
@@ -36,10 +44,10 @@ class Node:
         #tree1とtree2は右側と左側を指しています。
         
         if tree1 != tree2: #右側と左側の数が違うとき、バンクナンバーを使って、バイナリーのサイズを大きくする。
-            # bank_numberを使って tree_number を調整
-            while self.bank_number > 0 and tree2 < tree1: #バンクナンバーが１か２の時に大きさを調整する。
-                tree2 += 1
-                self.bank_number -= 1 #大きさを調整したら、バンクナンバーを１減らす
+            # bank_numberを使って tree_number を調整。1ずつ足す代わりに、使える分をまとめて使う。
+            used = max(min(self.bank_number, tree1 - tree2), 0) #バンクナンバーが１か２の時に大きさを調整する。
+            tree2 += used
+            self.bank_number -= used #大きさを調整した分だけ、バンクナンバーを減らす
                 
             # 差分をbank_numberに貯蔵（最大2まで）
             diff = min(tree1 - tree2, 2) #右側と左側の二つの差を計算し、バンクナンバーに
@@ -48,12 +56,12 @@ class Node:
 
     def calculate_binary_numbers(self) -> None: #ポジション数に応じてバイナリーのサイズを計算する。
         """バイナリーの大きさを計算"""
-        active_children = sorted(
-            [child for child in self.children if child.active],
-            key=lambda x: x.tree_number,
-            reverse=True
+        active_children = heapq.nlargest(
+            8,
+            (child for child in self.children if child.active),
+            key=lambda x: x.tree_number
         )
-        #まずは、直１を会員のtree_number数に応じてソートする。
+        #まずは、直１を会員のtree_number数に応じてソートする。使うのは上位8人だけなので、全員はソートしない。
         if not active_children:
             return
 
@@ -77,19 +85,18 @@ class Node:
             self.binary_number_7 = (min(node7.tree_number, node8.tree_number) - 1) * 2
             self.process_bank_number(node7, node8)
 
-    def activate(self) -> None: #会員をアクティブにするメソッド。定額で20,790円支払うことにしている。支払額は手動入力ですね。
-        """ノードをアクティブ化し、必要なポイントを支払う"""
-        self.paid_point += 20790
-        self.total_paid_point += 20790
+    def activate(self, plan: CompiledPlan = STANDARD_PLAN) -> None: #会員をアクティブにするメソッド。定額で20,790円支払うことにしている。支払額は手動入力ですね。
+        """ノードをアクティブ化し、必要なポイント（plan.activation_fee）を支払う"""
+        self.paid_point += plan.activation_fee
+        self.total_paid_point += plan.activation_fee
         self.active = True
 
-    def set_position(self, position: int) -> None: #ポジション数に応じて、会員が支払っているであろう金額を自動で計算する。まあ本番環境は使わないでしょう。
-        """ポジション番号を設定し、必要なポイントを支払う"""
-        position_costs = {1: 41580, 3: 82060, 5: 122540, 7: 163020}
-        if position in position_costs:
+    def set_position(self, position: int, plan: CompiledPlan = STANDARD_PLAN) -> None: #ポジション数に応じて、会員が支払っているであろう金額を自動で計算する。まあ本番環境は使わないでしょう。
+        """ポジション番号を設定し、必要なポイント（plan.position_costs）を支払う"""
+        if position in plan.position_costs:
             self.position_number = position
-            self.paid_point += position_costs[position]
-            self.total_paid_point += position_costs[position]
+            self.paid_point += plan.position_costs[position]
+            self.total_paid_point += plan.position_costs[position]
 
     def calculate_tree_number(self) -> int: #自分自身以下の会員が何人いるか計算する。tree_numberと名付けている。
         """ツリー内のノード総数を計算"""
@@ -99,111 +106,38 @@ class Node:
                 count += child.calculate_tree_number()
         return count
 
-    def update_title_rank(self) -> None: #タイトルランクを自動で更新するメソッド。現在のランクをpast_title_rankに入れてから、title_rankを更新する。
+    def update_title_rank(self, plan: CompiledPlan = STANDARD_PLAN) -> None: #タイトルランクを自動で更新するメソッド。現在のランクをpast_title_rankに入れてから、title_rankを更新する。
         """タイトルランクを更新"""
-        tree_size = self.calculate_tree_number()
-        active_children = len([child for child in self.children if child.active])
-
-        rank_conditions = [
-            (20, 2, 1), (60, 3, 2), (200, 4, 3),
-            (600, 5, 4), (1000, 7, 5), (2000, 10, 6),
-            (4000, 10, 7), (6000, 10, 8), (10000, 10, 9),
-            (20000, 10, 10)
-        ] #一番右の数字がタイトルランクを示している。左がtree_number、真ん中が直1。タイトルの条件値になっている。
+        # tree_numberとactive_children_numberは事前にcompute_tree_numbersで計算しておくこと。
+        # タイトルの条件値はplan.rank_conditions（tree_number、直1、タイトルランクの表）。
         self.past_title_rank = self.title_rank
-        self.title_rank = 0
-        for tree_req, children_req, rank in rank_conditions:
-            if tree_size >= tree_req and active_children >= children_req:
-                self.title_rank = rank
+        self.title_rank = plan.title_rank(self.tree_number, self.active_children_number)
 
-    def calculate_riseup_binary_bonus(self) -> int: #ライズアップボーナスを計算する。バイナリーナンバーを使います。
+    # ボーナスの計算はnode_class.Nodeと同じく、plan（既定はplan.STANDARD_PLAN）の早見表を引く。
+    def calculate_riseup_binary_bonus(self, plan: CompiledPlan = STANDARD_PLAN) -> int: #ライズアップボーナスを計算する。バイナリーナンバーを使います。
         """更新されたバイナリーボーナスの計算"""
-        def calculate_bonus_for_binary(binary_number: int) -> float:
-            if 4 <= binary_number <= 60:
-                return 3000 * binary_number / 4
-            elif 64 <= binary_number <= 200:
-                return 3000 * 15 + 4000 * (binary_number - 60) / 4
-            elif 204 <= binary_number <= 2000:
-                return 3000 * 15 + 4000 * 35 + 5000 * (binary_number - 200) / 4
-            elif 2004 <= binary_number <= 20000:
-                return 3000 * 15 + 4000 * 35 + 5000 * 450 + 2000 * (binary_number - 2000) / 4
-            elif binary_number > 20000:
-                return 3000 * 15 + 4000 * 35 + 5000 * 450 + 2000 * 4500
-            return 0
-
-        bonus = 0 #ポジション数に応じて計算する。position_numberが増えると何度もボーナスが加算される。
-        if self.position_number >= 1:
-            bonus += calculate_bonus_for_binary(self.binary_number_1)
-        if self.position_number >= 3:
-            bonus += calculate_bonus_for_binary(self.binary_number_3)
-        if self.position_number >= 5:
-            bonus += calculate_bonus_for_binary(self.binary_number_5)
-        if self.position_number >= 7:
-            bonus += calculate_bonus_for_binary(self.binary_number_7)
-            
-        return int(bonus)
+        #ポジション数に応じて計算する。position_numberが増えると何度もボーナスが加算される。
+        return plan.riseup_bonus_of(self)
 
-    def calculate_product_free_bonus(self) -> int: #プロダクトフリーボーナスを計算する。
+    def calculate_product_free_bonus(self, plan: CompiledPlan = STANDARD_PLAN) -> int: #プロダクトフリーボーナスを計算する。
         """更新された製品無料ボーナスの計算"""
-        def calculate_bonus_for_binary(binary_number: int) -> int:
-            if binary_number == 4:
-                return 10000
-            elif binary_number == 8:
-                return 7000
-            elif binary_number == 12:
-                return 4000
-            elif binary_number == 16:
-                return 1000
-            return 0
-
-        bonus = 0 #ポジション数に応じて計算する。position_numberが増えると何度もボーナスが加算される。
-        if self.position_number >= 1:
-            bonus += calculate_bonus_for_binary(self.binary_number_1)
-        if self.position_number >= 3:
-            bonus += calculate_bonus_for_binary(self.binary_number_3)
-        if self.position_number >= 5:
-            bonus += calculate_bonus_for_binary(self.binary_number_5)
-        if self.position_number >= 7:
-            bonus += calculate_bonus_for_binary(self.binary_number_7)
-            
-        return bonus
+        return plan.product_free_bonus_of(self)
 
-    def calculate_matching_bonus(self) -> int: #マッチングボーナスの計算。
-        """マッチングボーナスの計算"""
-        bonus = 0
-        for child in self.children:
-            if child.active:
-                # 子ノードからの15%
-                bonus += child.calculate_product_free_bonus() * 0.15
-                # 孫ノードからの5%
-                for grandchild in child.children:
-                    if grandchild.active:
-                        bonus += grandchild.calculate_product_free_bonus() * 0.05
-                        # ひ孫ノードからの5%
-                        for great_grandchild in grandchild.children:
-                            if great_grandchild.active:
-                                bonus += great_grandchild.calculate_product_free_bonus() * 0.05
-        return int(bonus)
-
-    def calculate_car_bonus(self) -> int: #カーボーナスの計算。title_rankとpast_title_rankを使う。今回は条件を満たしていれば、満額もらえるようにしている。
+    def calculate_matching_bonus(self, plan: CompiledPlan = STANDARD_PLAN) -> int: #マッチングボーナスの計算。
+        """マッチングボーナスの計算（子ノードから15%、孫ノードから5%、ひ孫ノードから5%）"""
+        return plan.matching_bonus_of(self)
+
+    def calculate_car_bonus(self, plan: CompiledPlan = STANDARD_PLAN) -> int: #カーボーナスの計算。title_rankとpast_title_rankを使う。今回は条件を満たしていれば、満額もらえるようにしている。
         """車ボーナスの計算"""
-        if self.title_rank >= 4 and self.past_title_rank >= 4:
-            return 100000
-        return 0
+        return plan.car_bonus_of(self)
 
-    def calculate_house_bonus(self) -> int: #ハウスボーナスの計算。title_rankとpast_title_rankを使う。今回は条件を満たしていれば、満額もらえるようにしている。
+    def calculate_house_bonus(self, plan: CompiledPlan = STANDARD_PLAN) -> int: #ハウスボーナスの計算。title_rankとpast_title_rankを使う。今回は条件を満たしていれば、満額もらえるようにしている。
         """住宅ボーナスの計算"""
-        if self.title_rank >= 5 and self.past_title_rank >= 5:
-            return 150000
-        return 0
+        return plan.house_bonus_of(self)
 
-    def calculate_sharing_bonus(self, total_paid_points: int) -> int: #シェアリングボーナスの計算。
+    def calculate_sharing_bonus(self, total_paid_points: int, plan: CompiledPlan = STANDARD_PLAN) -> int: #シェアリングボーナスの計算。
         """シェアリングボーナスの計算"""
-        if self.title_rank == 3:
-            return int(total_paid_points * 0.01)
-        elif self.title_rank >= 4:
-            return int(total_paid_points * 0.002)
-        return 0
+        return plan.sharing_bonus_of(self, total_paid_points)
 
     def arrange_tree(self) -> None: #ポジション数に応じてバイナリーを作るメソッド。
         """ツリー構造を構築"""
@@ -212,7 +146,7 @@ class Node:
 
         # 子ノードを孫ノード以下の数でソート
         active_children = [child for child in self.children if child.active]
-        active_children.sort(key=lambda x: x.calculate_tree_number(), reverse=True)
+        active_children.sort(key=lambda x: x.tree_number, reverse=True)
 
         # position_numberに応じてツリーを構築
         if self.position_number == 1:
@@ -298,11 +232,13 @@ class Node:
         # 最大2個までbank_numberに加算
         self.bank_number = min(self.bank_number + total_diff, 2)
 
-def create_random_nodes(num_layers: List[int]) -> List[Node]:
+def create_random_nodes(num_layers: List[int], rng: Optional[random.Random] = None) -> List[Node]:
     """
     ランダムなノード群を作成
     num_layers: 各層のノード数のリスト [第1層のノード数, 第2層の各ノードの子ノード数, ...]
+    rng: 乱数生成器（random.Random）。省略するとrandomモジュールの共通の乱数を使う
     """
+    rng = rng or random
     nodes = []
     node_counter = 1
     layer_nodes: Dict[int, List[Node]] = {0: []}  # 各層のノードを保持
@@ -311,7 +247,7 @@ def create_random_nodes(num_layers: List[int]) -> List[Node]:
     for _ in range(num_layers[0]):
         node = Node(
             name=f"Node_{node_counter}",
-            position_number=random.choice([1, 3, 5, 7]),
+            position_number=rng.choice([1, 3, 5, 7]),
             active=True
         )
         nodes.append(node)
@@ -325,9 +261,9 @@ def create_random_nodes(num_layers: List[int]) -> List[Node]:
             for _ in range(num_children):
                 node = Node(
                     name=f"Node_{node_counter}",
-                    position_number=random.choice([1, 3, 5, 7]),
+                    position_number=rng.choice([1, 3, 5, 7]),
                     parent_node=parent.name,
-                    active=random.random() > 0.1  # 90%の確率でアクティブ
+                    active=rng.random() > 0.1  # 90%の確率でアクティブ
                 )
                 nodes.append(node)
                 layer_nodes[layer].append(node)
@@ -338,130 +274,74 @@ def create_random_nodes(num_layers: List[int]) -> List[Node]:
 
 def build_node_hierarchy(nodes: List[Node]) -> List[Node]: #全会員の親子関係を作る関数。直１と始祖会員を計算する。
     """ノードの親子関係を構築し、ルートノードのリストを返す"""
-    node_dict = {node.name: node for node in nodes}
-    root_nodes = []
+    return build_hierarchy(nodes).roots
 
-    for node in nodes:
-        if node.parent_node:
-            if node.parent_node in node_dict:
-                parent = node_dict[node.parent_node]
-                if node not in parent.children:
-                    parent.children.append(node)
-        else:
-            root_nodes.append(node)
+def update_tree_numbers(node: Node) -> None:
+    """ツリー番号を1パスで更新"""
+    compute_tree_numbers([node])
 
-    return root_nodes
+def calculate_all_bonuses(nodes: List[Node], plan: CompiledPlan = STANDARD_PLAN) -> BonusLedger: #ボーナスを計算する関数。
+    """全ノードのボーナスを1回だけ計算し、会員ごとの内訳・種類別の合計金額と発生件数・合計ポイントの台帳を返す"""
+    forest = Forest.from_nodes(nodes)
 
-def update_tree_numbers(node: Node) -> None:
-    """ツリー番号を再帰的に更新"""
-    node.tree_number = node.calculate_tree_number()
-    for child in node.children:
-        if child.active:
-            update_tree_numbers(child)
-
-def calculate_all_bonuses(nodes: List[Node]) -> Dict[str, Tuple[int, int]]: #ボーナスを計算する関数。
-    """全ノードのボーナスを計算し、種類別の合計金額と発生件数を返す"""
-    # 全ノードの支払いポイントの合計を計算
-    total_paid_points = sum(node.paid_point for node in nodes)
-
-    # ボーナス集計用の辞書を初期化
-    bonus_summary = {
-        'riseup_binary_bonus': [0, 0],  # [合計金額, 発生件数]
-        'product_free_bonus': [0, 0],
-        'matching_bonus': [0, 0],
-        'car_bonus': [0, 0],
-        'house_bonus': [0, 0],
-        'sharing_bonus': [0, 0]
-    }
-
-    for node in nodes:
-        if not node.active:
-            continue
-
-        # binary numbersの計算
-        node.calculate_binary_numbers()
-
-        # 各ボーナスの計算と集計
-        bonuses = {
-            'riseup_binary_bonus': node.calculate_riseup_binary_bonus(),
-            'product_free_bonus': node.calculate_product_free_bonus(),
-            'matching_bonus': node.calculate_matching_bonus(),
-            'car_bonus': node.calculate_car_bonus(),
-            'house_bonus': node.calculate_house_bonus(),
-            'sharing_bonus': node.calculate_sharing_bonus(total_paid_points)
-        }
-
-        # ボーナスの集計
-        for bonus_type, amount in bonuses.items():
-            if amount > 0:
-                bonus_summary[bonus_type][0] += amount  # 金額を加算
-                bonus_summary[bonus_type][1] += 1      # 件数を加算
-
-        # 合計ボーナスの設定
-        node.bonus_point = sum(bonuses.values())
-        node.total_bonus_point += node.bonus_point
-
-    return bonus_summary
+    # binary numbersの計算。マッチングボーナスで直１以下のバイナリーを使うので、先に全員分計算しておく。
+    forest.calculate_binary_numbers()
+
+    # 6種類のボーナスを全員分まとめて計算し、bonus_pointとtotal_bonus_pointも更新する
+    ledger = build_bonus_ledger(forest, plan)
+    forest.update_nodes(nodes)
+    return ledger
 
 def main(): #メインの処理を行う関数。
+    parser = argparse.ArgumentParser(description="ランダムな会員群を作り、シーズンごとのボーナスを計算する")
+    parser.add_argument("--profile", action="store_true",
+                        help="段階ごとの時間・メモリと重いメソッドの呼び出し回数を profile_season_<シーズン番号>.json / .csv に書き出す")
+    parser.add_argument("--plan", default=None,
+                        help="報酬プランのJSONファイル（python plan.py > plan.json で既定のプランを書き出して編集する）")
+    args = parser.parse_args()
+    # タイトルの条件とボーナスの規則。省略すれば既定のプラン。コンパイル済みの早見表をシーズンの間ずっと使う
+    plan = load_plan(args.plan) if args.plan else STANDARD_PLAN
+    # --profileを付けなければ何もしないプロファイラーになる
+    profiler = make_profiler(args.profile)
+    profiler.count_hot_methods()
     
     #まずは、会員群（ツリー構造）をランダムに作成する。
     layer_config = [1, 5, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2]  # 各層のノード数設定
 
     # 1. ランダムなノード群を作成
-    nodes = create_random_nodes(layer_config)
+    with profiler.stage("create_nodes"):
+        nodes = create_random_nodes(layer_config)
     
-    # 2. ノードの階層構造を構築
-    root_nodes = build_node_hierarchy(nodes)
+    # 2. ノードの階層構造を構築し、列の形（Forest）に変換する
+    with profiler.stage("build_hierarchy"):
+        build_hierarchy(nodes)
+    with profiler.stage("to_forest"):
+        forest = Forest.from_nodes(nodes)
     
     # 3. ツリー番号を更新
-    for root in root_nodes:
-        update_tree_numbers(root)
+    with profiler.stage("tree_numbers"):
+        forest.compute_tree_numbers()
     
     #4. アクティブなノードのみバイナリーのサイズを計算する。
-    for node in nodes:
-        if not node.active:
-            continue
-
-        node.calculate_binary_numbers()
+    with profiler.stage("binary_numbers"):
+        forest.calculate_binary_numbers()
     
     print("Nodes created")
     
     num_simulations = 2  # シミュレーション回数。何シーズン計算するか。今回は２シーズンシュミレーションする。
 
-    for sim in range(num_simulations):
+    # シーズンの計算はmain.pyと同じくSeasonRunnerで行う（ツリー番号→ツリー構築→タイトルランク→ボーナス→
+    # 全員アクティブ化（テスト用）→バイナリーのサイズ）。タイトルランクはplan.title_ranksの早見表で判定する。
+    runner = SeasonRunner(forest, profiler=profiler, plan=plan)
+    while runner.season < num_simulations:
+        sim = runner.season
         print(f"Starting simulation {sim + 1}")
-        # 1. ノードの階層構造を構築
-        root_nodes = build_node_hierarchy(nodes)
-        
-        # 2. 各ルートノードからツリーを構築
-        for root in root_nodes:
-            root.arrange_tree()
-            
-        # 3. タイトルランクを更新。
-        for node in nodes:
-            node.update_title_rank()
-            
-        # 4. ボーナスを計算し、サマリーを取得
-        bonus_summary = calculate_all_bonuses(nodes)
-        total_bonus = sum(node.bonus_point for node in nodes)
-        print(bonus_summary)
-        print(f"total_bonus={total_bonus}")
-        
-        # 5. 全てのノードをアクティブにする。これにより、２シーズン目以降は全会員がアクティブな状態になる。テスト用。アクティブかどうかは手動で入力するしかない。
-        for node in nodes:
-            node.activate()
-        
-        # 7. アクティブなノードのみバイナリーのサイズを計算する。（更新する）
-        for node in nodes:
-            if not node.active:
-                continue
-            node.calculate_binary_numbers()
-
-        # 8. 結果を保存。csvで出力する。
-        
+        result = runner.run_season()
+        print(result.summary)
+        print(f"total_bonus={result.total_bonus}")
         print(f"Simulation {sim + 1} completed")
-        time.sleep(1)
+
+    profiler.close()
 
 if __name__ == "__main__":
     main()
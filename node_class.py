@@ -1,6 +1,14 @@
 from dataclasses import dataclass, field
 from typing import Optional, List
 import csv
+import heapq
+from tree_engine import rollup_matching_bonus
+from member_loader import iter_node_batches
+# 規則の値はplan.pyにまとめてある（ここからもimportできるように名前を残している）
+from plan import (
+    CompiledPlan, STANDARD_PLAN, RISEUP_BREAKPOINTS, RISEUP_LEVELS, PRODUCT_FREE_AMOUNTS, RANK_CONDITIONS,
+    MATCHING_RATES, CAR_BONUS, HOUSE_BONUS, SHARING_RATES, POSITION_COSTS, ACTIVATION_FEE, BONUS_TYPES
+)
 
 @dataclass
 class Node:
@@ -22,6 +30,7 @@ class Node:
     binary_number_3: int = 0 #ポジション３の時の２個目のバイナリーのサイズ。
     binary_number_5: int = 0 #ポジション５の時の３個目のバイナリーのサイズ。
     binary_number_7: int = 0 #ポジション７の時の４個目のバイナリーのサイズ。
+    active_children_number: int = 0 #アクティブな直１の人数。tree_numberと一緒に計算される。
 
     def process_bank_number(self, node1: 'Node', node2: 'Node') -> None: #バンクナンバーを足したり引いたりするメソッド
         """bank_number処理を実行"""
@@ -34,10 +43,10 @@ class Node:
         #tree1とtree2は右側と左側を指しています。
         
         if tree1 != tree2: #右側と左側の数が違うとき、バンクナンバーを使って、バイナリーのサイズを大きくする。
-            # bank_numberを使って tree_number を調整
-            while self.bank_number > 0 and tree2 < tree1: #バンクナンバーが１か２の時に大きさを調整する。
-                tree2 += 1
-                self.bank_number -= 1 #大きさを調整したら、バンクナンバーを１減らす
+            # bank_numberを使って tree_number を調整。1ずつ足す代わりに、使える分をまとめて使う。
+            used = max(min(self.bank_number, tree1 - tree2), 0) #バンクナンバーが１か２の時に大きさを調整する。
+            tree2 += used
+            self.bank_number -= used #大きさを調整した分だけ、バンクナンバーを減らす
                 
             # 差分をbank_numberに貯蔵（最大2まで）
             diff = min(tree1 - tree2, 2) #右側と左側の二つの差を計算し、バンクナンバーに
@@ -46,12 +55,12 @@ class Node:
 
     def calculate_binary_numbers(self) -> None: #ポジション数に応じてバイナリーのサイズを計算する。
         """バイナリーの大きさを計算"""
-        active_children = sorted(
-            [child for child in self.children if child.active],
-            key=lambda x: x.tree_number,
-            reverse=True
+        active_children = heapq.nlargest(
+            8,
+            (child for child in self.children if child.active),
+            key=lambda x: x.tree_number
         )
-        #まずは、直１を会員のtree_number数に応じてソートする。
+        #まずは、直１を会員のtree_number数に応じてソートする。使うのは上位8人だけなので、全員はソートしない。
         if not active_children:
             return
 
@@ -75,19 +84,18 @@ class Node:
             self.binary_number_7 = (min(node7.tree_number, node8.tree_number) - 1) * 2
             self.process_bank_number(node7, node8)
 
-    def activate(self) -> None: #会員をアクティブにするメソッド。定額で20,790円支払うことにしている。支払額は手動入力ですね。
-        """ノードをアクティブ化し、必要なポイントを支払う"""
-        self.paid_point += 20790
-        self.total_paid_point += 20790
+    def activate(self, plan: CompiledPlan = STANDARD_PLAN) -> None: #会員をアクティブにするメソッド。定額で20,790円支払うことにしている。支払額は手動入力ですね。
+        """ノードをアクティブ化し、必要なポイント（plan.activation_fee）を支払う"""
+        self.paid_point += plan.activation_fee
+        self.total_paid_point += plan.activation_fee
         self.active = True
 
-    def set_position(self, position: int) -> None: #ポジション数に応じて、会員が支払っているであろう金額を自動で計算する。まあ本番環境は使わないでしょう。
-        """ポジション番号を設定し、必要なポイントを支払う"""
-        position_costs = {1: 41580, 3: 82060, 5: 122540, 7: 163020}
-        if position in position_costs:
+    def set_position(self, position: int, plan: CompiledPlan = STANDARD_PLAN) -> None: #ポジション数に応じて、会員が支払っているであろう金額を自動で計算する。まあ本番環境は使わないでしょう。
+        """ポジション番号を設定し、必要なポイント（plan.position_costs）を支払う"""
+        if position in plan.position_costs:
             self.position_number = position
-            self.paid_point += position_costs[position]
-            self.total_paid_point += position_costs[position]
+            self.paid_point += plan.position_costs[position]
+            self.total_paid_point += plan.position_costs[position]
 
     def calculate_tree_number(self) -> int: #自分自身以下の会員が何人いるか計算する。tree_numberと名付けている。
         """ツリー内のノード総数を計算"""
@@ -97,111 +105,39 @@ class Node:
                 count += child.calculate_tree_number()
         return count
 
-    def update_title_rank(self) -> None: #タイトルランクを自動で更新するメソッド。現在のランクをpast_title_rankに入れてから、title_rankを更新する。
+    def update_title_rank(self, plan: CompiledPlan = STANDARD_PLAN) -> None: #タイトルランクを自動で更新するメソッド。現在のランクをpast_title_rankに入れてから、title_rankを更新する。
         """タイトルランクを更新"""
-        tree_size = self.calculate_tree_number()
-        active_children = len([child for child in self.children if child.active])
-
-        rank_conditions = [
-            (20, 2, 1), (60, 3, 2), (200, 4, 3),
-            (600, 5, 4), (1000, 7, 5), (2000, 10, 6),
-            (4000, 10, 7), (6000, 10, 8), (10000, 10, 9),
-            (20000, 10, 10)
-        ] #一番右の数字がタイトルランクを示している。左がtree_number、真ん中が直1。タイトルの条件値になっている。
+        # tree_numberとactive_children_numberは事前にcompute_tree_numbersで計算しておくこと。
+        # タイトルの条件値はplan.rank_conditions（tree_number、直1、タイトルランクの表）。
         self.past_title_rank = self.title_rank
-        self.title_rank = 0
-        for tree_req, children_req, rank in rank_conditions:
-            if tree_size >= tree_req and active_children >= children_req:
-                self.title_rank = rank
+        self.title_rank = plan.title_rank(self.tree_number, self.active_children_number)
 
-    def calculate_riseup_binary_bonus(self) -> int: #ライズアップボーナスを計算する。バイナリーナンバーを使います。
+    # ボーナスの計算はplan（既定はplan.STANDARD_PLAN）の早見表を引く。Forestの一括計算と同じ表を使う。
+    def calculate_riseup_binary_bonus(self, plan: CompiledPlan = STANDARD_PLAN) -> int: #ライズアップボーナスを計算する。バイナリーナンバーを使います。
         """更新されたバイナリーボーナスの計算"""
-        def calculate_bonus_for_binary(binary_number: int) -> float:
-            if 4 <= binary_number <= 60:
-                return 3000 * binary_number / 4
-            elif 64 <= binary_number <= 200:
-                return 3000 * 15 + 4000 * (binary_number - 60) / 4
-            elif 204 <= binary_number <= 2000:
-                return 3000 * 15 + 4000 * 35 + 5000 * (binary_number - 200) / 4
-            elif 2004 <= binary_number <= 20000:
-                return 3000 * 15 + 4000 * 35 + 5000 * 450 + 2000 * (binary_number - 2000) / 4
-            elif binary_number > 20000:
-                return 3000 * 15 + 4000 * 35 + 5000 * 450 + 2000 * 4500
-            return 0
-
-        bonus = 0 #ポジション数に応じて計算する。position_numberが増えると何度もボーナスが加算される。
-        if self.position_number >= 1:
-            bonus += calculate_bonus_for_binary(self.binary_number_1)
-        if self.position_number >= 3:
-            bonus += calculate_bonus_for_binary(self.binary_number_3)
-        if self.position_number >= 5:
-            bonus += calculate_bonus_for_binary(self.binary_number_5)
-        if self.position_number >= 7:
-            bonus += calculate_bonus_for_binary(self.binary_number_7)
-            
-        return int(bonus)
+        #ポジション数に応じて計算する。position_numberが増えると何度もボーナスが加算される。
+        return plan.riseup_bonus_of(self)
 
-    def calculate_product_free_bonus(self) -> int: #プロダクトフリーボーナスを計算する。
+    def calculate_product_free_bonus(self, plan: CompiledPlan = STANDARD_PLAN) -> int: #プロダクトフリーボーナスを計算する。
         """更新された製品無料ボーナスの計算"""
-        def calculate_bonus_for_binary(binary_number: int) -> int:
-            if binary_number == 4:
-                return 10000
-            elif binary_number == 8:
-                return 7000
-            elif binary_number == 12:
-                return 4000
-            elif binary_number == 16:
-                return 1000
-            return 0
-
-        bonus = 0 #ポジション数に応じて計算する。position_numberが増えると何度もボーナスが加算される。
-        if self.position_number >= 1:
-            bonus += calculate_bonus_for_binary(self.binary_number_1)
-        if self.position_number >= 3:
-            bonus += calculate_bonus_for_binary(self.binary_number_3)
-        if self.position_number >= 5:
-            bonus += calculate_bonus_for_binary(self.binary_number_5)
-        if self.position_number >= 7:
-            bonus += calculate_bonus_for_binary(self.binary_number_7)
-            
-        return bonus
+        #ポジション数に応じて計算する。position_numberが増えると何度もボーナスが加算される。
+        return plan.product_free_bonus_of(self)
 
-    def calculate_matching_bonus(self) -> int: #マッチングボーナスの計算。
-        """マッチングボーナスの計算"""
-        bonus = 0
-        for child in self.children:
-            if child.active:
-                # 子ノードからの15%
-                bonus += child.calculate_product_free_bonus() * 0.15
-                # 孫ノードからの5%
-                for grandchild in child.children:
-                    if grandchild.active:
-                        bonus += grandchild.calculate_product_free_bonus() * 0.05
-                        # ひ孫ノードからの5%
-                        for great_grandchild in grandchild.children:
-                            if great_grandchild.active:
-                                bonus += great_grandchild.calculate_product_free_bonus() * 0.05
-        return int(bonus)
-
-    def calculate_car_bonus(self) -> int: #カーボーナスの計算。title_rankとpast_title_rankを使う。今回は条件を満たしていれば、満額もらえるようにしている。
+    def calculate_matching_bonus(self, plan: CompiledPlan = STANDARD_PLAN) -> int: #マッチングボーナスの計算。
+        """マッチングボーナスの計算（子ノードから15%、孫ノードから5%、ひ孫ノードから5%）"""
+        return plan.matching_bonus_of(self)
+
+    def calculate_car_bonus(self, plan: CompiledPlan = STANDARD_PLAN) -> int: #カーボーナスの計算。title_rankとpast_title_rankを使う。今回は条件を満たしていれば、満額もらえるようにしている。
         """車ボーナスの計算"""
-        if self.title_rank >= 4 and self.past_title_rank >= 4:
-            return 100000
-        return 0
+        return plan.car_bonus_of(self)
 
-    def calculate_house_bonus(self) -> int: #ハウスボーナスの計算。title_rankとpast_title_rankを使う。今回は条件を満たしていれば、満額もらえるようにしている。
+    def calculate_house_bonus(self, plan: CompiledPlan = STANDARD_PLAN) -> int: #ハウスボーナスの計算。title_rankとpast_title_rankを使う。今回は条件を満たしていれば、満額もらえるようにしている。
         """住宅ボーナスの計算"""
-        if self.title_rank >= 5 and self.past_title_rank >= 5:
-            return 150000
-        return 0
+        return plan.house_bonus_of(self)
 
-    def calculate_sharing_bonus(self, total_paid_points: int) -> int: #シェアリングボーナスの計算。
+    def calculate_sharing_bonus(self, total_paid_points: int, plan: CompiledPlan = STANDARD_PLAN) -> int: #シェアリングボーナスの計算。
         """シェアリングボーナスの計算"""
-        if self.title_rank == 3:
-            return int(total_paid_points * 0.01)
-        elif self.title_rank >= 4:
-            return int(total_paid_points * 0.002)
-        return 0
+        return plan.sharing_bonus_of(self, total_paid_points)
 
     def arrange_tree(self) -> None: #ポジション数に応じてバイナリーを作るメソッド。
         """ツリー構造を構築"""
@@ -210,7 +146,7 @@ class Node:
 
         # 子ノードを孫ノード以下の数でソート
         active_children = [child for child in self.children if child.active]
-        active_children.sort(key=lambda x: x.calculate_tree_number(), reverse=True)
+        active_children.sort(key=lambda x: x.tree_number, reverse=True)
 
         # position_numberに応じてツリーを構築
         if self.position_number == 1:
@@ -297,8 +233,11 @@ class Node:
         self.bank_number = min(self.bank_number + total_diff, 2)
 
     @classmethod
-    def save_to_csv(cls, nodes: List['Node'], filename: str) -> None: #ＣＳＶに保存するメソッド。
-        """更新されたCSV保存機能"""
+    def save_to_csv(cls, nodes: List['Node'], filename: str, ledger=None, plan: CompiledPlan = STANDARD_PLAN) -> None: #ＣＳＶに保存するメソッド。
+        """更新されたCSV保存機能。ledger（ledger.BonusLedger）を渡せば、ボーナスの列は計算し直さずに台帳の値を書き出す
+
+        ledgerがなければ、planの規則でボーナスの列を計算する。
+        """
         with open(filename, 'w', newline='') as f:
             writer = csv.writer(f)
             writer.writerow([
@@ -306,20 +245,34 @@ class Node:
                 'parent_node', 'tree_number', 'title_rank', 'past_title_rank',
                 'paid_point', 'bonus_point', 'total_paid_point', 'total_bonus_point',
                 'binary_number_1', 'binary_number_3', 'binary_number_5', 'binary_number_7',
-                'riseup_binary_bonus', 'product_free_bonus', 'matching_bonus',
-                'car_bonus', 'house_bonus', 'sharing_bonus'
+                *BONUS_TYPES
             ])
-            
+
+            if ledger is not None:
+                components = [ledger.components[bonus_type].tolist() for bonus_type in BONUS_TYPES]
+                for node, bonuses in zip(nodes, zip(*components)):
+                    writer.writerow([
+                        node.name, node.position_number, node.bank_number,
+                        node.active, node.parent_node, node.tree_number,
+                        node.title_rank, node.past_title_rank, node.paid_point,
+                        node.bonus_point, node.total_paid_point, node.total_bonus_point,
+                        node.binary_number_1, node.binary_number_3, node.binary_number_5,
+                        node.binary_number_7, *bonuses
+                    ])
+                return
+
             total_paid_points = sum(node.paid_point for node in nodes)
+            # マッチングボーナスは会員ごとに子孫をたどらず、元のボーナス（既定はプロダクトフリー）を上に足し上げてまとめて計算する
+            riseup_bonuses = [node.calculate_riseup_binary_bonus(plan) for node in nodes]
+            product_free_bonuses = [node.calculate_product_free_bonus(plan) for node in nodes]
+            matching_base = riseup_bonuses if plan.definition.matching_base == 'riseup_binary_bonus' else product_free_bonuses
+            matching_bonuses = rollup_matching_bonus(nodes, matching_base, plan.matching_rates)
             
-            for node in nodes:
+            for node, riseup_binary_bonus, product_free_bonus, matching_bonus in zip(nodes, riseup_bonuses, product_free_bonuses, matching_bonuses):
                 # 各ボーナスを計算
-                riseup_binary_bonus = node.calculate_riseup_binary_bonus()
-                product_free_bonus = node.calculate_product_free_bonus()
-                matching_bonus = node.calculate_matching_bonus()
-                car_bonus = node.calculate_car_bonus()
-                house_bonus = node.calculate_house_bonus()
-                sharing_bonus = node.calculate_sharing_bonus(total_paid_points)
+                car_bonus = node.calculate_car_bonus(plan)
+                house_bonus = node.calculate_house_bonus(plan)
+                sharing_bonus = node.calculate_sharing_bonus(total_paid_points, plan)
                 
                 writer.writerow([
                     node.name, node.position_number, node.bank_number,
@@ -334,28 +287,8 @@ class Node:
 
     @classmethod
     def load_from_csv(cls, filename: str) -> List['Node']: #ＣＳＶを読み込むメソッド。
-        """更新されたCSV読み込み機能"""
+        """更新されたCSV読み込み機能。member_loaderで列ごとにまとめてパースする（親子関係はbuild_hierarchyでつなぐ）"""
         nodes = []
-        with open(filename, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                node = cls(
-                    name=row['name'],
-                    position_number=int(row['position_number']),
-                    bank_number=int(row['bank_number']),
-                    active=row['active'].lower() == 'true',
-                    parent_node=row['parent_node'] if row['parent_node'] else None,
-                    tree_number=int(row['tree_number']),
-                    title_rank=int(row['title_rank']),
-                    past_title_rank=int(row['past_title_rank']),
-                    paid_point=int(row['paid_point']),
-                    bonus_point=int(row['bonus_point']),
-                    total_paid_point=int(row['total_paid_point']),
-                    total_bonus_point=int(row['total_bonus_point']),
-                    binary_number_1=int(row['binary_number_1']),
-                    binary_number_3=int(row['binary_number_3']),
-                    binary_number_5=int(row['binary_number_5']),
-                    binary_number_7=int(row['binary_number_7'])
-                )
-                nodes.append(node)
+        for batch in iter_node_batches(filename, cls):
+            nodes.extend(batch)
         return nodes
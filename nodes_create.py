@@ -1,12 +1,16 @@
 import random
-from typing import List, Dict
+from typing import List, Dict, Optional
 from node_class import Node
+from forest import calculate_binary_numbers_batch
+from tree_engine import build_hierarchy, compute_tree_numbers
 
-def create_random_nodes(num_layers: List[int]) -> List[Node]:
+def create_random_nodes(num_layers: List[int], rng: Optional[random.Random] = None) -> List[Node]:
     """
     ランダムなノード群を作成
     num_layers: 各層のノード数のリスト [第1層のノード数, 第2層の各ノードの子ノード数, ...]
+    rng: 乱数生成器（random.Random）。省略するとrandomモジュールの共通の乱数を使う
     """
+    rng = rng or random
     nodes = []
     node_counter = 1
     layer_nodes: Dict[int, List[Node]] = {0: []}  # 各層のノードを保持
@@ -15,7 +19,7 @@ def create_random_nodes(num_layers: List[int]) -> List[Node]:
     for _ in range(num_layers[0]):
         node = Node(
             name=f"Node_{node_counter}",
-            position_number=random.choice([1, 3, 5, 7]),
+            position_number=rng.choice([1, 3, 5, 7]),
             active=True
         )
         nodes.append(node)
@@ -29,9 +33,9 @@ def create_random_nodes(num_layers: List[int]) -> List[Node]:
             for _ in range(num_children):
                 node = Node(
                     name=f"Node_{node_counter}",
-                    position_number=random.choice([1, 3, 5, 7]),
+                    position_number=rng.choice([1, 3, 5, 7]),
                     parent_node=parent.name,
-                    active=random.random() > 0.1  # 90%の確率でアクティブ
+                    active=rng.random() > 0.1  # 90%の確率でアクティブ
                 )
                 nodes.append(node)
                 layer_nodes[layer].append(node)
@@ -42,28 +46,11 @@ def create_random_nodes(num_layers: List[int]) -> List[Node]:
 
 def build_node_hierarchy(nodes: List[Node]) -> List[Node]:
     """ノードの親子関係を構築し、ルートノードのリストを返す"""
-    # ノードをname->nodeの辞書に変換
-    node_dict = {node.name: node for node in nodes}
-    root_nodes = []
-
-    # 親子関係を構築
-    for node in nodes:
-        if node.parent_node:
-            if node.parent_node in node_dict:
-                parent = node_dict[node.parent_node]
-                if node not in parent.children:
-                    parent.children.append(node)
-        else:
-            root_nodes.append(node)
-
-    return root_nodes
+    return build_hierarchy(nodes).roots
 
 def update_tree_numbers(node: Node) -> None:
-    """ツリー番号を再帰的に更新"""
-    node.tree_number = node.calculate_tree_number()
-    for child in node.children:
-        if child.active:
-            update_tree_numbers(child)
+    """ツリー番号を1パスで更新"""
+    compute_tree_numbers([node])
 
 if __name__ == "__main__":
     # 設定パラメータ
@@ -80,11 +67,7 @@ if __name__ == "__main__":
         update_tree_numbers(root)
     
     #4. アクティブなノードのみバイナリーのサイズを計算する。
-    for node in nodes:
-        if not node.active:
-            continue
-
-        node.calculate_binary_numbers()
+    calculate_binary_numbers_batch(nodes)
     
     # 5. CSVファイルに保存
     Node.save_to_csv(nodes, "nodes.csv")
@@ -0,0 +1,270 @@
+import argparse
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from forest import Forest, INT_COLUMNS, BINARY_COLUMNS
+from ledger import tree_bonus_amounts, settle_bonus_ledger
+from plan import CompiledPlan
+from season_runner import SeasonRunner, SeasonResult
+
+# 共有メモリに置くForestの列（orderはワーカーがサブツリーごとに作り直す）
+STATE_COLUMNS = ('parent', 'depth', 'active', *INT_COLUMNS)
+# ツリーの中だけで決まるボーナス（シェアリングボーナスは全体のpaid_pointの合計が要るので親プロセスで計算する）
+TREE_BONUS_TYPES = ('riseup_binary_bonus', 'product_free_bonus', 'matching_bonus', 'car_bonus', 'house_bonus')
+
+
+def root_of(parent: np.ndarray) -> np.ndarray: #各会員の始祖会員を求める関数。
+    """ポインタジャンプで各会員の始祖会員のインデックスを計算（始祖会員は自分自身）"""
+    root = np.where(parent >= 0, parent, np.arange(len(parent)))
+    while True:
+        jumped = root[root]
+        if np.array_equal(jumped, root):
+            return root
+        root = jumped
+
+
+def partition_members(parent: np.ndarray, partitions: int) -> Tuple[np.ndarray, np.ndarray]: #始祖会員のサブツリーを区画に分ける関数。
+    """始祖会員のサブツリーを丸ごと、人数がなるべく同じになるようにpartitions個の区画に分ける
+
+    (members, bounds) を返す。区画kの会員は members[bounds[k]:bounds[k+1]]（インデックス順）。
+    サブツリーより細かくは分けないので、1つのサブツリーが大きいとその区画だけ大きくなる。
+    """
+    size = len(parent)
+    root = root_of(parent)
+    roots = np.flatnonzero(parent < 0)
+    sizes = np.bincount(root, minlength=size)[roots]
+    # 始祖会員のインデックス順に人数を積み上げて、ちょうど partitions 等分する位置で切る
+    before = np.cumsum(sizes) - sizes
+    label_of_root = np.minimum(before * partitions // max(size, 1), partitions - 1)
+    label = np.empty(size, dtype=np.int64)
+    label[roots] = label_of_root
+    label = label[root]
+    members = np.argsort(label, kind='stable')
+    bounds = np.searchsorted(label[members], np.arange(partitions + 1))
+    return members, bounds
+
+
+@dataclass(frozen=True)
+class SharedSpec:
+    """ワーカーが共有メモリをつなぐための情報（共有メモリの名前と配列の形）"""
+    token: str #この共有メモリの組の名前。会員が増えて作り直すと変わる
+    blocks: Tuple[Tuple[str, str, str, int], ...] #(配列名, 共有メモリの名前, dtype, 長さ)
+    bounds: Tuple[int, ...] #区画kの会員は members[bounds[k]:bounds[k+1]]
+
+
+def _create_block(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    return block, view
+
+
+# ワーカープロセスがつないだ共有メモリ（同じtokenの間は使い回す）
+_attached: Dict[str, object] = {}
+
+
+def _attach(spec: SharedSpec) -> Dict[str, np.ndarray]:
+    """specの共有メモリにつないで、配列名→配列の辞書を返す"""
+    if _attached.get('token') != spec.token:
+        _attached.pop('arrays', None) #配列を先に手放さないとcloseできない
+        for block in _attached.get('blocks', []):
+            block.close()
+        blocks, arrays = [], {}
+        for name, block_name, dtype, length in spec.blocks:
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            arrays[name] = np.ndarray((length,), dtype=dtype, buffer=block.buf)
+        _attached.update(token=spec.token, blocks=blocks, arrays=arrays)
+    return _attached['arrays']
+
+
+def _local_forest(arrays: Dict[str, np.ndarray], members: np.ndarray, local_parent: np.ndarray) -> Forest:
+    """区画の会員だけのForest（インデックスは区画の中での番号）。名前は使わないので番号で代用する"""
+    columns = {column: arrays[column][members] for column in INT_COLUMNS}
+    return Forest.from_arrays(range(len(members)), local_parent, arrays['active'][members],
+                              depth=arrays['depth'][members], **columns)
+
+
+def _partition_season(spec: SharedSpec, k: int, plan: CompiledPlan) -> int: #1区画分のツリー番号・タイトルランク・バイナリー・ボーナスを計算する。
+    """区画kを計算して共有メモリに書き戻し、区画のpaid_pointの合計を返す（プロセスプールの中で実行される）"""
+    arrays = _attach(spec)
+    start, stop = spec.bounds[k], spec.bounds[k + 1]
+    members = arrays['members'][start:stop]
+    forest = _local_forest(arrays, members, arrays['local_parent'][start:stop])
+
+    forest.compute_tree_numbers()
+    forest.arrange_trees()
+    forest.update_title_ranks(plan)
+    forest.calculate_binary_numbers()
+    amounts = tree_bonus_amounts(forest, plan)
+
+    # 区画どうしは会員が重ならないので、ロックなしで書き戻してよい
+    for column in INT_COLUMNS:
+        arrays[column][members] = getattr(forest, column)
+    for bonus_type in TREE_BONUS_TYPES:
+        arrays[bonus_type][members] = amounts[bonus_type]
+    return int(forest.paid_point.sum())
+
+
+def _partition_binary(spec: SharedSpec, k: int) -> None: #1区画分のバイナリーのサイズを計算し直す。
+    """アクティブ化の後に、区画kのバイナリーのサイズとbank_numberを計算して書き戻す"""
+    arrays = _attach(spec)
+    start, stop = spec.bounds[k], spec.bounds[k + 1]
+    members = arrays['members'][start:stop]
+    forest = _local_forest(arrays, members, arrays['local_parent'][start:stop])
+    forest.calculate_binary_numbers()
+    for column in (*BINARY_COLUMNS, 'bank_number'):
+        arrays[column][members] = getattr(forest, column)
+
+
+class ParallelSeasonRunner(SeasonRunner):
+    """SeasonRunnerの、始祖会員のサブツリーごとに複数プロセスで計算する版
+
+    Forestの列を共有メモリに置き、ワーカーは区画（始祖会員のサブツリーの集まり）ごとに
+    ツリー番号・タイトルランク・バイナリー・ボーナスを計算して、共有メモリに直接書き戻す。
+    シェアリングボーナスに要る全体のpaid_pointの合計は、区画ごとの合計を親プロセスで足して求める。
+    結果はSeasonRunnerと同じ。使い終わったらclose()を呼ぶ（withでもよい）。
+    """
+
+    def __init__(self, forest: Forest, *args, workers: Optional[int] = None, partitions: Optional[int] = None, **kwargs):
+        super().__init__(forest, *args, **kwargs)
+        self.workers = workers or os.cpu_count() or 1
+        self.partitions = partitions or self.workers * 4 #区画を少し細かくして、大きさの偏りをならす
+        self._blocks: List[shared_memory.SharedMemory] = []
+        self._shared: Dict[str, np.ndarray] = {}
+        self._spec: Optional[SharedSpec] = None
+        self._executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+
+    def __enter__(self) -> 'ParallelSeasonRunner':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """ワーカーを止め、共有メモリを解放する（Forestの列は普通の配列に戻す）"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._release()
+
+    def _share(self) -> None:
+        """Forestの列を共有メモリに移し、区画を決める"""
+        forest = self.forest
+        members, bounds = partition_members(forest.parent, self.partitions)
+        # 区画の中での番号で表した親のインデックス
+        slot = np.empty(len(forest), dtype=np.int64)
+        slot[members] = np.arange(len(forest)) - np.repeat(bounds[:-1], np.diff(bounds))
+        member_parent = forest.parent[members]
+        local_parent = np.where(member_parent >= 0, slot[np.maximum(member_parent, 0)], -1)
+
+        arrays = {column: getattr(forest, column) for column in STATE_COLUMNS}
+        arrays.update({bonus_type: np.zeros(len(forest), dtype=np.int64) for bonus_type in TREE_BONUS_TYPES})
+        arrays.update(members=members, local_parent=local_parent)
+        token = uuid.uuid4().hex
+        blocks = []
+        for name, array in arrays.items():
+            block, view = _create_block(np.ascontiguousarray(array))
+            self._blocks.append(block)
+            self._shared[name] = view
+            blocks.append((name, block.name, view.dtype.str, len(view)))
+        self._spec = SharedSpec(token=token, blocks=tuple(blocks), bounds=tuple(bounds.tolist()))
+        self._publish()
+
+    def _release(self) -> None:
+        if self._spec is None:
+            return
+        # 共有メモリを消した後もForestが使えるように、列を普通の配列にコピーしておく
+        for column in STATE_COLUMNS:
+            setattr(self.forest, column, getattr(self.forest, column).copy())
+        self._shared = {}
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+        self._spec = None
+
+    def _publish(self) -> None:
+        """親プロセスで置き換わった列（アクティブ化など）を共有メモリに書き、Forestの列を共有メモリの配列に戻す"""
+        for column in STATE_COLUMNS:
+            view = self._shared[column]
+            values = getattr(self.forest, column)
+            if values is not view:
+                view[...] = values
+                setattr(self.forest, column, view)
+
+    def _map(self, function, *args) -> list:
+        partitions = range(len(self._spec.bounds) - 1)
+        if self._executor is None:
+            return [function(self._spec, k, *args) for k in partitions]
+        return list(self._executor.map(function, *zip(*[(self._spec, k, *args) for k in partitions])))
+
+    def run_season(self) -> SeasonResult:
+        if self._executor is None:
+            # 1プロセスなら共有メモリを使わず、SeasonRunnerと同じに計算する
+            return super().run_season()
+        season = self.season + 1
+        forest = self.forest
+        profiler = self.profiler
+        if self._spec is None or len(self._shared['parent']) != len(forest):
+            # 初回か、delta.apply_deltaなどで会員が増えていたら、共有メモリと区画を作り直す
+            with profiler.stage("share"):
+                self._release()
+                self._share()
+        self._publish()
+
+        # 1. 区画ごとにツリー番号→タイトルランク→バイナリー→ツリーの中のボーナス
+        with profiler.stage("partitions"):
+            paid = self._map(_partition_season, self.plan)
+        # 2. 区画ごとのpaid_pointの合計を足して、シェアリングボーナスと台帳を作る
+        with profiler.stage("bonus_ledger"):
+            total_paid_points = sum(paid)
+            amounts = {bonus_type: self._shared[bonus_type] for bonus_type in TREE_BONUS_TYPES}
+            amounts['sharing_bonus'] = self.plan.sharing_bonus(forest.title_rank, total_paid_points)
+            ledger = settle_bonus_ledger(forest, amounts, total_paid_points)
+        if self.history is not None and season > (self.history.latest_season() or 0):
+            with profiler.stage("history"):
+                self.history.record_season(season, forest, ledger, self.plan)
+
+        # 3. アクティブ化は親プロセスで行い、バイナリーのサイズは区画ごとに計算し直す
+        with profiler.stage("activate"):
+            self.activate(forest)
+            self._publish()
+            self._map(_partition_binary)
+
+        self.season = season
+        return self.finish_season(ledger)
+
+
+def main():
+    from generators import preferential_attachment
+
+    parser = argparse.ArgumentParser(description="生成したネットワークでシーズン計算のプロセス数ごとの速さを測る")
+    parser.add_argument("--size", type=int, default=1_000_000, help="会員数")
+    parser.add_argument("--roots", type=int, default=1000, help="始祖会員の数（サブツリーの数）")
+    parser.add_argument("--seasons", type=int, default=2, help="計算するシーズン数")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1], help="試すプロセス数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    args = parser.parse_args()
+
+    base = preferential_attachment(args.size, roots=args.roots, rng=args.seed)
+    for workers in args.workers:
+        forest = Forest.from_arrays(base.names, base.parent, base.active, depth=base.depth,
+                                    **{column: getattr(base, column) for column in INT_COLUMNS})
+        with ParallelSeasonRunner(forest, workers=workers) as runner:
+            start = time.perf_counter()
+            results = runner.run(args.seasons)
+            elapsed = time.perf_counter() - start
+        print(f"workers={workers}: {elapsed:.2f}s ({args.size * args.seasons / elapsed:,.0f} members/s), "
+              f"total_bonus={sum(result.total_bonus for result in results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import argparse
+import json
+from bisect import bisect_right
+from dataclasses import dataclass, field, asdict, replace, fields
+from typing import Dict, Tuple
+
+import numpy as np
+
+import kernels
+from tree_engine import compile_rank_table
+
+# ライズアップボーナスの段階。バイナリーのサイズがRISEUP_BREAKPOINTSの区間(前の境目+4 ～ 次の境目)に入ると、
+# その段階の単価（4バイナリーごと）がかかる。最後の境目を超えたら上限額。
+RISEUP_BREAKPOINTS = (0, 60, 200, 2000, 20000)
+RISEUP_LEVELS = {"level1": 3000, "level2": 4000, "level3": 5000, "level4": 2000}
+# プロダクトフリーボーナス。バイナリーのサイズが4, 8, 12, 16ちょうどの時にもらえる金額。
+PRODUCT_FREE_AMOUNTS = {"pf4": 10000, "pf8": 7000, "pf12": 4000, "pf16": 1000}
+# タイトルの条件。(tree_numberの条件, アクティブな直１の人数の条件, タイトルランク)。満たした行のうち一番下のランクになる。
+RANK_CONDITIONS = (
+    (20, 2, 1), (60, 3, 2), (200, 4, 3),
+    (600, 5, 4), (1000, 7, 5), (2000, 10, 6),
+    (4000, 10, 7), (6000, 10, 8), (10000, 10, 9),
+    (20000, 10, 10)
+)
+# マッチングボーナスの割合（%）。直１から15%、直２から5%、直３から5%。世代を増やすときは後ろに足す。
+MATCHING_RATES = (15, 5, 5)
+# カーボーナスとハウスボーナス。今回と前回のタイトルランクが両方rank以上ならamountをもらえる。
+CAR_BONUS = {"rank": 4, "amount": 100000}
+HOUSE_BONUS = {"rank": 5, "amount": 150000}
+# シェアリングボーナス。(タイトルランク, 売り上げ合計に対する割合)。そのランク以上、次の行のランク未満に適用する。
+SHARING_RATES = ((3, 0.01), (4, 0.002))
+# ポジション数ごとに支払う金額（set_position）
+POSITION_COSTS = {1: 41580, 3: 82060, 5: 122540, 7: 163020}
+# アクティブになるときに支払う金額（activate）
+ACTIVATION_FEE = 20790
+
+# マッチングボーナスの元にできるボーナス
+MATCHING_BASES = ('product_free_bonus', 'riseup_binary_bonus')
+# ボーナスの種類。台帳（ledger.BonusLedger）の内訳、CSVの列やサマリーもこの順番で並べる。
+BONUS_TYPES = (
+    'riseup_binary_bonus', 'product_free_bonus', 'matching_bonus',
+    'car_bonus', 'house_bonus', 'sharing_bonus',
+)
+
+
+@dataclass(frozen=True)
+class PlanDefinition:
+    """報酬プラン（タイトルの条件とボーナスの規則）の定義。値だけを持ち、compile()で計算用の表にする
+
+    既定値はmain.py / new_cal_bonus.pyの規則。app.pyの規則はAPP_DEFINITION
+    （プロダクトフリーは範囲で判定、マッチングはライズアップの足し上げ）。
+    """
+    riseup_breakpoints: Tuple[int, ...] = RISEUP_BREAKPOINTS
+    riseup_levels: Dict[str, int] = field(default_factory=lambda: dict(RISEUP_LEVELS))
+    product_free_amounts: Dict[str, int] = field(default_factory=lambda: dict(PRODUCT_FREE_AMOUNTS))
+    product_free_exact: bool = True #Trueならサイズがちょうどの時だけ、Falseなら次の境目の手前まで同じ金額
+    matching_base: str = 'product_free_bonus' #MATCHING_BASESのどれか
+    matching_rates: Tuple[int, ...] = MATCHING_RATES
+    rank_conditions: Tuple[Tuple[int, int, int], ...] = RANK_CONDITIONS
+    car_bonus: Dict[str, int] = field(default_factory=lambda: dict(CAR_BONUS))
+    house_bonus: Dict[str, int] = field(default_factory=lambda: dict(HOUSE_BONUS))
+    sharing_rates: Tuple[Tuple[int, float], ...] = SHARING_RATES
+    position_costs: Dict[int, int] = field(default_factory=lambda: dict(POSITION_COSTS))
+    activation_fee: int = ACTIVATION_FEE
+
+    def validate(self) -> None: #定義がおかしくないか確認するメソッド。
+        """計算できない定義ならValueErrorを出す（金額は円単位の整数であること）"""
+        breakpoints = list(self.riseup_breakpoints)
+        if len(breakpoints) < 2 or breakpoints[0] < 0 or any(a >= b for a, b in zip(breakpoints, breakpoints[1:])):
+            raise ValueError(f"riseup_breakpoints must be increasing non-negative sizes: {self.riseup_breakpoints}")
+        expected = {f"level{k + 1}" for k in range(len(breakpoints) - 1)}
+        if set(self.riseup_levels) != expected:
+            raise ValueError(f"riseup_levels must have the keys {sorted(expected)}: {sorted(self.riseup_levels)}")
+
+        if not self.product_free_amounts:
+            raise ValueError("product_free_amounts must not be empty")
+        for key in self.product_free_amounts:
+            if not (key.startswith("pf") and key[2:].isdigit() and int(key[2:]) > 0):
+                raise ValueError(f"product_free_amounts keys must look like 'pf4': {key!r}")
+
+        if self.matching_base not in MATCHING_BASES:
+            raise ValueError(f"matching_base must be one of {MATCHING_BASES}: {self.matching_base!r}")
+        if any(int(rate) != rate or rate < 0 for rate in self.matching_rates):
+            raise ValueError(f"matching_rates must be non-negative whole percentages: {self.matching_rates}")
+
+        for condition in self.rank_conditions:
+            if len(condition) != 3 or any(int(value) != value or value < 0 for value in condition) or condition[2] < 1:
+                raise ValueError(f"rank_conditions rows must be (tree_number, active children, rank >= 1): {condition}")
+
+        for name, rule in (('car_bonus', self.car_bonus), ('house_bonus', self.house_bonus)):
+            if set(rule) != {"rank", "amount"}:
+                raise ValueError(f"{name} must have the keys 'rank' and 'amount': {rule}")
+        ranks = [rank for rank, _ in self.sharing_rates]
+        if ranks != sorted(set(ranks)) or any(not 0 <= share <= 1 for _, share in self.sharing_rates):
+            raise ValueError(f"sharing_rates must have increasing ranks and shares between 0 and 1: {self.sharing_rates}")
+
+        # 金額は円単位の整数（端数があればkernels.as_yenがエラーにする）
+        for amount in (*self.riseup_levels.values(), *self.product_free_amounts.values(),
+                       self.car_bonus["amount"], self.house_bonus["amount"],
+                       *self.position_costs.values(), self.activation_fee):
+            if kernels.as_yen(amount) < 0:
+                raise ValueError(f"amounts must not be negative: {amount}")
+
+    def compile(self) -> 'CompiledPlan':
+        """確認してから、計算用の表を作ったCompiledPlanを返す"""
+        self.validate()
+        return CompiledPlan(self)
+
+    def to_dict(self) -> Dict:
+        """JSONに書き出せる辞書"""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'PlanDefinition': #辞書（JSON）から定義を作るメソッド。
+        """書いてある項目だけ既定値を置き換える。知らない項目があればValueError"""
+        known = {f.name for f in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"unknown plan settings: {sorted(unknown)}")
+        values = dict(data)
+        for name in ('riseup_breakpoints', 'matching_rates'):
+            if name in values:
+                values[name] = tuple(values[name])
+        for name in ('rank_conditions', 'sharing_rates'):
+            if name in values:
+                values[name] = tuple(tuple(row) for row in values[name])
+        if 'position_costs' in values:
+            # JSONの辞書のキーは文字列になるので、ポジション数に戻す
+            values['position_costs'] = {int(position): cost for position, cost in values['position_costs'].items()}
+        return cls(**values)
+
+
+class CompiledPlan:
+    """PlanDefinitionを1回だけ早見表にしたもの。全員分の一括計算（配列）と、会員1人分の計算の両方に使う
+
+    Forest・BonusLedger・各ファイルのNodeのボーナス計算は、全部これを通して同じ表を引く。
+    """
+
+    def __init__(self, definition: PlanDefinition):
+        self.definition = definition
+        self.rank_conditions = tuple(definition.rank_conditions)
+        self.matching_rates = tuple(int(rate) for rate in definition.matching_rates)
+        self.car_rule = {"rank": int(definition.car_bonus["rank"]), "amount": kernels.as_yen(definition.car_bonus["amount"])}
+        self.house_rule = {"rank": int(definition.house_bonus["rank"]), "amount": kernels.as_yen(definition.house_bonus["amount"])}
+        self.sharing_rates = tuple(definition.sharing_rates)
+        self.position_costs = {int(position): kernels.as_yen(cost) for position, cost in definition.position_costs.items()}
+        self.activation_fee = kernels.as_yen(definition.activation_fee)
+
+        # バイナリーのサイズ→金額の早見表（ライズアップは1/4円単位）
+        self.riseup_table = kernels.riseup_lookup(definition.riseup_levels, definition.riseup_breakpoints)
+        self.product_free_table = kernels.product_free_lookup(definition.product_free_amounts, definition.product_free_exact)
+        self.rank_lookup = kernels.compile_rank_lookup(self.rank_conditions)
+        # 会員1人分の計算はPythonのリストを引く方が速い
+        self._riseup_values = self.riseup_table.tolist()
+        self._product_free_values = self.product_free_table.tolist()
+        self._rank_table = compile_rank_table(self.rank_conditions)
+
+    # ---- 全員分の一括計算（配列） ----
+
+    def riseup_bonus(self, binary_number_1, binary_number_3, binary_number_5, binary_number_7, position_number) -> np.ndarray:
+        """全員分のライズアップボーナス（円単位の整数配列）"""
+        return kernels.position_total(self.riseup_table, binary_number_1, binary_number_3, binary_number_5,
+                                      binary_number_7, position_number) // 4
+
+    def product_free_bonus(self, binary_number_1, binary_number_3, binary_number_5, binary_number_7, position_number) -> np.ndarray:
+        """全員分のプロダクトフリーボーナス"""
+        return kernels.position_total(self.product_free_table, binary_number_1, binary_number_3, binary_number_5,
+                                      binary_number_7, position_number)
+
+    def matching_bonus(self, parent: np.ndarray, active: np.ndarray, base: np.ndarray) -> np.ndarray:
+        """base（matching_baseのボーナス）をmatching_ratesで上の世代に足し上げたマッチングボーナス"""
+        return kernels.matching_bonus(parent, active, base, self.matching_rates)
+
+    def title_ranks(self, tree_number: np.ndarray, active_children_number: np.ndarray) -> np.ndarray:
+        """全員分のタイトルランク"""
+        return kernels.lookup_title_ranks(self.rank_lookup, tree_number, active_children_number)
+
+    def car_bonus(self, title_rank: np.ndarray, past_title_rank: np.ndarray) -> np.ndarray:
+        return kernels.rank_pair_bonus(title_rank, past_title_rank, self.car_rule)
+
+    def house_bonus(self, title_rank: np.ndarray, past_title_rank: np.ndarray) -> np.ndarray:
+        return kernels.rank_pair_bonus(title_rank, past_title_rank, self.house_rule)
+
+    def sharing_bonus(self, title_rank: np.ndarray, total_paid_points: int) -> np.ndarray:
+        return kernels.sharing_bonus(title_rank, total_paid_points, self.sharing_rates)
+
+    # ---- 会員1人分の計算（Nodeのメソッドから使う） ----
+
+    def riseup_bonus_of(self, member) -> int: #1人分のライズアップボーナス。
+        """memberのbinary_number_1～7とposition_numberからライズアップボーナスを計算"""
+        values = self._riseup_values
+        last = len(values) - 1
+        total = 0
+        for position in kernels.BINARY_POSITIONS:
+            if member.position_number >= position:
+                total += values[min(max(getattr(member, f"binary_number_{position}"), 0), last)]
+        return total // 4
+
+    def product_free_bonus_of(self, member) -> int: #1人分のプロダクトフリーボーナス。
+        """memberのbinary_number_1～7とposition_numberからプロダクトフリーボーナスを計算"""
+        values = self._product_free_values
+        last = len(values) - 1
+        total = 0
+        for position in kernels.BINARY_POSITIONS:
+            if member.position_number >= position:
+                total += values[min(max(getattr(member, f"binary_number_{position}"), 0), last)]
+        return total
+
+    def matching_bonus_of(self, member) -> int: #1人分のマッチングボーナス。
+        """memberのアクティブな直１・直２…（間の会員もアクティブな場合だけ）のボーナスをmatching_ratesで足す"""
+        base = self.riseup_bonus_of if self.definition.matching_base == 'riseup_binary_bonus' else self.product_free_bonus_of
+        generation = [member]
+        total = 0
+        for rate in self.matching_rates:
+            generation = [child for node in generation for child in node.children if child.active]
+            total += rate * sum(base(child) for child in generation)
+        return total // 100
+
+    def car_bonus_of(self, member) -> int:
+        rank = self.car_rule["rank"]
+        return self.car_rule["amount"] if member.title_rank >= rank and member.past_title_rank >= rank else 0
+
+    def house_bonus_of(self, member) -> int:
+        rank = self.house_rule["rank"]
+        return self.house_rule["amount"] if member.title_rank >= rank and member.past_title_rank >= rank else 0
+
+    def sharing_bonus_of(self, member, total_paid_points: int) -> int:
+        rate = 0
+        for rank, share in self.sharing_rates:
+            if member.title_rank >= rank:
+                rate = share
+        return int(total_paid_points * rate) if rate else 0
+
+    def title_rank(self, tree_number: int, active_children_number: int) -> int:
+        """1人分のタイトルランク"""
+        children_thresholds, tree_thresholds, table = self._rank_table
+        return table[bisect_right(children_thresholds, active_children_number)][bisect_right(tree_thresholds, tree_number)]
+
+
+def load_plan_definition(filename: str) -> PlanDefinition: #プランのJSONファイルを読み込む関数。
+    """JSONファイルの項目で既定の定義（STANDARD_DEFINITION）を置き換えた定義を返す"""
+    with open(filename, 'r', encoding='utf-8') as f:
+        return PlanDefinition.from_dict(json.load(f))
+
+
+def load_plan(filename: str) -> CompiledPlan:
+    """load_plan_definitionで読んだ定義をcompileして返す"""
+    return load_plan_definition(filename).compile()
+
+
+STANDARD_DEFINITION = PlanDefinition()
+# app.pyの規則。プロダクトフリーは範囲で判定し、マッチングボーナスはライズアップボーナスを上の世代へ足し上げる
+APP_DEFINITION = replace(STANDARD_DEFINITION, product_free_exact=False, matching_base='riseup_binary_bonus')
+
+STANDARD_PLAN = STANDARD_DEFINITION.compile()
+APP_PLAN = APP_DEFINITION.compile()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="既定の報酬プランをJSONで書き出す（編集して main.py --plan に渡す）")
+    parser.add_argument("--app", action="store_true", help="app.pyの規則を書き出す")
+    args = parser.parse_args()
+    definition = APP_DEFINITION if args.app else STANDARD_DEFINITION
+    print(json.dumps(definition.to_dict(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import csv
+import functools
+import inspect
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+from forest import Forest
+from plan import CompiledPlan
+
+# 呼ばれた回数を数えるメソッド（SeasonRunnerのシーズンの計算で実際に動くもの）
+# Forestの一括計算のメソッド
+HOT_FOREST_METHODS = (
+    'compute_tree_numbers', 'accumulate_up', 'arrange_trees', 'update_title_ranks', 'calculate_binary_numbers',
+)
+# 全員分の配列でまとめて計算するplanのメソッド（中でkernelsの関数を呼ぶ）
+HOT_PLAN_METHODS = (
+    'title_ranks', 'riseup_bonus', 'product_free_bonus', 'matching_bonus', 'car_bonus', 'house_bonus', 'sharing_bonus',
+)
+
+
+@dataclass
+class StageRecord:
+    """1つの段階の計測結果"""
+    name: str
+    seconds: float
+    peak_bytes: int #段階の開始時から増えたメモリの最大値（memory=Falseなら0）
+
+
+class Profiler:
+    """パイプラインの段階ごとの時間・メモリと、重いメソッドの呼び出し回数をシーズンごとに記録する
+
+    `with profiler.stage("bonus_ledger"):` で段階を囲み、シーズンの終わりにend_seasonを呼ぶと、
+    output_dirに {prefix}_season_<シーズン番号>.json と .csv を書き出す。
+    無効のときはNULL_PROFILER（何もしない）を使うので、計算の流れに手を入れる必要はない。
+    """
+
+    def __init__(self, output_dir: str = ".", prefix: str = "profile", memory: bool = True):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.memory = memory
+        self.records: List[StageRecord] = []
+        self.calls: Dict[str, int] = {}
+        self._patched = []
+        self._peaks: List[int] = [] #入れ子の段階のために、外側の段階で見えたメモリの最大値を持っておく
+        self._tracing = memory and not tracemalloc.is_tracing() #自分で始めたtracemallocだけcloseで止める
+        if self._tracing:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str):
+        """囲んだ処理の時間とメモリを、段階nameとして記録する"""
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append(current)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak_bytes = 0
+            if self.memory:
+                started = self._peaks.pop()
+                peak = tracemalloc.get_traced_memory()[1]
+                peak_bytes = max(peak - started, 0)
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+            self.records.append(StageRecord(name, elapsed, peak_bytes))
+
+    def count_calls(self, owner, *names: str) -> None: #メソッドの呼び出し回数を数えるようにするメソッド。
+        """owner（クラス）のメソッドnamesを、呼ばれた回数を数える版に置き換える（closeで元に戻す）"""
+        for name in names:
+            method = owner.__dict__.get(name)
+            if not inspect.isfunction(method):
+                continue
+            key = f"{owner.__name__}.{name}"
+            self.calls.setdefault(key, 0)
+            setattr(owner, name, self._counted(method, key))
+            self._patched.append((owner, name, method))
+
+    def _counted(self, method, key: str):
+        @functools.wraps(method)
+        def counted(*args, **kwargs):
+            self.calls[key] += 1
+            return method(*args, **kwargs)
+        return counted
+
+    def count_hot_methods(self) -> None:
+        """HOT_FOREST_METHODSとHOT_PLAN_METHODSの呼び出し回数を数える
+
+        ParallelSeasonRunnerのワーカーの中で呼ばれた分は、このプロセスからは見えないので数えない。
+        """
+        self.count_calls(Forest, *HOT_FOREST_METHODS)
+        self.count_calls(CompiledPlan, *HOT_PLAN_METHODS)
+
+    def end_season(self, season: int) -> Dict: #1シーズン分の記録を書き出すメソッド。
+        """ここまでの記録をシーズンseasonの分としてJSONとCSVに書き出し、記録を空にする"""
+        report = {
+            'season': season,
+            'stages': [asdict(record) for record in self.records],
+            'calls': dict(self.calls),
+        }
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{self.prefix}_season_{season:04d}")
+        with open(f"{path}.json", 'w') as f:
+            json.dump(report, f, indent=2)
+        with open(f"{path}.csv", 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'seconds', 'peak_bytes', 'calls'])
+            for record in self.records:
+                writer.writerow([record.name, f"{record.seconds:.6f}", record.peak_bytes, ''])
+            for key, count in self.calls.items():
+                writer.writerow([key, '', '', count])
+
+        self.records = []
+        self.calls = dict.fromkeys(self.calls, 0)
+        return report
+
+    def close(self) -> None:
+        """置き換えたメソッドを元に戻し、tracemallocを止める"""
+        for owner, name, method in reversed(self._patched):
+            setattr(owner, name, method)
+        self._patched = []
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+
+class NullProfiler:
+    """無効のときのProfiler。どのメソッドも何もしない"""
+
+    _context = nullcontext()
+
+    def stage(self, name: str):
+        return self._context
+
+    def count_calls(self, owner, *names: str) -> None:
+        pass
+
+    def count_hot_methods(self) -> None:
+        pass
+
+    def end_season(self, season: int) -> Optional[Dict]:
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def make_profiler(enabled: bool, output_dir: str = ".", memory: bool = True):
+    """enabledならProfiler、そうでなければNULL_PROFILERを返す"""
+    return Profiler(output_dir, memory=memory) if enabled else NULL_PROFILER
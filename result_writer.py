@@ -0,0 +1,225 @@
+import csv
+import gzip
+import io
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, Optional, Sequence, TextIO
+
+import numpy as np
+
+from forest import Forest, INT_COLUMNS
+from ledger import BonusLedger, BONUS_TYPES, write_points
+
+try:
+    import zstandard
+except ImportError: #zstdは入っていれば使う
+    zstandard = None
+
+# 圧縮の種類と、ファイル名の後ろに付ける拡張子
+COMPRESSION_SUFFIXES = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+# Node.save_to_csvと同じ列の並び
+NODE_CSV_HEADER = (
+    'name', 'position_number', 'bank_number', 'active',
+    'parent_node', 'tree_number', 'title_rank', 'past_title_rank',
+    'paid_point', 'bonus_point', 'total_paid_point', 'total_bonus_point',
+    'binary_number_1', 'binary_number_3', 'binary_number_5', 'binary_number_7',
+    *BONUS_TYPES,
+)
+ROWS_PER_CHUNK = 100_000 #1回にPythonのリストにする行数（大きいネットワークでもメモリが増えすぎないように）
+
+
+def available_compressions() -> Sequence[str]:
+    """この環境で使える圧縮の種類（zstdはzstandardが入っているときだけ）"""
+    return tuple(name for name in COMPRESSION_SUFFIXES if name != 'zstd' or zstandard is not None)
+
+
+@contextmanager
+def open_compressed(filename: str, compression: str = 'gzip', level: Optional[int] = None) -> Iterator[TextIO]: #圧縮して書くファイルを開く関数。
+    """filename.tmpに書き、閉じるときにflushとfsyncをしてからfilenameに置き換える（途中で落ちても壊れたファイルが残らない）"""
+    if compression not in available_compressions():
+        raise ValueError(f"unknown or unavailable compression: {compression} (available: {', '.join(available_compressions())})")
+    tmp = f"{filename}.tmp"
+    try:
+        with open(tmp, 'wb') as raw:
+            if compression == 'gzip':
+                # mtime=0にして、同じ内容なら同じファイルになるようにする
+                stream = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6 if level is None else level, mtime=0)
+            elif compression == 'zstd':
+                stream = zstandard.ZstdCompressor(level=3 if level is None else level).stream_writer(raw, closefd=False)
+            else:
+                stream = raw
+            text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+            yield text
+            text.flush()
+            text.detach()
+            if stream is not raw:
+                stream.close() #圧縮の最後の部分を書く（rawは閉じない）
+            raw.flush()
+            os.fsync(raw.fileno())
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, filename)
+
+
+def open_result(filename: str) -> TextIO:
+    """ResultWriterが書いたファイルを、拡張子で圧縮を見分けてテキストとして開く"""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', encoding='utf-8', newline='')
+    if filename.endswith('.zst'):
+        if zstandard is None:
+            raise ValueError("reading .zst files needs the zstandard package")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True),
+                                encoding='utf-8', newline='')
+    return open(filename, newline='')
+
+
+@dataclass
+class SeasonOutput:
+    """書き出しを待っている1シーズン分の結果。Forestの列はsubmitの時点でコピーしてある"""
+    season: int
+    names: Sequence[str]
+    parent: np.ndarray
+    active: np.ndarray
+    columns: Dict[str, np.ndarray]
+    ledger: BonusLedger
+    unresolved_parents: Dict[int, str] = field(default_factory=dict) #Forest.unresolved_parentsと同じ
+
+    @classmethod
+    def capture(cls, season: int, forest: Forest, ledger: BonusLedger) -> 'SeasonOutput':
+        # 列は次のシーズンで置き換わったり書き換えられたり（delta、parallelの共有メモリ）するのでコピーする。
+        # namesは書き足さずに作り直されるので、そのまま持っていてよい。
+        return cls(
+            season=season, names=forest.names, parent=forest.parent.copy(), active=forest.active.copy(),
+            columns={column: getattr(forest, column).copy() for column in INT_COLUMNS}, ledger=ledger,
+            unresolved_parents=dict(forest.unresolved_parents),
+        )
+
+
+def write_nodes(output: SeasonOutput, f: TextIO, members: Optional[np.ndarray] = None) -> None: #会員ごとの結果をCSVに書く関数。
+    """Node.save_to_csv(forest.to_nodes(), ..., ledger)と同じ内容を、Nodeを作らずに列から書く
+
+    membersにインデックスの配列を渡せば、その会員の行だけを、先頭にインデックスの列を付けて書く（delta_outputの差分ファイル）。
+    """
+    writer = csv.writer(f)
+    writer.writerow(NODE_CSV_HEADER if members is None else ('index', *NODE_CSV_HEADER))
+    names = output.names
+    columns = output.columns
+    components = output.ledger.components
+    unresolved = output.unresolved_parents
+    count = len(output.parent) if members is None else len(members)
+    for start in range(0, count, ROWS_PER_CHUNK):
+        if members is None:
+            rows = slice(start, start + ROWS_PER_CHUNK)
+            row_names = names[rows]
+            indices = range(*rows.indices(len(output.parent)))
+        else:
+            rows = members[start:start + ROWS_PER_CHUNK]
+            indices = rows.tolist()
+            row_names = [names[i] for i in indices]
+        # 親が見つからなかった会員は、ファイルにあったparent_nodeをそのまま書く
+        parent_nodes = [names[p] if p >= 0 else unresolved.get(i) for i, p in zip(indices, output.parent[rows].tolist())]
+        writer.writerows(zip(
+            *(() if members is None else (indices,)), row_names, columns['position_number'][rows].tolist(), columns['bank_number'][rows].tolist(),
+            output.active[rows].tolist(), parent_nodes,
+            *(columns[column][rows].tolist() for column in NODE_CSV_HEADER[5:16]),
+            *(components[bonus_type][rows].tolist() for bonus_type in BONUS_TYPES),
+        ))
+
+
+class ResultWriter:
+    """シーズンの結果（nodes.csvとpoints.csv）を別スレッドで圧縮して書き出す
+
+    submitは列をコピーしてキューに入れるだけなので、書き出しの間に次のシーズンを計算できる。
+    キューはmax_pendingシーズン分までで、いっぱいならsubmitは空くまで待つ（メモリが増え続けない）。
+    圧縮とディスクへの書き込みの間はGILが外れるので、スレッドでも計算と重なる。
+    ファイルは1つずつfsyncしてから置き換え、close()で残りを書き終えてディレクトリもfsyncする。
+    """
+
+    def __init__(self, output_dir: str = ".", compression: str = 'gzip', max_pending: int = 2,
+                 level: Optional[int] = None):
+        if compression not in available_compressions():
+            raise ValueError(f"unknown or unavailable compression: {compression} (available: {', '.join(available_compressions())})")
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+        self.output_dir = output_dir
+        self.compression = compression
+        self.level = level
+        self.suffix = COMPRESSION_SUFFIXES[compression]
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="ResultWriter", daemon=True)
+        os.makedirs(output_dir, exist_ok=True)
+        self._thread.start()
+
+    def __enter__(self) -> 'ResultWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def paths(self, season: int) -> Dict[str, str]:
+        """シーズンseasonのnodesとpointsのファイル名"""
+        prefix = os.path.join(self.output_dir, f"season_{season:04d}")
+        return {'nodes': f"{prefix}_nodes.csv{self.suffix}", 'points': f"{prefix}_points.csv{self.suffix}"}
+
+    def submit(self, season: int, forest: Forest, ledger: BonusLedger) -> None: #1シーズン分の書き出しを頼むメソッド。
+        """今の列をコピーしてキューに入れる（キューがいっぱいなら待つ）。前の書き出しが失敗していればその例外を出す"""
+        self._check()
+        if not self._thread.is_alive():
+            raise RuntimeError("ResultWriter is closed")
+        self._queue.put(SeasonOutput.capture(season, forest, ledger))
+
+    def flush(self) -> None:
+        """キューに入っている分を全部書き終えるまで待つ（チェックポイントの前に呼ぶ）"""
+        self._queue.join()
+        self._check()
+
+    def close(self) -> None:
+        """残りを書き終えてスレッドを止め、ディレクトリをfsyncする"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+            self._sync_directory()
+        self._check()
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("writing season results failed") from self._error
+
+    def _run(self) -> None:
+        while True:
+            output = self._queue.get()
+            try:
+                if output is None:
+                    return
+                if self._error is None: #失敗した後の分は書かずに捨てる（submitとcloseが例外を出す）
+                    self._write(output)
+            except BaseException as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _write(self, output: SeasonOutput) -> None:
+        paths = self.paths(output.season)
+        with open_compressed(paths['nodes'], self.compression, self.level) as f:
+            write_nodes(output, f)
+        with open_compressed(paths['points'], self.compression, self.level) as f:
+            write_points(output.ledger, f)
+
+    def _sync_directory(self) -> None:
+        # ファイルの置き換え（os.replace）をディスクに残す。ディレクトリを開けないOSでは何もしない
+        try:
+            fd = os.open(self.output_dir, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
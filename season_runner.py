@@ -0,0 +1,170 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from node_class import Node
+from forest import Forest
+from ledger import BonusLedger, build_bonus_ledger, save_points_csv
+from snapshot import save_snapshot, load_snapshot
+from history import SeasonHistory
+from profiler import NULL_PROFILER
+from plan import CompiledPlan, STANDARD_PLAN, ACTIVATION_FEE
+from result_writer import ResultWriter
+
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+def activate_all(forest: Forest, fee: int = ACTIVATION_FEE) -> None: #全員をアクティブにする関数。main.pyのテスト用の動き。
+    """全員のactivate()をまとめて行う（支払いはfee円）"""
+    forest.paid_point = forest.paid_point + fee
+    forest.total_paid_point = forest.total_paid_point + fee
+    forest.active = np.ones(len(forest), dtype=bool)
+
+
+def read_checkpoint(checkpoint_dir: str) -> Dict: #checkpoint.jsonを読む関数。
+    """最後のチェックポイントの {"season", "snapshot"}（履歴を書いていれば "history_run" も）を返す"""
+    with open(os.path.join(checkpoint_dir, CHECKPOINT_FILE)) as f:
+        return json.load(f)
+
+
+@dataclass
+class SeasonResult:
+    """1シーズン分の結果（会員ごとの内訳は持たない）"""
+    season: int
+    summary: Dict[str, List[int]] #ボーナスの種類ごとの [合計金額, 発生件数]
+    total_paid: int
+    total_bonus: int
+
+
+class SeasonRunner:
+    """会員の状態をメモリ上のForestに持ったまま、シーズンを続けて計算する
+
+    シーズンごとにファイルを読み直したり待ったりしない。checkpoint_dirを指定すれば、
+    checkpoint_everyシーズンごとにスナップショットを保存し、落ちてもresumeで続きから計算できる。
+    """
+
+    def __init__(self, forest: Forest, season: int = 0,
+                 output_dir: Optional[str] = None,
+                 checkpoint_dir: Optional[str] = None, checkpoint_every: int = 10, keep_checkpoints: int = 2,
+                 history: Optional[SeasonHistory] = None,
+                 activate: Optional[Callable[[Forest], None]] = None,
+                 profiler=NULL_PROFILER, plan: CompiledPlan = STANDARD_PLAN,
+                 writer: Optional[ResultWriter] = None):
+        self.forest = forest
+        self.season = season #計算が終わった最後のシーズン
+        self.output_dir = output_dir #指定すればシーズンごとのnodes.csvとpoints.csvを書き出す
+        self.writer = writer #result_writer.ResultWriterを渡せば、output_dirの代わりに別スレッドで圧縮して書き出す
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_every = checkpoint_every
+        self.keep_checkpoints = keep_checkpoints
+        self.history = history
+        self.plan = plan #タイトルの条件とボーナスの規則
+        # 省略すれば全員をアクティブにし、planのactivation_feeを支払う
+        self.activate = activate or (lambda forest: activate_all(forest, plan.activation_fee))
+        self.profiler = profiler #profiler.Profilerを渡せば、段階ごとの時間とメモリをシーズンごとに書き出す
+
+    @classmethod
+    def resume(cls, checkpoint_dir: str, **kwargs) -> 'SeasonRunner': #最後のチェックポイントから再開するメソッド。
+        """checkpoint_dirの最後のチェックポイントの状態から再開する"""
+        state = read_checkpoint(checkpoint_dir)
+        snapshot = load_snapshot(os.path.join(checkpoint_dir, state["snapshot"]))
+        if snapshot.season != state["season"]:
+            raise ValueError(f"checkpoint says season {state['season']} but the snapshot holds season {snapshot.season}")
+        return cls(snapshot.forest, season=snapshot.season, checkpoint_dir=checkpoint_dir, **kwargs)
+
+    def run_season(self) -> SeasonResult: #1シーズン分を計算するメソッド。
+        """main.pyの1シーズン分（ツリー番号→タイトルランク→ボーナス→アクティブ化→バイナリー）を行う"""
+        season = self.season + 1
+        forest = self.forest
+        profiler = self.profiler
+
+        # 1. ツリー番号とアクティブな直１の人数を計算し、ツリーを構築してタイトルランクを更新
+        with profiler.stage("tree_numbers"):
+            forest.compute_tree_numbers()
+        with profiler.stage("arrange_trees"):
+            forest.arrange_trees()
+        with profiler.stage("title_ranks"):
+            forest.update_title_ranks(self.plan)
+
+        # 2. バイナリーのサイズを計算してからボーナスを計算
+        with profiler.stage("binary_numbers"):
+            forest.calculate_binary_numbers()
+        with profiler.stage("bonus_ledger"):
+            ledger = build_bonus_ledger(forest, self.plan)
+        if self.history is not None and season > (self.history.latest_season() or 0):
+            # 前回落ちたときに記録済みのシーズンはもう一度追記しない
+            with profiler.stage("history"):
+                self.history.record_season(season, forest, ledger, self.plan)
+
+        # 3. 次のシーズンに向けてアクティブ化し、バイナリーのサイズを更新
+        with profiler.stage("activate"):
+            self.activate(forest)
+            forest.calculate_binary_numbers()
+
+        self.season = season
+        return self.finish_season(ledger)
+
+    def finish_season(self, ledger: BonusLedger) -> SeasonResult: #計算が終わったシーズンの結果を保存するメソッド。
+        """結果の書き出し（writerがあればキューに入れるだけ）とチェックポイントをして、SeasonResultを返す"""
+        season = self.season
+        profiler = self.profiler
+        if self.writer is not None or self.output_dir is not None:
+            with profiler.stage("save_results"):
+                # points.csvの合計は、nodes.csvと同じくアクティブ化の後の値
+                output = ledger.with_totals_of(self.forest)
+                if self.writer is not None:
+                    self.writer.submit(season, self.forest, output)
+                else:
+                    self.save_season(output)
+        if self.checkpoint_dir is not None and season % self.checkpoint_every == 0:
+            with profiler.stage("checkpoint"):
+                self.checkpoint()
+        profiler.end_season(season)
+        return SeasonResult(season=season, summary=ledger.summary,
+                            total_paid=ledger.total_paid, total_bonus=ledger.total_bonus)
+
+    def run(self, until: int) -> List[SeasonResult]: #until シーズン目まで計算するメソッド。
+        """until シーズン目まで計算し、最後にチェックポイントを保存する"""
+        results = []
+        while self.season < until:
+            results.append(self.run_season())
+        if self.checkpoint_dir is not None and results and self.season % self.checkpoint_every != 0:
+            self.checkpoint()
+        return results
+
+    def save_season(self, ledger: BonusLedger) -> None:
+        """シーズン番号のついたnodes.csvとpoints.csvを書き出す"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"season_{self.season:04d}")
+        Node.save_to_csv(self.forest.to_nodes(), f"{prefix}_nodes.csv", ledger)
+        save_points_csv(ledger, f"{prefix}_points.csv")
+
+    def checkpoint(self) -> None: #今の状態をチェックポイントとして保存するメソッド。
+        """スナップショットを書いてから、checkpoint.jsonを置き換える（どちらも途中で落ちても壊れない）"""
+        if self.writer is not None:
+            # 書き出しが済んでいないシーズンをチェックポイントに含めると、再開したときにそのシーズンの結果が抜ける
+            self.writer.flush()
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        snapshot_name = f"season_{self.season:06d}.snap"
+        save_snapshot(self.forest, os.path.join(self.checkpoint_dir, snapshot_name), self.season)
+
+        path = os.path.join(self.checkpoint_dir, CHECKPOINT_FILE)
+        state = {"season": self.season, "snapshot": snapshot_name}
+        if self.history is not None:
+            state["history_run"] = self.history.run_id #再開したときに同じrunの続きとして履歴に書くため
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+
+        # 今回の分を含めてkeep_checkpoints個だけ残し、それより古いチェックポイントは消す
+        older = sorted(
+            name for name in os.listdir(self.checkpoint_dir)
+            if name.startswith("season_") and name.endswith(".snap") and name < snapshot_name
+        )
+        for name in older[:max(len(older) - (self.keep_checkpoints - 1), 0)]:
+            os.remove(os.path.join(self.checkpoint_dir, name))
@@ -0,0 +1,129 @@
+import json
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from typing import Iterator, Sequence
+
+import numpy as np
+
+from forest import Forest, INT_COLUMNS
+
+# ファイルの構成（数値はすべてリトルエンディアン）:
+#   ヘッダー（64バイト）: マジック, スキーマのバージョン, 見つからない親の表のバイト数, シーズン番号, 会員数, 名前表のバイト数
+#   int64の列: parent, order, depth, INT_COLUMNSの各列（各N個）, 名前の開始位置（N+1個）
+#   uint8の列: active（N個）
+#   名前表: 全員の名前をUTF-8でつないだもの（親は名前ではなくparentのインデックスで持つ）
+#   見つからない親の表: Forest.unresolved_parentsのJSON（バージョン2から。バージョン1は予約の0で、表がない）
+SNAPSHOT_MAGIC = b'MLMSNAP\x00'
+SNAPSHOT_VERSION = 2
+_READABLE_VERSIONS = (1, 2)
+SNAPSHOT_COLUMNS = ('parent', 'order', 'depth') + INT_COLUMNS
+_HEADER = struct.Struct('<8sIIqqq')
+_HEADER_SIZE = 64
+
+
+@dataclass
+class Snapshot:
+    """load_snapshotの結果"""
+    season: int #何シーズン目の状態か
+    forest: Forest #ファイルをmmapした列を持つForest（書き換えてもファイルは変わらない）
+
+
+class SnapshotNames(Sequence[str]):
+    """名前表を必要な分だけデコードする名前のリスト"""
+
+    def __init__(self, offsets: np.ndarray, blob: memoryview):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        blob = self._blob
+        offsets = self._offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield bytes(blob[start:end]).decode('utf-8')
+
+
+def save_snapshot(forest: Forest, filename: str, season: int) -> None: #シーズンの状態をバイナリで保存する関数。
+    """Forestをスナップショットファイルに保存（一時ファイルに書いてから置き換えるので、途中で落ちても壊れない）"""
+    encoded = [name.encode('utf-8') for name in forest.names]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    np.cumsum([len(name) for name in encoded], out=offsets[1:])
+
+    unresolved = json.dumps({str(i): name for i, name in forest.unresolved_parents.items()}).encode('utf-8') \
+        if forest.unresolved_parents else b''
+
+    tmp = f"{filename}.tmp"
+    with open(tmp, 'wb') as f:
+        header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(unresolved), season, len(forest), int(offsets[-1]))
+        f.write(header.ljust(_HEADER_SIZE, b'\x00'))
+        for column in SNAPSHOT_COLUMNS:
+            f.write(np.ascontiguousarray(getattr(forest, column), dtype='<i8'))
+        f.write(offsets)
+        f.write(np.ascontiguousarray(forest.active, dtype=np.uint8))
+        f.write(b''.join(encoded))
+        f.write(unresolved)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+
+def read_snapshot_season(filename: str) -> int:
+    """ヘッダーだけ読んでシーズン番号を返す"""
+    with open(filename, 'rb') as f:
+        season, _, _, _ = _unpack_header(f.read(_HEADER_SIZE), filename)
+    return season
+
+
+def _unpack_header(data: bytes, filename: str):
+    if len(data) < _HEADER_SIZE:
+        raise ValueError(f"{filename} is not a member snapshot")
+    magic, version, unresolved_size, season, count, names_size = _HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"{filename} is not a member snapshot")
+    if version not in _READABLE_VERSIONS:
+        raise ValueError(f"{filename}: unsupported snapshot version {version} (expected {SNAPSHOT_VERSION})")
+    return season, count, names_size, unresolved_size
+
+
+def load_snapshot(filename: str) -> Snapshot: #スナップショットを読み込む関数。
+    """スナップショットをmmapで開き、列をコピーせずにForestにする
+
+    ページは実際に触った分だけ読まれるので、会員数が多くても開くのは一瞬で済む。
+    mmapは書き込み時コピーなので、Forestの列を書き換えてもファイルは変わらない。
+    """
+    with open(filename, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    season, count, names_size, unresolved_size = _unpack_header(buffer[:_HEADER_SIZE], filename)
+
+    int_columns = len(SNAPSHOT_COLUMNS) * count + count + 1
+    expected = _HEADER_SIZE + 8 * int_columns + count + names_size + unresolved_size
+    if len(buffer) != expected:
+        raise ValueError(f"{filename}: truncated snapshot ({len(buffer)} bytes, expected {expected})")
+
+    table = np.frombuffer(buffer, dtype='<i8', count=int_columns, offset=_HEADER_SIZE)
+    columns = {column: table[k * count:(k + 1) * count] for k, column in enumerate(SNAPSHOT_COLUMNS)}
+    offsets = table[len(SNAPSHOT_COLUMNS) * count:]
+    active_start = _HEADER_SIZE + 8 * int_columns
+    active = np.frombuffer(buffer, dtype=np.bool_, count=count, offset=active_start)
+    names_start = active_start + count
+    names = SnapshotNames(offsets, memoryview(buffer)[names_start:names_start + names_size])
+    unresolved = {}
+    if unresolved_size:
+        unresolved_start = names_start + names_size
+        unresolved = {int(i): name for i, name in json.loads(buffer[unresolved_start:unresolved_start + unresolved_size]).items()}
+
+    forest = Forest(names=names, active=active, **columns, unresolved_parents=unresolved)
+    return Snapshot(season=season, forest=forest)
@@ -0,0 +1,181 @@
+from dataclasses import dataclass
+from itertools import product
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from forest import Forest, BINARY_COLUMNS
+from plan import PlanDefinition, APP_DEFINITION
+import kernels
+
+_CHUNK_CELLS = 8_000_000 #1回に計算する（会員数×グリッドの点の数）の上限。int64で64MBくらい
+
+
+def expand_grid(values: Dict[str, Sequence]) -> List[Dict[str, int]]: #パラメータのグリッドを作る関数。
+    """{"level1": [2000, 3000], "level2": [4000]} のような候補から、全部の組み合わせの辞書のリストを作る
+
+    書いていない定数は、sweep_bonus_paramsでplanの値になる。
+    """
+    keys = list(values)
+    return [dict(zip(keys, combination)) for combination in product(*(values[key] for key in keys))]
+
+
+def complete_params(params: Dict[str, int], defaults: Dict[str, int], name: str) -> Dict[str, int]: #グリッドの1点に書いていない定数を埋める関数。
+    """paramsに書いていない定数をdefaults（planの値）で埋める。planにない定数があればValueError"""
+    unknown = set(params) - set(defaults)
+    if unknown:
+        raise ValueError(f"unknown {name} keys {sorted(unknown)} (expected some of {sorted(defaults)})")
+    return {**defaults, **params}
+
+
+@dataclass
+class SweepPoint:
+    """グリッドの1点の結果"""
+    riseup_params: Dict[str, int]
+    product_free_params: Dict[str, int]
+    summary: Dict[str, List[int]] #ボーナスの種類ごとの [合計金額, 発生件数]（BonusLedger.summaryと同じ）
+    total_bonus: int
+    total_paid: int
+
+    @property
+    def payout_ratio(self) -> float:
+        return self.total_bonus / self.total_paid if self.total_paid else float('nan')
+
+
+class SweepStructure:
+    """支払いの定数によらない部分（バイナリーのサイズ、ランク、マッチングの世代のつながり）を1回だけ計算したもの
+
+    ライズアップボーナスは各段階の単価の、プロダクトフリーボーナスは各金額の一次式になるので、
+    会員ごとの係数を持っておけば、定数を変えたときは行列の掛け算1回で全員分が計算できる。
+    """
+
+    def __init__(self, forest: Forest, plan: PlanDefinition = APP_DEFINITION):
+        if plan.matching_base != 'riseup_binary_bonus':
+            # マッチングはライズアップのパスで一緒に集計するので、app.pyと同じ足し上げ方だけ扱える
+            raise ValueError("the sweep only supports plans whose matching bonus rolls up the rise-up bonus")
+        compiled = plan.compile()
+        self.size = len(forest)
+        self.active = forest.active.copy()
+        # 係数はplanの定数ごとに持つ。グリッドの点に書いていない定数はplanの値のまま
+        self.riseup_defaults = dict(plan.riseup_levels)
+        self.product_free_defaults = dict(plan.product_free_amounts)
+        self.riseup_keys = list(self.riseup_defaults)
+        self.product_free_keys = list(self.product_free_defaults)
+        self.matching_rates = compiled.matching_rates
+        self.total_paid = int(forest.paid_point.sum())
+        binary = [getattr(forest, column) for column in BINARY_COLUMNS]
+
+        # 単価を1つだけ1円にしたときの金額が、その単価の係数になる
+        def unit(keys: Sequence[str], key: str) -> Dict[str, int]:
+            return {other: int(other == key) for other in keys}
+
+        # ライズアップは1/4円単位の係数にしておき、単価を掛けて足してから切り捨てる（riseup_bonusと同じ順番）
+        self.riseup_coefficients = np.stack([
+            kernels.riseup_total_quarters(*binary, forest.position_number, unit(self.riseup_keys, key), plan.riseup_breakpoints)
+            for key in self.riseup_keys
+        ], axis=1)
+        self.product_free_coefficients = np.stack([
+            kernels.product_free_bonus(*binary, forest.position_number, unit(self.product_free_keys, key), plan.product_free_exact)
+            for key in self.product_free_keys
+        ], axis=1)
+
+        # マッチングボーナスを上に足し上げるための、親ごとにまとめた直１の並び
+        children = np.flatnonzero(forest.parent >= 0)
+        children = children[np.argsort(forest.parent[children], kind='stable')]
+        parents = forest.parent[children]
+        starts = np.flatnonzero(np.r_[True, parents[1:] != parents[:-1]]) if len(children) else np.zeros(0, dtype=np.int64)
+        self._children = children
+        self._parents = parents[starts]
+        self._starts = starts
+
+        # アクティブでない会員のbonus_pointは前のシーズンのまま合計に入る（BonusLedger.total_bonusと同じ）
+        self.inactive_bonus = int(forest.bonus_point[~self.active].sum())
+        # カー・ハウス・シェアリングボーナスは支払いの定数によらない
+        self.fixed = {
+            'car_bonus': compiled.car_bonus(forest.title_rank, forest.past_title_rank),
+            'house_bonus': compiled.house_bonus(forest.title_rank, forest.past_title_rank),
+            'sharing_bonus': compiled.sharing_bonus(forest.title_rank, self.total_paid),
+        }
+
+    def _matching(self, base: np.ndarray) -> np.ndarray:
+        """kernels.matching_bonusの、列（グリッドの点）ごとにまとめて計算する版"""
+        carry = np.where(self.active[:, None], base, 0)
+        total = np.zeros_like(carry)
+        for rate in self.matching_rates:
+            reached = np.zeros_like(carry)
+            if len(self._children):
+                reached[self._parents] = np.add.reduceat(carry[self._children], self._starts, axis=0)
+            total += reached * rate
+            carry = np.where(self.active[:, None], reached, 0)
+        return total // 100
+
+    def _summarize(self, amounts: np.ndarray) -> List[List[int]]:
+        """アクティブな会員の分の、列ごとの [合計金額, 発生件数]"""
+        amounts = amounts[self.active]
+        return [[int(amount), int(count)] for amount, count in zip(amounts.sum(axis=0), (amounts > 0).sum(axis=0))]
+
+    def _chunks(self, count: int):
+        step = max(1, _CHUNK_CELLS // max(self.size, 1))
+        for start in range(0, count, step):
+            yield start, min(start + step, count)
+
+    def fixed_summary(self) -> Dict[str, List[int]]:
+        """カー・ハウス・シェアリングボーナスの [合計金額, 発生件数]"""
+        return {bonus_type: self._summarize(amount[:, None])[0] for bonus_type, amount in self.fixed.items()}
+
+    def riseup_pass(self, riseup_grid: Sequence[Dict[str, int]]) -> List[Dict[str, List[int]]]: #ライズアップの定数ごとの集計。
+        """ライズアップボーナスとマッチングボーナス（app.pyと同じくライズアップの足し上げ）の集計を、グリッドの点ごとに返す"""
+        riseup_grid = [complete_params(params, self.riseup_defaults, 'riseup_levels') for params in riseup_grid]
+        levels = np.array([[kernels.as_yen(params[key]) for key in self.riseup_keys] for params in riseup_grid], dtype=np.int64).reshape(-1, len(self.riseup_keys))
+        results = []
+        for start, end in self._chunks(len(levels)):
+            riseup = (self.riseup_coefficients @ levels[start:end].T) // 4
+            matching = self._matching(riseup)
+            for riseup_summary, matching_summary in zip(self._summarize(riseup), self._summarize(matching)):
+                results.append({'riseup_binary_bonus': riseup_summary, 'matching_bonus': matching_summary})
+        return results
+
+    def product_free_pass(self, product_free_grid: Sequence[Dict[str, int]]) -> List[List[int]]: #プロダクトフリーの定数ごとの集計。
+        """プロダクトフリーボーナスの [合計金額, 発生件数] を、グリッドの点ごとに返す"""
+        product_free_grid = [complete_params(params, self.product_free_defaults, 'product_free_amounts') for params in product_free_grid]
+        amounts = np.array([[kernels.as_yen(params[key]) for key in self.product_free_keys] for params in product_free_grid], dtype=np.int64).reshape(-1, len(self.product_free_keys))
+        results = []
+        for start, end in self._chunks(len(amounts)):
+            results.extend(self._summarize(self.product_free_coefficients @ amounts[start:end].T))
+        return results
+
+
+def sweep_bonus_params(forest: Forest, riseup_grid: Sequence[Dict[str, int]], product_free_grid: Sequence[Dict[str, int]],
+                       plan: PlanDefinition = APP_DEFINITION) -> List[SweepPoint]: #ボーナスの定数をまとめて試す関数。
+    """ライズアップの定数×プロダクトフリーの定数の全部の組み合わせについて、ボーナスの集計を返す
+
+    forestはバイナリーのサイズとタイトルランクが計算済みのもの（build_bonus_ledgerに渡すのと同じ状態）。
+    ライズアップとプロダクトフリーの定数以外の規則はplan（既定はapp.pyの規則のplan.APP_DEFINITION）のもの。
+    グリッドの点に書いていない定数はplanの値になり、planにない定数を書くとValueError。
+    SweepPointのパラメータは、planの値で埋めた実際に使った定数。
+    ライズアップとプロダクトフリーは互いに影響しないので、計算はそれぞれの点の数の分だけで済む。
+    結果の並びはriseup_gridが外側、product_free_gridが内側。
+    """
+    if not riseup_grid or not product_free_grid:
+        return []
+    structure = SweepStructure(forest, plan)
+    riseup_grid = [complete_params(params, structure.riseup_defaults, 'riseup_levels') for params in riseup_grid]
+    product_free_grid = [complete_params(params, structure.product_free_defaults, 'product_free_amounts')
+                         for params in product_free_grid]
+    riseup_results = structure.riseup_pass(riseup_grid)
+    product_free_results = structure.product_free_pass(product_free_grid)
+    fixed = structure.fixed_summary()
+    fixed_total = sum(amount for amount, _ in fixed.values()) + structure.inactive_bonus
+
+    points = []
+    for riseup_params, riseup_result in zip(riseup_grid, riseup_results):
+        for product_free_params, product_free_result in zip(product_free_grid, product_free_results):
+            summary = {
+                'riseup_binary_bonus': list(riseup_result['riseup_binary_bonus']),
+                'product_free_bonus': list(product_free_result),
+                'matching_bonus': list(riseup_result['matching_bonus']),
+                **{bonus_type: list(value) for bonus_type, value in fixed.items()},
+            }
+            total_bonus = riseup_result['riseup_binary_bonus'][0] + riseup_result['matching_bonus'][0] + product_free_result[0] + fixed_total
+            points.append(SweepPoint(dict(riseup_params), dict(product_free_params), summary, total_bonus, structure.total_paid))
+    return points
@@ -0,0 +1,194 @@
+"""最初のnode_class.Nodeのメソッドを、そのまま関数にしたもの
+
+一括計算（tree_engine、kernels、Forest）がこれと同じ値になることをテストで確かめる。
+"""
+
+
+def tree_number(node) -> int:
+    """calculate_tree_number"""
+    count = 1  # 自分自身をカウント
+    for child in node.children:
+        if child.active:
+            count += tree_number(child)
+    return count
+
+
+def _by_position(node, bonus_for_binary):
+    bonus = 0
+    if node.position_number >= 1:
+        bonus += bonus_for_binary(node.binary_number_1)
+    if node.position_number >= 3:
+        bonus += bonus_for_binary(node.binary_number_3)
+    if node.position_number >= 5:
+        bonus += bonus_for_binary(node.binary_number_5)
+    if node.position_number >= 7:
+        bonus += bonus_for_binary(node.binary_number_7)
+    return bonus
+
+
+def riseup_bonus_for_binary(binary_number: int) -> float:
+    if 4 <= binary_number <= 60:
+        return 3000 * binary_number / 4
+    elif 64 <= binary_number <= 200:
+        return 3000 * 15 + 4000 * (binary_number - 60) / 4
+    elif 204 <= binary_number <= 2000:
+        return 3000 * 15 + 4000 * 35 + 5000 * (binary_number - 200) / 4
+    elif 2004 <= binary_number <= 20000:
+        return 3000 * 15 + 4000 * 35 + 5000 * 450 + 2000 * (binary_number - 2000) / 4
+    elif binary_number > 20000:
+        return 3000 * 15 + 4000 * 35 + 5000 * 450 + 2000 * 4500
+    return 0
+
+
+def riseup_binary_bonus(node) -> int:
+    """calculate_riseup_binary_bonus"""
+    return int(_by_position(node, riseup_bonus_for_binary))
+
+
+def product_free_bonus_for_binary(binary_number: int) -> int:
+    if binary_number == 4:
+        return 10000
+    elif binary_number == 8:
+        return 7000
+    elif binary_number == 12:
+        return 4000
+    elif binary_number == 16:
+        return 1000
+    return 0
+
+
+def product_free_bonus(node) -> int:
+    """calculate_product_free_bonus"""
+    return _by_position(node, product_free_bonus_for_binary)
+
+
+def matching_bonus(node) -> int:
+    """calculate_matching_bonus"""
+    bonus = 0
+    for child in node.children:
+        if child.active:
+            bonus += product_free_bonus(child) * 0.15
+            for grandchild in child.children:
+                if grandchild.active:
+                    bonus += product_free_bonus(grandchild) * 0.05
+                    for great_grandchild in grandchild.children:
+                        if great_grandchild.active:
+                            bonus += product_free_bonus(great_grandchild) * 0.05
+    return int(bonus)
+
+
+def rank_for(tree_size: int, active_children: int) -> int:
+    """update_title_rankの条件の判定"""
+    rank_conditions = [
+        (20, 2, 1), (60, 3, 2), (200, 4, 3),
+        (600, 5, 4), (1000, 7, 5), (2000, 10, 6),
+        (4000, 10, 7), (6000, 10, 8), (10000, 10, 9),
+        (20000, 10, 10)
+    ]
+    title_rank = 0
+    for tree_req, children_req, rank in rank_conditions:
+        if tree_size >= tree_req and active_children >= children_req:
+            title_rank = rank
+    return title_rank
+
+
+def title_rank(node) -> int:
+    """update_title_rankで決まるtitle_rank"""
+    return rank_for(tree_number(node), len([child for child in node.children if child.active]))
+
+
+def process_bank_number(node, node1, node2) -> None:
+    """process_bank_number（バンクナンバーを1ずつ使う元の書き方）"""
+    if not node1 or not node2:
+        return
+    tree1 = node1.tree_number
+    tree2 = node2.tree_number
+    if tree1 != tree2:
+        while node.bank_number > 0 and tree2 < tree1:
+            tree2 += 1
+            node.bank_number -= 1
+        diff = min(tree1 - tree2, 2)
+        if diff > 0:
+            node.bank_number = min(node.bank_number + diff, 2)
+
+
+def calculate_binary_numbers(node) -> None:
+    """calculate_binary_numbers（直１を全員ソートする元の書き方）"""
+    active_children = sorted(
+        [child for child in node.children if child.active],
+        key=lambda x: x.tree_number,
+        reverse=True
+    )
+    if not active_children:
+        return
+
+    if node.position_number >= 1 and len(active_children) >= 2:
+        node1, node2 = active_children[0:2]
+        node.binary_number_1 = (min(node1.tree_number, node2.tree_number) - 1) * 2
+        process_bank_number(node, node1, node2)
+
+    if node.position_number >= 3 and len(active_children) >= 4:
+        node3, node4 = active_children[2:4]
+        node.binary_number_3 = (min(node3.tree_number, node4.tree_number) - 1) * 2
+        process_bank_number(node, node3, node4)
+
+    if node.position_number >= 5 and len(active_children) >= 6:
+        node5, node6 = active_children[4:6]
+        node.binary_number_5 = (min(node5.tree_number, node6.tree_number) - 1) * 2
+        process_bank_number(node, node5, node6)
+
+    if node.position_number >= 7 and len(active_children) >= 8:
+        node7, node8 = active_children[6:8]
+        node.binary_number_7 = (min(node7.tree_number, node8.tree_number) - 1) * 2
+        process_bank_number(node, node7, node8)
+
+
+def car_bonus(node) -> int:
+    """calculate_car_bonus"""
+    if node.title_rank >= 4 and node.past_title_rank >= 4:
+        return 100000
+    return 0
+
+
+def house_bonus(node) -> int:
+    """calculate_house_bonus"""
+    if node.title_rank >= 5 and node.past_title_rank >= 5:
+        return 150000
+    return 0
+
+
+def sharing_bonus(node, total_paid_points: int) -> int:
+    """calculate_sharing_bonus"""
+    if node.title_rank == 3:
+        return int(total_paid_points * 0.01)
+    elif node.title_rank >= 4:
+        return int(total_paid_points * 0.002)
+    return 0
+
+
+# 最初のapp.pyのNodeの規則（定数は画面から渡す。プロダクトフリーは範囲で判定する）
+def app_riseup_bonus_for_binary(binary_number: int, bonus_params) -> float:
+    if 4 <= binary_number <= 60:
+        return bonus_params["level1"] * binary_number / 4
+    elif 64 <= binary_number <= 200:
+        return bonus_params["level1"] * 15 + bonus_params["level2"] * (binary_number - 60) / 4
+    elif 204 <= binary_number <= 2000:
+        return bonus_params["level1"] * 15 + bonus_params["level2"] * 35 + bonus_params["level3"] * (binary_number - 200) / 4
+    elif 2004 <= binary_number <= 20000:
+        return bonus_params["level1"] * 15 + bonus_params["level2"] * 35 + bonus_params["level3"] * 450 + bonus_params["level4"] * (binary_number - 2000) / 4
+    elif binary_number > 20000:
+        return bonus_params["level1"] * 15 + bonus_params["level2"] * 35 + bonus_params["level3"] * 450 + bonus_params["level4"] * 4500
+    return 0
+
+
+def app_product_free_bonus_for_binary(binary_number: int, bonus_pf) -> int:
+    if binary_number >= 4 and binary_number < 8:
+        return bonus_pf["pf4"]
+    elif binary_number >= 8 and binary_number < 12:
+        return bonus_pf["pf8"]
+    elif binary_number >= 12 and binary_number < 16:
+        return bonus_pf["pf12"]
+    elif binary_number == 16:
+        return bonus_pf["pf16"]
+    else:
+        return 0
@@ -0,0 +1,94 @@
+import os
+import random
+import sys
+from typing import List
+
+import numpy as np
+import pytest
+
+# モジュールはリポジトリの直下に並んでいるので、testsの1つ上をimportできるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from forest import Forest, INT_COLUMNS
+from generators import galton_watson, preferential_attachment, sponsor_chains
+from node_class import Node
+from season_runner import SeasonRunner
+from tree_engine import build_hierarchy
+
+
+def random_nodes(size: int, seed: int, roots: int = 2) -> List[Node]: #親子関係をつないだランダムなNodeのリストを作る関数。
+    """紹介者は自分より前の会員から等確率に選ぶ。ポジション数とアクティブかどうかもランダム"""
+    rng = random.Random(seed)
+    nodes = []
+    for i in range(size):
+        parent = nodes[rng.randrange(i)].name if i >= roots else None
+        nodes.append(Node(name=f"Node_{i + 1}", position_number=rng.choice([1, 3, 5, 7]),
+                          active=rng.random() < 0.85, parent_node=parent))
+    build_hierarchy(nodes)
+    return nodes
+
+
+def seasoned(forest: Forest, seed: int) -> Forest:
+    """バンクナンバー・支払い・タイトルランクに値を入れて、何シーズンか回した後のような状態にする"""
+    rng = np.random.default_rng(seed)
+    size = len(forest)
+    forest.bank_number = rng.integers(0, 3, size)
+    forest.paid_point = rng.integers(0, 5, size) * 20790
+    forest.total_paid_point = forest.paid_point + rng.integers(0, 10, size) * 20790
+    forest.title_rank = rng.integers(0, 8, size)
+    forest.compute_tree_numbers()
+    return forest
+
+
+def clone(forest: Forest) -> Forest:
+    """列をすべて持った別のForest（同じネットワークで2通りの計算を比べるため）"""
+    return Forest.from_arrays(list(forest.names), forest.parent, forest.active, depth=forest.depth,
+                              unresolved_parents=forest.unresolved_parents,
+                              **{column: getattr(forest, column) for column in INT_COLUMNS})
+
+
+def assert_same_state(a: Forest, b: Forest) -> None:
+    assert list(a.names) == list(b.names)
+    assert np.array_equal(a.parent, b.parent)
+    assert np.array_equal(a.active, b.active)
+    for column in INT_COLUMNS:
+        assert np.array_equal(getattr(a, column), getattr(b, column)), column
+
+
+@pytest.fixture(params=['preferential', 'bushy', 'chains'])
+def network(request) -> Forest:
+    """直１が集中するネットワーク、直１が多くてバイナリーが4本そろうネットワーク、深い一本道のネットワーク"""
+    if request.param == 'preferential':
+        return seasoned(preferential_attachment(3000, roots=3, rng=1), seed=1)
+    if request.param == 'bushy':
+        forest = galton_watson([0.35] + [0.65 / 12] * 12, 4000, roots=2, rng=3)
+        forest.position_number = np.full(len(forest), 7, dtype=np.int64)
+        return seasoned(forest, seed=3)
+    return seasoned(sponsor_chains(300, chains=4, rng=2), seed=2)
+
+
+# 結果のファイルのテスト（result_writer、delta_output）で回すシーズン数
+SEASONS = 5
+
+
+def run_seasons(forest: Forest, **kwargs) -> None:
+    """4シーズン目の前に、名前が重複する会員と新しい会員の下の会員を足しながらSEASONSシーズン回す"""
+    runner = SeasonRunner(forest, **kwargs)
+    for season in range(SEASONS):
+        if season == 3:
+            forest.append_members([forest.names[0], 'new_a', 'new_b'], [-1, 0, len(forest) + 1])
+        runner.run_season()
+
+
+def read_bytes(path) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def synchronous(network, tmp_path):
+    """今まで通りその場で書いたnodes.csvとpoints.csvのディレクトリ"""
+    # ファイルにあった親が見つからない会員のparent_nodeも、そのまま書き戻されること
+    network.unresolved_parents = {int(network.roots()[-1]): 'someone_outside'}
+    run_seasons(clone(network), output_dir=str(tmp_path / "sync"))
+    return tmp_path / "sync"
@@ -0,0 +1,37 @@
+import itertools
+from types import SimpleNamespace
+
+import numpy as np
+
+import baseline
+import kernels
+
+
+def test_settle_bank_numbers_matches_process_bank_number_for_every_gap():
+    # バンク0～2と、ペアごとの左右の大きさ（差0～5と大きな差）の全部の組み合わせを、2ペア続けて処理する
+    sizes = [(tree1, tree2) for tree1 in (1, 2, 3, 5, 7, 500) for tree2 in (1, 2, 3, 5, 7, 500) if tree1 >= tree2]
+    cases = list(itertools.product(range(3), sizes, sizes, (True, False)))
+    bank = np.array([case[0] for case in cases], dtype=np.int64)
+    legs = np.zeros((len(cases), 8), dtype=np.int64)
+    paired = np.zeros((len(cases), 4), dtype=bool)
+    for row, (_, first, second, second_paired) in enumerate(cases):
+        legs[row, :4] = [*first, *second]
+        paired[row, 0] = True
+        paired[row, 1] = second_paired
+
+    settled = kernels.settle_bank_numbers(bank, legs, paired)
+    for row, (start, first, second, second_paired) in enumerate(cases):
+        member = SimpleNamespace(bank_number=start)
+        for (tree1, tree2), used in ((first, True), (second, second_paired)):
+            if used:
+                baseline.process_bank_number(member, SimpleNamespace(tree_number=tree1), SimpleNamespace(tree_number=tree2))
+        assert settled[row] == member.bank_number, (start, first, second, second_paired)
+
+
+def test_bank_numbers_match_calculate_binary_numbers(network):
+    nodes = network.to_nodes()
+    for node in nodes:
+        if node.active:
+            baseline.calculate_binary_numbers(node)
+    network.calculate_binary_numbers()
+    assert network.bank_number.tolist() == [node.bank_number for node in nodes]
@@ -0,0 +1,12 @@
+import baseline
+from forest import BINARY_COLUMNS
+
+
+def test_binary_numbers_match_calculate_binary_numbers(network):
+    nodes = network.to_nodes()
+    for node in nodes:
+        if node.active:
+            baseline.calculate_binary_numbers(node)
+    network.calculate_binary_numbers()
+    for column in BINARY_COLUMNS:
+        assert getattr(network, column).tolist() == [getattr(node, column) for node in nodes], column
@@ -0,0 +1,113 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from conftest import clone
+from delta import MemberEvent, apply_delta, load_delta_csv
+from forest import BINARY_COLUMNS, INT_COLUMNS
+from plan import STANDARD_PLAN
+
+
+def random_events(forest, rng, round_number):
+    """参加（新しい会員の下への参加も含む）・アクティブ化・非アクティブ化・ポジション変更を混ぜたイベント"""
+    size = len(forest)
+    events = []
+    for k in range(6):
+        parent = forest.names[int(rng.integers(size))] if k % 3 else None
+        events.append(MemberEvent('join', f"r{round_number}_{k}", parent, int(rng.choice([1, 3, 5, 7])), bool(k % 4)))
+    events.append(MemberEvent('join', f"r{round_number}_under", f"r{round_number}_1", 3))
+    inactive = np.flatnonzero(~forest.active)
+    active = np.flatnonzero(forest.active)
+    for i in rng.choice(inactive, size=min(20, len(inactive)), replace=False).tolist():
+        events.append(MemberEvent('activate', forest.names[i]))
+    for i in rng.choice(active, size=20, replace=False).tolist():
+        events.append(MemberEvent('deactivate', forest.names[i]))
+    for i in rng.choice(size, size=10, replace=False).tolist():
+        events.append(MemberEvent('position', forest.names[i], position_number=int(rng.choice([1, 3, 5, 7]))))
+    # 同じ会員が何度も変わったときは最後の状態になる
+    events.append(MemberEvent('activate', events[-1].name))
+    events.append(MemberEvent('deactivate', events[-1].name))
+    return events
+
+
+def apply_in_full(forest, events):
+    """イベントを列に反映してから、compute_tree_numbersとタイトルの判定を全員分やり直す"""
+    for event in events:
+        if event.kind == 'join':
+            parent = forest.index_of(event.parent_node) if event.parent_node else -1
+            forest.append_members([event.name], [parent], [event.active], position_number=[event.position_number])
+            continue
+        i = forest.index_of(event.name)
+        if event.kind == 'activate':
+            forest.active[i] = True
+            forest.paid_point[i] += STANDARD_PLAN.activation_fee
+            forest.total_paid_point[i] += STANDARD_PLAN.activation_fee
+        elif event.kind == 'deactivate':
+            forest.active[i] = False
+        elif event.kind == 'position':
+            forest.position_number[i] = event.position_number
+            forest.paid_point[i] += STANDARD_PLAN.position_costs[event.position_number]
+            forest.total_paid_point[i] += STANDARD_PLAN.position_costs[event.position_number]
+    forest.compute_tree_numbers()
+    forest.title_rank = STANDARD_PLAN.title_ranks(forest.tree_number, forest.active_children_number)
+
+
+def test_apply_delta_matches_full_recalculation(network):
+    network.update_title_ranks()
+    network.calculate_binary_numbers()
+    incremental = clone(network)
+    rng = np.random.default_rng(7)
+    for round_number in range(3):
+        events = random_events(incremental, rng, round_number)
+        full = clone(incremental)
+        result = apply_delta(incremental, events)
+        apply_in_full(full, events)
+        # バイナリーのサイズとbank_numberは、計算し直した会員だけを一括版で計算したのと同じ
+        rebinarized = np.zeros(len(full), dtype=bool)
+        rebinarized[result.rebinarized] = True
+        full.calculate_binary_numbers(members=rebinarized)
+
+        assert list(incremental.names) == list(full.names)
+        for column in ('parent', 'active', 'depth', 'position_number', 'tree_number', 'active_children_number',
+                       'title_rank', 'past_title_rank', 'paid_point', 'total_paid_point', 'bank_number', *BINARY_COLUMNS):
+            assert np.array_equal(getattr(incremental, column), getattr(full, column)), (round_number, column)
+        assert np.array_equal(incremental.order, np.argsort(incremental.depth, kind='stable'))
+
+        # 全員分のバイナリーを計算し直しても、計算し直さなかった会員のサイズは変わらない
+        everyone = clone(full)
+        everyone.calculate_binary_numbers()
+        for column in BINARY_COLUMNS:
+            assert np.array_equal(getattr(everyone, column)[incremental.active], getattr(incremental, column)[incremental.active]), column
+
+
+def test_apply_delta_leaves_earlier_states_alone(network):
+    network.calculate_binary_numbers()
+    earlier = replace(network)
+    expected = clone(network)
+    apply_delta(network, random_events(network, np.random.default_rng(8), 0))
+    # 浅いコピー（app.pyが残すシーズンごとの状態など）の列は書き換わらない
+    assert np.array_equal(earlier.active, expected.active)
+    for column in INT_COLUMNS:
+        assert np.array_equal(getattr(earlier, column), getattr(expected, column)), column
+    assert not np.array_equal(network.active, earlier.active)
+
+
+def test_apply_delta_rejects_unknown_and_existing_members(network):
+    with pytest.raises(ValueError, match="unknown member"):
+        apply_delta(network, [MemberEvent('activate', 'nobody')])
+    with pytest.raises(ValueError, match="already exists"):
+        apply_delta(network, [MemberEvent('join', network.names[0])])
+
+
+def test_load_delta_csv_parses_active_strictly(tmp_path):
+    filename = tmp_path / "delta.csv"
+    filename.write_text("event,name,parent_node,position_number,active\n"
+                        "join,a,,3,false\njoin,b,a,,TRUE\njoin,c,a,1,\n", encoding='utf-8')
+    events = load_delta_csv(str(filename))
+    assert [event.active for event in events] == [False, True, True]
+    assert [event.position_number for event in events] == [3, 1, 1]
+
+    filename.write_text("event,name,parent_node,position_number,active\njoin,a,,3,0\n", encoding='utf-8')
+    with pytest.raises(ValueError, match="active must be True or False"):
+        load_delta_csv(str(filename))
@@ -0,0 +1,60 @@
+import csv
+import os
+
+import pytest
+
+from conftest import SEASONS, clone, read_bytes, run_seasons
+from delta_output import DeltaResultWriter, read_season_nodes, rebuild_season_csv
+from result_writer import open_result
+
+
+def expected_rows(synchronous, season):
+    with open(synchronous / f"season_{season:04d}_nodes.csv", newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_delta_output_rebuilds_every_season(network, synchronous, tmp_path):
+    output_dir = str(tmp_path / "delta")
+    with DeltaResultWriter(output_dir, 'gzip', base_every=3) as writer:
+        run_seasons(network, writer=writer)
+    names = sorted(os.listdir(output_dir))
+    assert 'season_0003_nodes.csv.gz' in names and 'season_0004_nodes_delta.csv.gz' in names
+
+    for season in range(1, SEASONS + 1):
+        header, rows = read_season_nodes(output_dir, season)
+        assert [list(header), *rows] == expected_rows(synchronous, season), season
+        with open_result(writer.paths(season)['points']) as f:
+            assert f.read().encode('utf-8') == read_bytes(synchronous / f"season_{season:04d}_points.csv")
+
+    rebuilt = str(tmp_path / "season_0005_nodes_full.csv")
+    rebuild_season_csv(output_dir, SEASONS, rebuilt)
+    assert read_bytes(rebuilt) == read_bytes(synchronous / f"season_{SEASONS:04d}_nodes.csv")
+
+
+@pytest.mark.parametrize('first, second', [(('gzip', 1), ('none', 3)), (('none', 3), ('gzip', 2))])
+def test_rerun_with_another_mode_replaces_old_files(network, synchronous, tmp_path, first, second):
+    output_dir = str(tmp_path / "delta")
+    # 前の実行は別の会員で、別の圧縮とベースの間隔で書いていた
+    stale = clone(network)
+    stale.position_number = stale.position_number * 0 + 1
+    with DeltaResultWriter(output_dir, first[0], base_every=first[1]) as writer:
+        run_seasons(stale, writer=writer)
+    with DeltaResultWriter(output_dir, second[0], base_every=second[1]) as writer:
+        run_seasons(network, writer=writer)
+
+    for season in range(1, SEASONS + 1):
+        header, rows = read_season_nodes(output_dir, season)
+        assert [list(header), *rows] == expected_rows(synchronous, season), season
+    nodes_files = [name for name in os.listdir(output_dir) if '_nodes' in name]
+    assert len(nodes_files) == SEASONS
+
+
+def test_ambiguous_nodes_files_are_rejected(network, tmp_path):
+    output_dir = str(tmp_path / "delta")
+    with DeltaResultWriter(output_dir, 'none') as writer:
+        run_seasons(network, writer=writer)
+    # 別の実行のファイルを後から置いたような、拡張子違いで2つあるシーズンは読まない
+    with open(os.path.join(output_dir, "season_0001_nodes.csv.gz"), 'wb') as f:
+        f.write(b"")
+    with pytest.raises(ValueError, match="more than one nodes file for season 1"):
+        read_season_nodes(output_dir, 3)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from baseline import tree_number
+from conftest import random_nodes
+from forest import Forest, INT_COLUMNS, compute_depths
+from node_class import Node
+
+
+def test_compute_tree_numbers_matches_calculate_tree_number():
+    nodes = random_nodes(2000, seed=2)
+    forest = Forest.from_nodes(nodes)
+    forest.compute_tree_numbers()
+    assert forest.tree_number.tolist() == [tree_number(node) for node in nodes]
+    assert forest.active_children_number.tolist() == [sum(child.active for child in node.children) for node in nodes]
+
+
+def test_to_nodes_round_trips_every_field():
+    nodes = random_nodes(300, seed=3)
+    for k, node in enumerate(nodes):
+        node.bank_number = k % 3
+        node.paid_point = k * 10
+        node.binary_number_5 = k % 7
+    back = Forest.from_nodes(nodes).to_nodes()
+    for original, node in zip(nodes, back):
+        assert (node.name, node.active, node.parent_node) == (original.name, original.active, original.parent_node)
+        for column in INT_COLUMNS:
+            assert getattr(node, column) == getattr(original, column), column
+        assert [child.name for child in node.children] == [child.name for child in original.children]
+
+
+def test_parents_come_before_children_in_order():
+    forest = Forest.from_nodes(random_nodes(500, seed=4))
+    position = np.empty(len(forest), dtype=np.int64)
+    position[forest.order] = np.arange(len(forest))
+    linked = forest.parent >= 0
+    assert np.all(position[forest.parent[linked]] < position[linked])
+    assert np.array_equal(forest.depth[linked], forest.depth[forest.parent[linked]] + 1)
+
+
+def test_parent_cycles_are_rejected():
+    nodes = [Node(name="A", position_number=1, parent_node="B"), Node(name="B", position_number=1, parent_node="A"),
+             Node(name="R", position_number=1)]
+    with pytest.raises(ValueError, match="cycle"):
+        Forest.from_nodes(nodes)
+    with pytest.raises(ValueError, match="cycle"):
+        compute_depths(np.array([1, 2, 0, -1]))
+
+
+def test_unresolved_parent_names_are_written_back():
+    nodes = [Node(name="R", position_number=1), Node(name="A", position_number=1, parent_node="outside"),
+             Node(name="B", position_number=1, parent_node="A")]
+    forest = Forest.from_nodes(nodes)
+    # 親が見つからない会員は始祖会員として計算する
+    assert forest.parent.tolist() == [-1, -1, 1]
+    assert forest.unresolved_parents == {1: "outside"}
+    assert [node.parent_node for node in forest.to_nodes()] == [None, "outside", "A"]
@@ -0,0 +1,83 @@
+from dataclasses import replace
+
+import pytest
+
+from forest import Forest
+from generators import preferential_attachment
+from history import SeasonHistory
+from ledger import build_bonus_ledger
+from plan import CAR_BONUS, HOUSE_BONUS, STANDARD_DEFINITION
+from season_runner import SeasonRunner
+
+
+def run_history(filename, seasons: int, run_id=None) -> SeasonHistory:
+    history = SeasonHistory(filename, run_id)
+    SeasonRunner(preferential_attachment(2000, roots=3, rng=4), history=history).run(seasons)
+    return history
+
+
+def test_history_records_every_season_of_a_run(tmp_path):
+    filename = str(tmp_path / "history.sqlite")
+    with run_history(filename, 4) as history:
+        assert history.latest_season() == 4
+        summary = history.season_summary(4)
+        assert summary['members'] == 2000
+        ranked = history.members_with_rank(4, 1)
+        assert ranked and all(rank >= 1 for _, rank in ranked)
+        records = history.member_history(ranked[0][0], seasons=3)
+        assert [record['season'] for record in records] == [2, 3, 4]
+
+        # 連続記録は、カー（ハウス）ボーナスのランク以上だったシーズンが何シーズン続いたか
+        for name, _ in ranked[:50]:
+            car = house = 0
+            for record in history.member_history(name):
+                car = car + 1 if record['title_rank'] >= CAR_BONUS["rank"] else 0
+                house = house + 1 if record['title_rank'] >= HOUSE_BONUS["rank"] else 0
+                assert (record['car_streak'], record['house_streak']) == (car, house)
+
+
+def test_streaks_follow_the_plan_of_the_runner(tmp_path):
+    definition = replace(STANDARD_DEFINITION, car_bonus={"rank": 1, "amount": 100000},
+                         house_bonus={"rank": 2, "amount": 150000})
+    with SeasonHistory(str(tmp_path / "history.sqlite")) as history:
+        SeasonRunner(preferential_attachment(2000, roots=3, rng=4), history=history, plan=definition.compile()).run(3)
+        for name, rank in history.members_with_rank(3, 1)[-20:]:
+            car = house = 0
+            for record in history.member_history(name):
+                car = car + 1 if record['title_rank'] >= 1 else 0
+                house = house + 1 if record['title_rank'] >= 2 else 0
+                # 台帳でカーボーナスが出る会員は、前のシーズンから続けてランク以上
+                assert (record['car_bonus'] > 0) == (car >= 2)
+                assert (record['car_streak'], record['house_streak']) == (car, house)
+
+
+def test_runs_are_kept_apart(tmp_path):
+    filename = str(tmp_path / "history.sqlite")
+    first = run_history(filename, 3)
+    first.close()
+    with run_history(filename, 2) as second:
+        assert second.run_id != first.run_id
+        assert second.latest_season() == 2
+    with SeasonHistory.latest_run(filename) as latest:
+        assert latest.run_id == second.run_id
+    with SeasonHistory(filename, first.run_id) as reopened:
+        assert reopened.latest_season() == 3
+    with pytest.raises(ValueError, match="run 99"):
+        SeasonHistory(filename, 99)
+
+
+def test_history_is_append_only_and_rejects_duplicate_names(tmp_path):
+    forest = preferential_attachment(100, rng=5)
+    forest.compute_tree_numbers()
+    ledger = build_bonus_ledger(forest)
+    with SeasonHistory(str(tmp_path / "history.sqlite")) as history:
+        history.record_season(1, forest, ledger)
+        with pytest.raises(ValueError, match="append-only"):
+            history.record_season(1, forest, ledger)
+
+        twins = Forest.from_arrays(["a", "a"], [-1, 0])
+        twins.compute_tree_numbers()
+        with pytest.raises(ValueError, match="duplicate member names"):
+            history.record_season(2, twins, build_bonus_ledger(twins))
+        assert history.latest_season() == 1
+        assert history.season_summary(2) is None
@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import baseline
+import kernels
+from plan import RISEUP_BREAKPOINTS, RISEUP_LEVELS, PRODUCT_FREE_AMOUNTS
+
+
+@pytest.mark.parametrize('position_number', [0, 1, 3, 5, 7])
+def test_riseup_and_product_free_match_for_every_binary_size(position_number):
+    # 段階の境目と上限を越えるまでの全部の偶数のサイズ（バイナリーのサイズは(min-1)*2なので偶数）。4本は別々に並べ替える
+    rng = np.random.default_rng(position_number)
+    binary = [rng.permutation(np.arange(0, 20100, 2, dtype=np.int64)) for _ in range(4)]
+    position = np.full(len(binary[0]), position_number, dtype=np.int64)
+
+    riseup = kernels.riseup_bonus(*binary, position, RISEUP_LEVELS, RISEUP_BREAKPOINTS)
+    product_free = kernels.product_free_bonus(*binary, position, PRODUCT_FREE_AMOUNTS)
+    for i in range(len(position)):
+        member = SimpleNamespace(position_number=position_number, binary_number_1=int(binary[0][i]),
+                                 binary_number_3=int(binary[1][i]), binary_number_5=int(binary[2][i]),
+                                 binary_number_7=int(binary[3][i]))
+        assert riseup[i] == baseline.riseup_binary_bonus(member)
+        assert product_free[i] == baseline.product_free_bonus(member)
+
+
+def test_fractional_amounts_are_rejected():
+    with pytest.raises(ValueError, match="whole yen"):
+        kernels.riseup_lookup({**RISEUP_LEVELS, "level1": 3000.5}, RISEUP_BREAKPOINTS)
@@ -0,0 +1,48 @@
+import io
+
+import numpy as np
+
+import baseline
+from ledger import BONUS_TYPES, build_bonus_ledger, write_points
+from season_runner import activate_all
+
+
+def test_ledger_matches_the_node_bonus_methods(network):
+    network.update_title_ranks()
+    network.calculate_binary_numbers()
+    nodes = network.to_nodes()
+    total_paid_points = sum(node.paid_point for node in nodes)
+    bonus_before = network.bonus_point.copy()
+    ledger = build_bonus_ledger(network)
+
+    expected = {
+        'riseup_binary_bonus': [baseline.riseup_binary_bonus(node) for node in nodes],
+        'product_free_bonus': [baseline.product_free_bonus(node) for node in nodes],
+        'matching_bonus': [baseline.matching_bonus(node) for node in nodes],
+        'car_bonus': [baseline.car_bonus(node) for node in nodes],
+        'house_bonus': [baseline.house_bonus(node) for node in nodes],
+        'sharing_bonus': [baseline.sharing_bonus(node, total_paid_points) for node in nodes],
+    }
+    for bonus_type in BONUS_TYPES:
+        amounts = [amount if node.active else 0 for node, amount in zip(nodes, expected[bonus_type])]
+        assert ledger.components[bonus_type].tolist() == amounts, bonus_type
+        assert ledger.summary[bonus_type] == [sum(amounts), sum(amount > 0 for amount in amounts)]
+
+    # アクティブでない会員のbonus_pointは前のまま
+    total = sum(ledger.components.values())
+    assert np.array_equal(network.bonus_point, np.where(network.active, total, bonus_before))
+    assert ledger.total_paid == total_paid_points
+    assert ledger.total_bonus == int(network.bonus_point.sum())
+
+
+def test_points_file_carries_the_totals_after_activation(network):
+    network.update_title_ranks()
+    network.calculate_binary_numbers()
+    ledger = build_bonus_ledger(network)
+    activate_all(network)
+    f = io.StringIO()
+    write_points(ledger.with_totals_of(network), f)
+    lines = f.getvalue().splitlines()
+    assert lines[1] == f"total_paid,{int(network.paid_point.sum())},N/A"
+    assert lines[-2] == f"all_seasons_total_paid,{int(network.total_paid_point.sum())},N/A"
+    assert lines[-1] == f"all_seasons_total_bonus,{int(network.total_bonus_point.sum())},N/A"
@@ -0,0 +1,34 @@
+import random
+
+import numpy as np
+
+import baseline
+import kernels
+from conftest import random_nodes
+from forest import Forest
+from plan import MATCHING_RATES
+from tree_engine import rollup_matching_bonus
+
+
+def nodes_with_binaries(seed):
+    nodes = random_nodes(3000, seed=seed)
+    rng = random.Random(seed)
+    for node in nodes:
+        # プロダクトフリーボーナスが出るサイズと出ないサイズを混ぜる
+        for column in ('binary_number_1', 'binary_number_3', 'binary_number_5', 'binary_number_7'):
+            setattr(node, column, rng.choice([0, 4, 6, 8, 12, 16, 20]))
+    return nodes
+
+
+def test_rollup_matches_calculate_matching_bonus():
+    nodes = nodes_with_binaries(5)
+    base = [baseline.product_free_bonus(node) for node in nodes]
+    assert rollup_matching_bonus(nodes, base, MATCHING_RATES) == [baseline.matching_bonus(node) for node in nodes]
+
+
+def test_array_matching_matches_calculate_matching_bonus():
+    nodes = nodes_with_binaries(6)
+    forest = Forest.from_nodes(nodes)
+    base = np.array([baseline.product_free_bonus(node) for node in nodes], dtype=np.int64)
+    matching = kernels.matching_bonus(forest.parent, forest.active, base, MATCHING_RATES)
+    assert matching.tolist() == [baseline.matching_bonus(node) for node in nodes]
@@ -0,0 +1,60 @@
+import csv
+
+import numpy as np
+import pytest
+
+from conftest import random_nodes
+from member_loader import INT_FIELDS, iter_member_chunks, iter_member_chunks_parallel
+from node_class import Node
+
+
+@pytest.fixture
+def member_file(tmp_path):
+    nodes = random_nodes(300, seed=11)
+    for i, node in enumerate(nodes):
+        node.paid_point = i * 20790
+        node.bank_number = i % 3
+    filename = tmp_path / "nodes.csv"
+    Node.save_to_csv(nodes, str(filename))
+    return filename
+
+
+def read_with_int(filename):
+    """元のload_from_csvと同じく、1行ずつint()で読んだ列"""
+    with open(filename, newline='') as f:
+        rows = list(csv.DictReader(f))
+    return [row['name'] for row in rows], {field: [int(row[field]) for row in rows] for field in INT_FIELDS}
+
+
+def test_chunks_match_reading_row_by_row(member_file):
+    names, expected = read_with_int(member_file)
+    for chunks in (list(iter_member_chunks(str(member_file), chunk_size=7)),
+                   list(iter_member_chunks_parallel(str(member_file), workers=1, chunk_bytes=500))):
+        assert len(chunks) > 1
+        assert [name for chunk in chunks for name in chunk.names] == names
+        for field in INT_FIELDS:
+            assert np.array_equal(np.concatenate([chunk.columns[field] for chunk in chunks]), expected[field]), field
+
+
+def replace_cells(member_file, field, cells):
+    """cells（{ファイルの行の番号（ヘッダーが0）: 値}）の行のfieldの値を書き換え、最初の行を返す"""
+    rows = list(csv.reader(member_file.read_text().splitlines()))
+    column = rows[0].index(field)
+    for line, cell in cells.items():
+        rows[line][column] = cell
+    with open(member_file, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+    return rows[min(cells)]
+
+
+# '-'（0になる）や、'1,2'と空欄の組（後ろの列がずれる）は、np.fromstringでは黙って読めてしまっていた
+@pytest.mark.parametrize('cells', [{40: '12x'}, {40: ''}, {40: '1.5'}, {40: '99999999999999999999'},
+                                   {40: '-'}, {40: '1,2', 41: ''}])
+def test_malformed_cells_are_rejected_with_the_row(member_file, cells):
+    row = replace_cells(member_file, 'paid_point', cells)
+
+    # 値を読み飛ばしたり、列がずれたりせずに止まる
+    with pytest.raises(ValueError, match=f"invalid paid_point .* for member '{row[0]}' on line 41"):
+        list(iter_member_chunks(str(member_file), chunk_size=16))
+    with pytest.raises(ValueError, match=f"invalid paid_point .* for member '{row[0]}'"):
+        list(iter_member_chunks_parallel(str(member_file), workers=1, chunk_bytes=500))
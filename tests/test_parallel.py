@@ -0,0 +1,37 @@
+import numpy as np
+
+from conftest import assert_same_state, clone
+from parallel import ParallelSeasonRunner, partition_members, root_of
+from season_runner import SeasonRunner
+
+
+def test_partitions_keep_each_subtree_together(network):
+    members, bounds = partition_members(network.parent, 5)
+    assert sorted(members.tolist()) == list(range(len(network)))
+    roots = root_of(network.parent)
+    partition = np.repeat(np.arange(len(bounds) - 1), np.diff(bounds))
+    owner = np.empty(len(network), dtype=np.int64)
+    owner[members] = partition
+    # 同じ始祖会員のサブツリーは同じ区画に入る
+    assert np.array_equal(owner, owner[roots])
+
+
+def test_parallel_runner_matches_serial_runner(network):
+    serial = clone(network)
+    expected = SeasonRunner(serial).run(3)
+    with ParallelSeasonRunner(network, workers=2, partitions=5) as runner:
+        results = runner.run(3)
+    assert results == expected
+    assert_same_state(network, serial)
+
+
+def test_parallel_runner_follows_new_members(network):
+    serial = clone(network)
+    serial_runner = SeasonRunner(serial)
+    with ParallelSeasonRunner(network, workers=2) as runner:
+        for season in range(3):
+            if season == 1:
+                for target in (serial, network):
+                    target.append_members(['new_a', 'new_b', 'new_c'], [0, len(target), -1])
+            assert runner.run_season() == serial_runner.run_season()
+    assert_same_state(network, serial)
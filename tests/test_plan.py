@@ -0,0 +1,59 @@
+import json
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+import baseline
+from conftest import clone
+from ledger import build_bonus_ledger
+from plan import PlanDefinition, STANDARD_DEFINITION, STANDARD_PLAN, APP_DEFINITION, load_plan
+from season_runner import SeasonRunner
+
+
+def test_plan_json_round_trip_gives_the_same_ledger(network, tmp_path):
+    filename = tmp_path / "plan.json"
+    filename.write_text(json.dumps(STANDARD_DEFINITION.to_dict()), encoding='utf-8')
+    plan = load_plan(str(filename))
+    assert plan.definition == STANDARD_DEFINITION
+
+    network.update_title_ranks()
+    network.calculate_binary_numbers()
+    expected = build_bonus_ledger(clone(network), STANDARD_PLAN)
+    ledger = build_bonus_ledger(network, plan)
+    assert ledger.summary == expected.summary
+    for bonus_type, amounts in expected.components.items():
+        assert np.array_equal(ledger.components[bonus_type], amounts), bonus_type
+
+
+def test_app_plan_matches_the_app_rules():
+    rise = {"level1": 3100, "level2": 4200, "level3": 5300, "level4": 2400}
+    pf = {"pf4": 11000, "pf8": 7500, "pf12": 4100, "pf16": 1200}
+    plan = replace(APP_DEFINITION, riseup_levels=rise, product_free_amounts=pf).compile()
+    sizes = np.arange(0, 20100, 2, dtype=np.int64)
+    zeros = np.zeros_like(sizes)
+    position = np.ones_like(sizes)
+    riseup = plan.riseup_bonus(sizes, zeros, zeros, zeros, position)
+    product_free = plan.product_free_bonus(sizes, zeros, zeros, zeros, position)
+    for i, size in enumerate(sizes.tolist()):
+        assert riseup[i] == int(baseline.app_riseup_bonus_for_binary(size, rise))
+        assert product_free[i] == baseline.app_product_free_bonus_for_binary(size, pf)
+
+
+def test_runner_charges_the_activation_fee_of_its_plan(network):
+    plan = replace(STANDARD_DEFINITION, activation_fee=1000).compile()
+    paid = network.paid_point.copy()
+    SeasonRunner(network, plan=plan).run_season()
+    assert np.array_equal(network.paid_point, paid + 1000)
+
+
+@pytest.mark.parametrize('settings', [
+    {'riseup_levels': {'level1': 3000}},
+    {'matching_base': 'car_bonus'},
+    {'sharing_rates': [[4, 0.002], [3, 0.01]]},
+    {'activation_fee': 20790.5},
+    {'no_such_setting': 1},
+])
+def test_broken_plans_are_rejected(settings):
+    with pytest.raises(ValueError):
+        PlanDefinition.from_dict(settings).compile()
@@ -0,0 +1,24 @@
+import json
+
+from forest import Forest
+from generators import preferential_attachment
+from profiler import HOT_FOREST_METHODS, HOT_PLAN_METHODS, Profiler
+from season_runner import SeasonRunner
+
+
+def test_profile_counts_the_methods_a_season_runs(tmp_path):
+    compute_tree_numbers = Forest.__dict__['compute_tree_numbers']
+    profiler = Profiler(str(tmp_path), memory=False)
+    profiler.count_hot_methods()
+    SeasonRunner(preferential_attachment(500, rng=6), profiler=profiler).run(2)
+    profiler.close()
+    assert Forest.__dict__['compute_tree_numbers'] is compute_tree_numbers  # closeで元に戻る
+
+    with open(tmp_path / "profile_season_0002.json") as f:
+        report = json.load(f)
+    assert {record['name'] for record in report['stages']} >= {'tree_numbers', 'title_ranks', 'binary_numbers', 'bonus_ledger'}
+    # シーズンの計算で呼ばれるメソッドは、どれも1回以上数えられる
+    expected = [f"Forest.{name}" for name in HOT_FOREST_METHODS] + [f"CompiledPlan.{name}" for name in HOT_PLAN_METHODS]
+    assert list(report['calls']) == expected
+    assert all(count > 0 for count in report['calls'].values()), report['calls']
+    assert report['calls']['Forest.calculate_binary_numbers'] == 2
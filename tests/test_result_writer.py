@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from conftest import SEASONS, read_bytes, run_seasons
+from result_writer import ResultWriter, open_result
+from season_runner import SeasonRunner
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'none'])
+def test_result_writer_writes_the_same_files(network, synchronous, tmp_path, compression):
+    with ResultWriter(str(tmp_path / "async"), compression, max_pending=1) as writer:
+        run_seasons(network, writer=writer)
+    for season in range(1, SEASONS + 1):
+        for kind, path in writer.paths(season).items():
+            with open_result(path) as f:
+                written = f.read().encode('utf-8')
+            assert written == read_bytes(synchronous / f"season_{season:04d}_{kind}.csv"), (season, kind)
+    assert not [name for name in os.listdir(tmp_path / "async") if name.endswith('.tmp')]
+
+
+def test_result_writer_reports_failed_writes(network, tmp_path):
+    output_dir = tmp_path / "gone"
+    writer = ResultWriter(str(output_dir), 'gzip')
+    os.rmdir(output_dir)
+    SeasonRunner(network, writer=writer).run_season()
+    with pytest.raises(RuntimeError, match="writing season results failed"):
+        writer.close()
@@ -0,0 +1,33 @@
+import os
+
+from conftest import assert_same_state, clone
+from history import SeasonHistory
+from season_runner import SeasonRunner, read_checkpoint
+
+
+def test_resume_continues_like_an_uninterrupted_run(network, tmp_path):
+    expected = clone(network)
+    expected_results = SeasonRunner(expected).run(5)
+
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    history_file = str(tmp_path / "history.sqlite")
+    with SeasonHistory(history_file) as history:
+        results = SeasonRunner(network, checkpoint_dir=checkpoint_dir, checkpoint_every=2, history=history).run(3)
+        run_id = history.run_id
+    # 3シーズン目まで計算して落ちた、として最後のチェックポイントから続ける
+    state = read_checkpoint(checkpoint_dir)
+    assert state == {"season": 3, "snapshot": "season_000003.snap", "history_run": run_id}
+    with SeasonHistory(history_file, run_id=state["history_run"]) as history:
+        runner = SeasonRunner.resume(checkpoint_dir, history=history)
+        assert runner.season == 3
+        results += runner.run(5)
+        assert history.latest_season() == 5
+    assert results == expected_results
+    assert_same_state(runner.forest, expected)
+
+
+def test_old_checkpoints_are_removed(network, tmp_path):
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    SeasonRunner(network, checkpoint_dir=checkpoint_dir, checkpoint_every=1, keep_checkpoints=2).run(4)
+    assert sorted(os.listdir(checkpoint_dir)) == ["checkpoint.json", "season_000003.snap", "season_000004.snap"]
+    assert "history_run" not in read_checkpoint(checkpoint_dir)
@@ -0,0 +1,59 @@
+import struct
+
+import numpy as np
+import pytest
+
+from forest import Forest, INT_COLUMNS
+from generators import preferential_attachment
+from snapshot import load_snapshot, read_snapshot_season, save_snapshot
+
+
+@pytest.fixture
+def forest():
+    forest = preferential_attachment(2000, roots=4, rng=12)
+    forest.compute_tree_numbers()
+    forest.paid_point = np.arange(len(forest), dtype=np.int64) * 20790
+    forest.names = [*forest.names[:-1], "名前_unicode"]
+    forest.unresolved_parents = {1: "outside"}
+    return forest
+
+
+def test_snapshot_round_trips_the_forest(forest, tmp_path):
+    filename = str(tmp_path / "season.snap")
+    save_snapshot(forest, filename, season=7)
+    assert read_snapshot_season(filename) == 7
+    snapshot = load_snapshot(filename)
+    assert snapshot.season == 7
+    loaded = snapshot.forest
+    assert list(loaded.names) == list(forest.names)
+    assert loaded.unresolved_parents == {1: "outside"}
+    for column in ('parent', 'order', 'depth', 'active', *INT_COLUMNS):
+        assert np.array_equal(getattr(loaded, column), getattr(forest, column)), column
+
+    # mmapの列を書き換えても、ファイルは変わらない
+    loaded.paid_point[:] = 0
+    loaded.compute_tree_numbers()
+    assert np.array_equal(load_snapshot(filename).forest.paid_point, forest.paid_point)
+
+
+def test_version_1_snapshots_still_load(tmp_path):
+    forest = Forest.from_arrays(["a", "b"], [-1, 0])
+    filename = tmp_path / "v1.snap"
+    save_snapshot(forest, str(filename), season=1)
+    data = bytearray(filename.read_bytes())
+    # バージョン1は見つからない親の表がなく、ヘッダーのその場所は予約の0
+    struct.pack_into('<I', data, 8, 1)
+    filename.write_bytes(bytes(data))
+    assert list(load_snapshot(str(filename)).forest.names) == ["a", "b"]
+
+
+def test_broken_snapshots_are_rejected(forest, tmp_path):
+    filename = tmp_path / "season.snap"
+    save_snapshot(forest, str(filename), season=1)
+    data = filename.read_bytes()
+    filename.write_bytes(data[:-10])
+    with pytest.raises(ValueError, match="truncated"):
+        load_snapshot(str(filename))
+    filename.write_bytes(b"not a snapshot" + data)
+    with pytest.raises(ValueError, match="not a member snapshot"):
+        load_snapshot(str(filename))
@@ -0,0 +1,53 @@
+from dataclasses import replace
+
+import pytest
+
+from conftest import clone
+from ledger import build_bonus_ledger
+from plan import APP_DEFINITION
+from sweep import expand_grid, sweep_bonus_params
+
+
+@pytest.fixture
+def prepared(network):
+    network.update_title_ranks(APP_DEFINITION.compile())
+    network.calculate_binary_numbers()
+    return network
+
+
+def ledger_for(forest, riseup_params, product_free_params):
+    definition = replace(APP_DEFINITION, riseup_levels=riseup_params, product_free_amounts=product_free_params)
+    return build_bonus_ledger(clone(forest), definition.compile())
+
+
+def test_sweep_matches_the_ledger_of_each_plan(prepared):
+    riseup_grid = expand_grid({"level1": [2000, 3000], "level2": [4000], "level3": [5000, 5500], "level4": [2000]})
+    product_free_grid = expand_grid({"pf4": [10000, 12000], "pf8": [7000], "pf12": [4000], "pf16": [1000, 0]})
+    points = sweep_bonus_params(prepared, riseup_grid, product_free_grid)
+    assert len(points) == 16
+    for point in points:
+        ledger = ledger_for(prepared, point.riseup_params, point.product_free_params)
+        assert point.summary == ledger.summary
+        assert point.total_bonus == ledger.total_bonus
+
+
+def test_partial_grids_use_the_plan_values(prepared):
+    # expand_gridの例のように一部の定数だけを書いた点は、書いていない定数がplanの値になる
+    points = sweep_bonus_params(prepared, expand_grid({"level1": [2000, 3000], "level2": [4000]}), [{"pf4": 10000}])
+    assert [point.riseup_params for point in points] == [
+        {**APP_DEFINITION.riseup_levels, "level1": 2000, "level2": 4000},
+        {**APP_DEFINITION.riseup_levels, "level1": 3000, "level2": 4000},
+    ]
+    full = sweep_bonus_params(prepared, [points[1].riseup_params], [APP_DEFINITION.product_free_amounts])[0]
+    assert points[1].product_free_params == APP_DEFINITION.product_free_amounts
+    assert points[1].summary == full.summary
+    assert points[1].total_bonus == full.total_bonus
+
+
+@pytest.mark.parametrize('riseup_grid, product_free_grid', [
+    ([{"level5": 1000}], [{}]),
+    ([{}], [{"pf4": 10000, "pf6": 5000}]),
+])
+def test_unknown_keys_are_rejected(prepared, riseup_grid, product_free_grid):
+    with pytest.raises(ValueError, match="unknown"):
+        sweep_bonus_params(prepared, riseup_grid, product_free_grid)
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import baseline
+import kernels
+from conftest import random_nodes
+from forest import Forest
+from plan import RANK_CONDITIONS
+from tree_engine import update_title_ranks
+
+
+def test_rank_table_matches_the_conditions_at_every_threshold():
+    # 条件値の前後と、直１の人数0～12の全部の組み合わせ
+    sizes = sorted({0, 1, 25000} | {tree + d for tree, _, _ in RANK_CONDITIONS for d in (-1, 0, 1)})
+    grid = [(tree, children) for tree in sizes for children in range(13)]
+    tree_number = np.array([tree for tree, _ in grid], dtype=np.int64)
+    children_number = np.array([children for _, children in grid], dtype=np.int64)
+    expected = [baseline.rank_for(tree, children) for tree, children in grid]
+
+    assert kernels.title_ranks(tree_number, children_number, RANK_CONDITIONS).tolist() == expected
+    members = [SimpleNamespace(tree_number=tree, active_children_number=children, title_rank=7) for tree, children in grid]
+    update_title_ranks(members, RANK_CONDITIONS)
+    assert [member.title_rank for member in members] == expected
+    assert all(member.past_title_rank == 7 for member in members)
+
+
+def test_forest_title_ranks_match_update_title_rank():
+    nodes = random_nodes(3000, seed=7)
+    forest = Forest.from_nodes(nodes)
+    forest.title_rank = np.arange(len(forest)) % 5
+    forest.compute_tree_numbers()
+    forest.update_title_ranks()
+    assert forest.title_rank.tolist() == [baseline.title_rank(node) for node in nodes]
+    assert forest.past_title_rank.tolist() == (np.arange(len(forest)) % 5).tolist()
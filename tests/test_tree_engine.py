@@ -0,0 +1,37 @@
+from baseline import tree_number
+from conftest import random_nodes
+from node_class import Node
+from tree_engine import build_hierarchy, compute_tree_numbers
+
+
+def test_tree_numbers_match_calculate_tree_number():
+    nodes = random_nodes(2000, seed=1)
+    order = compute_tree_numbers(node for node in nodes if node.parent_node is None)
+    assert len(order) == len(nodes)
+    for node in nodes:
+        assert node.tree_number == tree_number(node)
+        assert node.active_children_number == sum(child.active for child in node.children)
+
+
+def test_deep_chain_does_not_recurse():
+    # 再帰ではsys.getrecursionlimit()を超える深さ
+    nodes = [Node(name="Node_0", position_number=1)]
+    for i in range(1, 5000):
+        nodes.append(Node(name=f"Node_{i}", position_number=1, parent_node=f"Node_{i - 1}"))
+    nodes[2500].active = False
+    compute_tree_numbers(build_hierarchy(nodes).roots)
+    assert nodes[0].tree_number == 2500
+    assert nodes[2499].tree_number == 1
+    assert nodes[2501].tree_number == 2499
+
+
+def test_build_hierarchy_reports_orphans_and_duplicates():
+    nodes = [Node(name="a", position_number=1), Node(name="b", position_number=1, parent_node="a"),
+             Node(name="c", position_number=1, parent_node="missing"), Node(name="b", position_number=1)]
+    hierarchy = build_hierarchy(nodes)
+    assert [node.name for node in hierarchy.roots] == ["a", "b"]
+    assert [node.name for node in hierarchy.orphans] == ["c"]
+    assert hierarchy.duplicates == ["b"]
+    # もう一度呼んでも直１は二重にならない
+    build_hierarchy(nodes)
+    assert [child.name for child in nodes[0].children] == ["b"]
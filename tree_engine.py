@@ -0,0 +1,122 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Iterable, List, Sequence, Tuple
+
+
+def compute_tree_numbers(root_nodes: Iterable) -> List: #ツリー番号とアクティブな直１の人数を一括で計算する関数。
+    """全ノードのtree_numberとactive_children_numberを後行順の1パスで計算し、訪問順のリストを返す"""
+    # 先行順（親が子より先）に並べる。再帰を使わないので深いツリーでも落ちない。
+    order = []
+    stack = list(root_nodes)
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(node.children)
+
+    # 逆順にたどれば、子のtree_numberは親より先に確定している。
+    for node in reversed(order):
+        count = 1  # 自分自身をカウント
+        active_children = 0
+        for child in node.children:
+            if child.active:
+                count += child.tree_number
+                active_children += 1
+        node.tree_number = count
+        node.active_children_number = active_children
+
+    return order
+
+
+def rollup_matching_bonus(nodes: List, base_bonuses: Sequence[int], rates: Sequence[int]) -> List[int]: #マッチングボーナスを全員分まとめて計算する関数。
+    """nodesと同じ並びの元のボーナスを、親・祖父母・曽祖父母…へrates（%）の分だけ足し上げる"""
+    # 親は直１のリストから逆引きする（名前ではなく実体で対応させる）
+    parent_of = {}
+    for node in nodes:
+        for child in node.children:
+            parent_of[id(child)] = node
+
+    matching = {id(node): 0 for node in nodes}
+    for node, base in zip(nodes, base_bonuses):
+        if not node.active or not base:
+            continue
+        ancestor = parent_of.get(id(node))
+        for rate in rates:
+            if ancestor is None:
+                break
+            matching[id(ancestor)] += base * rate
+            # 間の会員がアクティブでなければ、それより上には届かない
+            if not ancestor.active:
+                break
+            ancestor = parent_of.get(id(ancestor))
+
+    return [matching[id(node)] // 100 for node in nodes]
+
+
+@dataclass
+class Hierarchy:
+    """build_hierarchyの結果"""
+    roots: List #始祖会員（parent_nodeが空の会員）
+    orphans: List #parent_nodeの会員が見つからなかった会員
+    duplicates: List[str] #2回以上出てきた名前（後から出てきた会員が親として使われる）
+
+
+def build_hierarchy(nodes: List) -> Hierarchy: #全会員の親子関係を作る関数。全コピーのbuild_node_hierarchyから使う。
+    """ノードの親子関係をO(N)で構築し、始祖会員・親が見つからない会員・重複した名前を返す"""
+    node_dict = {}
+    duplicates = {}
+    for node in nodes:
+        if node.name in node_dict:
+            duplicates[node.name] = None
+        node_dict[node.name] = node
+
+    # すでにつながっている親子は実体（id）の組で覚えておく。
+    # dataclassの==は全フィールドとchildrenを再帰的に比べるので、`in children` は使わない。
+    linked = {(id(node), id(child)) for node in nodes for child in node.children}
+
+    roots = []
+    orphans = []
+    for node in nodes:
+        if not node.parent_node:
+            roots.append(node)
+            continue
+        parent = node_dict.get(node.parent_node)
+        if parent is None:
+            orphans.append(node)
+        elif (id(parent), id(node)) not in linked:
+            parent.children.append(node)
+            linked.add((id(parent), id(node)))
+
+    return Hierarchy(roots=roots, orphans=orphans, duplicates=list(duplicates))
+
+
+def compile_rank_table(rank_conditions: Sequence[Tuple[int, int, int]]) -> Tuple[List[int], List[int], List[List[int]]]: #タイトルの条件表を早見表にする関数。
+    """(tree_number条件, 直１条件, ランク)の表を、直１の人数×tree_numberの2次元の早見表に変換する
+
+    元のupdate_title_rankと同じく、条件を満たした行のうち表の後ろにある方のランクになる。
+    返り値の table[i][j] は、直１がchildren_thresholds[i-1]以上・tree_numberがtree_thresholds[j-1]以上のときのランク
+    （i=0, j=0は条件値未満）。
+    """
+    children_thresholds = sorted({children_req for _, children_req, _ in rank_conditions})
+    tree_thresholds = sorted({tree_req for tree_req, _, _ in rank_conditions})
+
+    def rank_for(tree_size: int, active_children: int) -> int:
+        title_rank = 0
+        for tree_req, children_req, rank in rank_conditions:
+            if tree_size >= tree_req and active_children >= children_req:
+                title_rank = rank
+        return title_rank
+
+    # 条件の判定結果は境目でしか変わらないので、境目の値だけ調べれば表が埋まる
+    children_values = [min(children_thresholds, default=0) - 1] + children_thresholds
+    tree_values = [min(tree_thresholds, default=0) - 1] + tree_thresholds
+    table = [[rank_for(tree_size, active_children) for tree_size in tree_values] for active_children in children_values]
+    return children_thresholds, tree_thresholds, table
+
+
+def update_title_ranks(nodes: List, rank_conditions: Sequence[Tuple[int, int, int]]) -> None: #全員のタイトルランクをまとめて更新する関数。
+    """保存済みのtree_numberとactive_children_numberから全員のタイトルランクを更新（past_title_rankへずらしてから）"""
+    children_thresholds, tree_thresholds, table = compile_rank_table(rank_conditions)
+    for node in nodes:
+        row = table[bisect_right(children_thresholds, node.active_children_number)]
+        node.past_title_rank = node.title_rank
+        node.title_rank = row[bisect_right(tree_thresholds, node.tree_number)]